@@ -0,0 +1,233 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import metrics
+from lance_registry import registry
+from embedding_backends import backend_metadata, table_metadata
+
+# Семантический кеш ответов на вопросы по лекциям. Для каждой таблицы фрагментов
+# рядом хранится таблица <table>_answer_cache: эмбеддинг вопроса, хеши фрагментов,
+# по которым построен ответ, и сам ответ. Ответ выдаётся, если новый вопрос близок
+# к сохранённому (косинусная близость не ниже ANSWER_CACHE_SIMILARITY) и все его
+# фрагменты есть в текущей версии таблицы. При смене версии таблицы (повторный ingest)
+# устаревшие записи удаляются; размер ограничен TTL и ANSWER_CACHE_MAX_ENTRIES.
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "20000"))
+ANSWER_CACHE_CANDIDATES = 3
+# Проверка размера выполняется раз в столько новых записей
+EVICT_EVERY = 100
+DELETE_BATCH = 500
+
+
+def cache_schema(dimensions):
+    import pyarrow as pa
+    return pa.schema([
+        pa.field("vector", pa.list_(pa.float32(), dimensions)),
+        pa.field("entry_id", pa.string()),
+        pa.field("query", pa.string()),
+        pa.field("answer", pa.string()),
+        pa.field("chunk_hashes", pa.list_(pa.string())),
+        pa.field("created_at", pa.float64()),
+    ], metadata=backend_metadata())
+
+
+def _read_columns(table, columns):
+    try:
+        data = table.to_lance().to_table(columns=columns)
+    except (AttributeError, ImportError):
+        data = table.to_arrow().select(columns)
+    return data.to_pylist()
+
+
+# Хеши фрагментов текущей версии таблицы; None - таблица без content_hash, кеш не используется
+def read_hashes(table):
+    if "content_hash" not in table.schema.names:
+        return None
+    return {row["content_hash"] for row in _read_columns(table, ["content_hash"])}
+
+
+class AnswerCache:
+    def __init__(self, db_path, source_table, similarity=ANSWER_CACHE_SIMILARITY,
+                 ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.source_table = source_table
+        self.table_name = f"{source_table}_answer_cache"
+        self.similarity = similarity
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._table = None
+        self._valid = None
+        self._valid_version = None
+        # Время последнего попадания по entry_id: в таблицу не пишется, чтобы чтения не создавали версий
+        self._last_used = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._maintenance = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "stored": 0, "evicted": 0}
+
+    def _open(self, dimensions=None):
+        if self._table is None:
+            db = registry.connection(self.db_path)
+            with self._lock:
+                if self._table is None:
+                    if self.table_name in db.table_names():
+                        table = db.open_table(self.table_name)
+                        if table_metadata(table) == backend_metadata():
+                            self._table = table
+                        elif dimensions:
+                            # Кеш построен другим бэкендом эмбеддингов - пересоздаём
+                            self._table = db.create_table(self.table_name, schema=cache_schema(dimensions), mode="overwrite")
+                    elif dimensions:
+                        # exist_ok: таблицу мог создать другой процесс бота
+                        self._table = db.create_table(self.table_name, schema=cache_schema(dimensions), exist_ok=True)
+        return self._table
+
+    def _valid_hashes(self, source):
+        version = source.version
+        if self._valid_version != version:
+            hashes = read_hashes(source)
+            with self._lock:
+                self._valid, self._valid_version = hashes, version
+        return self._valid
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def lookup(self, vector, source):
+        try:
+            valid = self._valid_hashes(source)
+            table = self._open()
+            if valid is None or table is None:
+                return None
+            with metrics.span("answer_cache"):
+                query = table.search(vector)
+                query = query.distance_type("cosine") if hasattr(query, "distance_type") else query.metric("cosine")
+                rows = query.limit(ANSWER_CACHE_CANDIDATES).to_list()
+        except Exception:
+            logger.exception("Ошибка поиска в кеше ответов %s", self.table_name)
+            return None
+        now = time.time()
+        for row in rows:
+            if 1.0 - row["_distance"] < self.similarity:
+                break
+            if row["created_at"] < now - self.ttl:
+                continue
+            if not valid.issuperset(row["chunk_hashes"]):
+                self._count("stale")
+                continue
+            self._last_used[row["entry_id"]] = now
+            self._count("hits")
+            return row["answer"]
+        self._count("misses")
+        return None
+
+    def store(self, query, vector, chunk_hashes, answer):
+        try:
+            table = self._open(len(vector))
+            table.add([{
+                "vector": vector,
+                "entry_id": uuid.uuid4().hex,
+                "query": query,
+                "answer": answer,
+                "chunk_hashes": list(chunk_hashes),
+                "created_at": time.time(),
+            }])
+        except Exception:
+            logger.exception("Не удалось сохранить ответ в кеш %s", self.table_name)
+            return
+        with self._lock:
+            self._stats["stored"] += 1
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0
+        if evict:
+            threading.Thread(target=self.evict, name="answer-cache-evict", daemon=True).start()
+
+    def _delete(self, entry_ids):
+        for i in range(0, len(entry_ids), DELETE_BATCH):
+            batch = entry_ids[i:i + DELETE_BATCH]
+            self._table.delete("entry_id IN (" + ", ".join(f"'{entry_id}'" for entry_id in batch) + ")")
+            for entry_id in batch:
+                self._last_used.pop(entry_id, None)
+        with self._lock:
+            self._stats["evicted"] += len(entry_ids)
+
+    # Удаление просроченных записей и давно не использованных сверх max_entries
+    def evict(self):
+        with self._maintenance:
+            try:
+                table = self._open()
+                if table is None:
+                    return
+                rows = _read_columns(table, ["entry_id", "created_at"])
+                cutoff = time.time() - self.ttl
+                expired = [r["entry_id"] for r in rows if r["created_at"] < cutoff]
+                alive = sorted(
+                    (r for r in rows if r["created_at"] >= cutoff),
+                    key=lambda r: self._last_used.get(r["entry_id"], r["created_at"])
+                )
+                excess = [r["entry_id"] for r in alive[:max(0, len(alive) - self.max_entries)]]
+                if expired or excess:
+                    self._delete(expired + excess)
+            except Exception:
+                logger.exception("Ошибка очистки кеша ответов %s", self.table_name)
+
+    # Вызывается при смене версии таблицы фрагментов: удаляет ответы по изменившимся фрагментам
+    def invalidate(self, source):
+        with self._maintenance:
+            try:
+                valid = self._valid_hashes(source)
+                table = self._open()
+                if table is None:
+                    return
+                if valid is None:
+                    stale = [r["entry_id"] for r in _read_columns(table, ["entry_id"])]
+                else:
+                    stale = [
+                        r["entry_id"] for r in _read_columns(table, ["entry_id", "chunk_hashes"])
+                        if not valid.issuperset(r["chunk_hashes"])
+                    ]
+                if stale:
+                    self._delete(stale)
+                    logger.info("Кеш ответов %s: удалено %d устаревших записей", self.table_name, len(stale))
+            except Exception:
+                logger.exception("Ошибка инвалидации кеша ответов %s", self.table_name)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class AnswerCaches:
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_path, source_table):
+        key = (db_path, source_table)
+        with self._lock:
+            cache = self._caches.get(key)
+            if cache is None:
+                cache = self._caches[key] = AnswerCache(db_path, source_table)
+            return cache
+
+    # Подписчик TableRegistry.on_version_change; инвалидация идёт в фоне, не задерживая запрос
+    def on_version_change(self, db_path, table_name, table, previous, version):
+        cache = self._caches.get((db_path, table_name))
+        if cache is not None:
+            threading.Thread(target=cache.invalidate, args=(table,), name="answer-cache-invalidate", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            caches = list(self._caches.values())
+        return {cache.table_name: cache.stats() for cache in caches}
+
+
+answer_caches = AnswerCaches()
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# Компромисс "recall / память / задержка" для компактных векторов на нашем корпусе.
+# Векторы pdf_docs загружаются в память; запросами служат случайные фрагменты корпуса
+# (сам фрагмент исключается из выдачи). Первый проход - полный перебор по усечённым
+# (Matryoshka) векторам в float32/float16, int8 или бинарном виде, затем top-k
+# переранжируется по полному вектору. recall@k считается относительно точного поиска.
+#   python bench_compact_vectors.py --dims 128 256 512 --rerank 4 8 16
+
+
+def load_vectors(db_path, table_name, limit, seed):
+    import lancedb
+    table = lancedb.connect(db_path).open_table(table_name)
+    column = table.to_lance().to_table(columns=["vector"]).column("vector").combine_chunks()
+    dim = column.type.list_size
+    vectors = column.flatten().to_numpy(zero_copy_only=False).astype(np.float32).reshape(-1, dim)
+    if limit and len(vectors) > limit:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), limit, replace=False)]
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def truncate(vectors, dims):
+    head = vectors[:, :dims]
+    return head / np.linalg.norm(head, axis=1, keepdims=True)
+
+
+# Первый проход: функция (запрос полной размерности) -> оценки по всему корпусу (больше - ближе)
+def make_scorer(vectors, dims, encoding):
+    small = truncate(vectors, dims)
+    if encoding == "float32":
+        return small.nbytes, lambda q: small @ truncate(q[None], dims)[0]
+    if encoding == "float16":
+        stored = small.astype(np.float16)
+        return stored.nbytes, lambda q: stored @ truncate(q[None], dims)[0].astype(np.float16)
+    if encoding == "int8":
+        scale = np.abs(small).max(axis=0) / 127.0 + 1e-12
+        stored = np.round(small / scale).astype(np.int8)
+        # Скалярное квантование по измерениям: масштаб переносится на запрос
+        return stored.nbytes + scale.nbytes, lambda q: stored @ (truncate(q[None], dims)[0] * scale).astype(np.float32)
+    if encoding == "binary":
+        stored = np.packbits(small > 0, axis=1)
+        popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+        def score(q):
+            bits = np.packbits(truncate(q[None], dims)[0] > 0)
+            return -popcount[np.bitwise_xor(stored, bits)].sum(axis=1)
+
+        return stored.nbytes, score
+    raise ValueError(encoding)
+
+
+def top_k(scores, k, exclude):
+    scores = scores.astype(np.float32)
+    scores[exclude] = -np.inf
+    candidates = np.argpartition(-scores, k)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def evaluate(vectors, queries, exact, dims, encoding, k, rerank):
+    memory, score = make_scorer(vectors, dims, encoding)
+    found, latencies = [], []
+    for query_id, true_ids in zip(queries, exact):
+        q = vectors[query_id]
+        started = time.perf_counter()
+        candidates = top_k(score(q), k * rerank, query_id)
+        if rerank > 1:
+            full = vectors[candidates] @ q
+            candidates = candidates[np.argsort(-full)[:k]]
+        latencies.append(time.perf_counter() - started)
+        found.append(len(set(candidates[:k].tolist()) & true_ids) / k)
+    return float(np.mean(found)), memory, np.array(latencies) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall и память компактных векторов на корпусе pdf_docs")
+    parser.add_argument("--db-path", default=os.getenv("LANCE_DB_PATH") or "lancedb")
+    parser.add_argument("--table", default="pdf_docs")
+    parser.add_argument("--limit", type=int, default=0, help="ограничить корпус случайной выборкой строк")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--encodings", nargs="+", default=["float32", "float16", "int8", "binary"],
+                        choices=["float32", "float16", "int8", "binary"])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[1, 4, 8],
+                        help="во сколько раз больше кандидатов переранжировать (1 - без переранжирования)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    vectors = load_vectors(args.db_path, args.table, args.limit, args.seed)
+    num_rows, full_dim = vectors.shape
+    if num_rows <= args.k * max(args.rerank):
+        print(f"В таблице {num_rows} строк - слишком мало для k={args.k}")
+        return 1
+    rng = np.random.default_rng(args.seed)
+    queries = rng.choice(num_rows, min(args.queries, num_rows), replace=False)
+    exact, exact_ms = [], []
+    for query_id in queries:
+        started = time.perf_counter()
+        exact.append(set(top_k(vectors @ vectors[query_id], args.k, query_id).tolist()))
+        exact_ms.append((time.perf_counter() - started) * 1000)
+
+    print(f"{num_rows} строк, dim={full_dim}, {len(queries)} запросов, k={args.k}")
+    print(f"Полные векторы float32: {vectors.nbytes / 2 ** 20:.1f} МБ, "
+          f"точный поиск p50={np.percentile(exact_ms, 50):.2f} мс p99={np.percentile(exact_ms, 99):.2f} мс")
+    print(f"\n{'dims':>5} {'формат':>8} {'rerank':>6} {'recall@k':>9} {'МБ':>8} {'байт/вектор':>12} "
+          f"{'p50, мс':>8} {'p99, мс':>8}")
+    for dims in args.dims:
+        if dims > full_dim:
+            continue
+        for encoding in args.encodings:
+            for rerank in args.rerank:
+                value, memory, ms = evaluate(vectors, queries, exact, dims, encoding, args.k, rerank)
+                print(f"{dims:>5} {encoding:>8} {rerank:>6} {value:>9.3f} {memory / 2 ** 20:>8.1f} "
+                      f"{memory / num_rows:>12.0f} {np.percentile(ms, 50):>8.2f} {np.percentile(ms, 99):>8.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
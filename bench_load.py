@@ -0,0 +1,404 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from itertools import count
+
+# Нагрузочный тест бота без сети: GPT-4, эмбеддинги, поиск видео, MySQL и Telegram
+# заменены заглушками с настраиваемой задержкой и долей ошибок, LanceDB - локальная
+# во временном каталоге. N студентов проходят сценарии (меню курса, объяснение темы,
+# тест, вопрос по лекциям, код-ревью); выводится пропускная способность и
+# p50/p95/p99 по шагам сценария.
+#   python bench_load.py --students 50 --duration 60 --llm-latency 2
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Latency:
+    def __init__(self, mean, failure_rate=0.0, rng=None):
+        self.mean = mean
+        self.failure_rate = failure_rate
+        self.rng = rng or random.Random()
+
+    def wait(self, what):
+        if self.mean:
+            time.sleep(self.rng.expovariate(1 / self.mean))
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            raise RuntimeError(f"Искусственная ошибка: {what}")
+
+
+COURSES = [
+    {'course_id': 1, 'course_name': 'Python для начинающих'},
+    {'course_id': 2, 'course_name': 'Python для продвинутых'},
+]
+TOPIC_NAMES = ["Переменные", "Циклы", "Функции", "Декораторы", "Генераторы",
+               "Классы", "Исключения", "Модули", "Итераторы", "Контекстные менеджеры"]
+QUIZ_QUESTIONS = 6
+
+
+# Заглушка MySQL: реализует именованные запросы db_pool поверх словарей
+class FakeDatabase:
+    def __init__(self, latency):
+        self.latency = latency
+        self.topics = [
+            {'topic_id': i + 1, 'course_id': 1 + i // 5, 'topic_name': name,
+             'position': i % 5 + 1, 'difficulty': 'beginner'}
+            for i, name in enumerate(TOPIC_NAMES)
+        ]
+        self.marks = {}
+        self.quizzes = {}
+        self.served = {}
+        self.quiz_ids = count(1)
+        self.lock = threading.Lock()
+
+    def fetch_all(self, name, params=()):
+        self.latency.wait("mysql")
+        with self.lock:
+            if name == "catalog_courses":
+                return [dict(c) for c in COURSES]
+            if name == "catalog_topics":
+                return [dict(t) for t in self.topics]
+            if name == "catalog_version":
+                return [{'courses': len(COURSES), 'courses_updated': 1, 'topics': len(self.topics), 'topics_updated': 1}]
+            if name == "topic_text":
+                return [{'text': f"Текст лекции по теме {params[0]}. " * 20}]
+            if name == "user_progress":
+                user_id, course_id = params
+                return [{'topic_id': t['topic_id'], 'topic_name': t['topic_name'],
+                         'mark': self.marks.get((user_id, t['topic_id']))}
+                        for t in self.topics if t['course_id'] == course_id]
+            if name == "quiz_count":
+                return [{'quizzes': sum(1 for q in self.quizzes.values() if q[0] == params[0])}]
+            if name == "quiz_pick":
+                user_id, topic_id = params
+                candidates = [(self.served.get((user_id, quiz_id)) is not None,
+                               self.served.get((user_id, quiz_id)) or 0, quiz_id)
+                              for quiz_id, (t, _) in self.quizzes.items() if t == topic_id]
+                if not candidates:
+                    return []
+                _, served_at, quiz_id = min(candidates)
+                return [{'quiz_id': quiz_id, 'questions': self.quizzes[quiz_id][1],
+                         'served_at': self.served.get((user_id, quiz_id))}]
+        raise KeyError(name)
+
+    def fetch_one(self, name, params=()):
+        rows = self.fetch_all(name, params)
+        return rows[0] if rows else None
+
+    def execute(self, name, params=()):
+        self.latency.wait("mysql")
+        with self.lock:
+            if name == "quiz_user_served":
+                self.served[params] = time.time()
+        return 1
+
+    def insert(self, name, params=()):
+        self.latency.wait("mysql")
+        with self.lock:
+            quiz_id = next(self.quiz_ids)
+            self.quizzes[quiz_id] = params
+            return quiz_id
+
+    # Многострочные INSERT из write_behind
+    def execute_sql(self, sql, params=()):
+        self.latency.wait("mysql")
+        if "user_has_topic" in sql:
+            with self.lock:
+                for i in range(0, len(params), 3):
+                    user_id, topic_id, mark = params[i:i + 3]
+                    self.marks[(user_id, topic_id)] = mark
+        return len(params)
+
+
+# Заглушка LLM: ответ зависит от системного промпта, поддерживает потоковый режим
+class FakeLLM:
+    def __init__(self, latency, token_delay):
+        self.latency = latency
+        self.token_delay = token_delay
+
+    def answer(self, messages):
+        system = messages[0].content
+        if "Создайте тест" in system:
+            return "\n".join(
+                f"Вопрос {i + 1} | Вариант А | Вариант Б | Вариант В | Вариант Г | Вариант А"
+                for i in range(QUIZ_QUESTIONS)
+            )
+        return "Ответ преподавателя. " * 60
+
+    def generate(self, messages):
+        self.latency.wait("llm")
+        return self.answer(messages)
+
+    def stream(self, messages):
+        self.latency.wait("llm")
+        words = self.answer(messages).split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.token_delay)
+            yield word + (" " if i < len(words) - 1 else "")
+
+
+# Подменяется только модель (get_llm): промпт, run_chain, регулятор запросов,
+# учёт токенов и потоковая передача ответа работают как в боте
+def fake_chat_model(llm):
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    class FakeChatModel(BaseChatModel):
+        @property
+        def _llm_type(self):
+            return "bench-fake"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            message = AIMessage(content=llm.generate(messages))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            for piece in llm.stream(messages):
+                yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    return FakeChatModel()
+
+
+class FakeTelegram:
+    def __init__(self, latency):
+        self.latency = latency
+        self.message_ids = count(1)
+        self.calls = 0
+
+    def make_request(self, token, method_name, method='get', params=None, files=None):
+        self.latency.wait("telegram")
+        self.calls += 1
+        params = params or {}
+        if method_name in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            return {
+                'message_id': int(params.get("message_id") or next(self.message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get("text", ""),
+            }
+        return True
+
+
+def fake_embeddings(latency, dim):
+    import numpy as np
+
+    def create_embeddings(texts):
+        import metrics
+        with metrics.span("embedding"):
+            latency.wait("embedding")
+        vectors = []
+        for text in texts:
+            rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+            v = rng.standard_normal(dim).astype("float32")
+            vectors.append((v / np.linalg.norm(v)).tolist())
+        return vectors
+
+    return create_embeddings
+
+
+def seed_lancedb(create_embeddings, num_chunks):
+    import lancedb
+    from ingest import chunk_hash
+    rows = []
+    for i in range(num_chunks):
+        topic = TOPIC_NAMES[i % len(TOPIC_NAMES)]
+        text = f"{topic}: фрагмент лекции номер {i}. Пример кода и пояснения к теме {topic.lower()}."
+        rows.append({"text": text, "source": "bench.pdf", "page": i // 10 + 1,
+                     "chunk_id": f"bench.pdf:{i}", "content_hash": chunk_hash("bench.pdf", text)})
+    for start in range(0, len(rows), 256):
+        batch = rows[start:start + 256]
+        for row, vector in zip(batch, create_embeddings([r["text"] for r in batch])):
+            row["vector"] = vector
+    lancedb.connect("lancedb").create_table("pdf_docs", data=rows, mode="overwrite")
+
+
+# Сценарии: список (шаг, текст сообщения); текст может зависеть от выбранного курса и темы
+def scenario(rng):
+    course = rng.choice(COURSES)
+    topics = [t for i, t in enumerate(TOPIC_NAMES) if 1 + i // 5 == course['course_id']]
+    topic = rng.choice(topics)
+    course_menu = [
+        ("start", "/start"),
+        ("courses_menu", "Прохождение курсов"),
+        ("course_selected", f"Курс: {course['course_name']} (ID: {course['course_id']})"),
+    ]
+    scripts = {
+        "course_graph": course_menu + [("show_course_graph", "Граф курса")],
+        "explain_topic": course_menu + [
+            ("explain_topic_menu", "Объяснить тему"),
+            ("process_topic_explanation", topic),
+            ("handle_topic_questions", f"Зачем нужны {topic.lower()}?"),
+            ("exit_topic", "Выход"),
+        ],
+        "quiz": course_menu + [
+            ("take_test_menu", "Пройти тест"),
+            ("start_test", topic),
+        ] + [("process_test_answer", f"{rng.randint(1, 4)}. Вариант А")] * QUIZ_QUESTIONS + [
+            ("exit_topic", "Выход"),
+        ],
+        "rag_question": [
+            ("start", "/start"),
+            ("question_answering", "Ответы на вопросы"),
+            ("process_question", f"Что такое {topic.lower()}?"),
+        ],
+        "code_review": [
+            ("start", "/start"),
+            ("code_review_menu", "Код-ревью"),
+            ("get_code_for_review", "Напишите функцию суммы списка"),
+            ("process_code_review", "def total(xs):\n    s = 0\n    for x in xs:\n        s += x\n    return s"),
+        ],
+    }
+    name = rng.choice(sorted(scripts))
+    return name, scripts[name]
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн нагрузочный тест бота")
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="длительность, с")
+    parser.add_argument("--think-time", type=float, default=0.5, help="пауза студента между сообщениями, с")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-token-delay", type=float, default=0.005)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--chat-rpm", type=int, default=500, help="лимит запросов к GPT-4 в минуту для rate_governor")
+    parser.add_argument("--chat-tpm", type=int, default=30000, help="лимит токенов GPT-4 в минуту для rate_governor")
+    parser.add_argument("--embedding-latency", type=float, default=0.2)
+    parser.add_argument("--search-latency", type=float, default=0.5)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-failure-rate", type=float, default=0.0)
+    parser.add_argument("--chunks", type=int, default=2000, help="фрагментов в pdf_docs")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="edubot-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "0:load-test",
+        "SESSION_BACKEND": "memory",
+        "BOT_WORKERS": str(args.workers),
+        "STREAM_EDIT_INTERVAL": "0.5",
+        "OPENAI_API_KEY": "offline",
+        "OPENAI_CHAT_RPM": str(args.chat_rpm),
+        "OPENAI_CHAT_TPM": str(args.chat_tpm),
+    })
+
+    # Bot API подменяется до импорта main, чтобы метрики обернули заглушку
+    from telebot import apihelper, types
+    telegram = FakeTelegram(Latency(args.telegram_latency, args.telegram_failure_rate, random.Random(rng.random())))
+    apihelper._make_request = telegram.make_request
+
+    import db_pool
+    database = FakeDatabase(Latency(args.db_latency, rng=random.Random(rng.random())))
+    for name in ("fetch_all", "fetch_one", "execute", "insert", "execute_sql"):
+        setattr(db_pool, name, getattr(database, name))
+
+    import education_bot
+    llm = FakeLLM(Latency(args.llm_latency, args.llm_failure_rate, random.Random(rng.random())), args.llm_token_delay)
+    chat_model = fake_chat_model(llm)
+    education_bot.get_llm = lambda: chat_model
+    education_bot.summarize_dialog = lambda summary, turns: "резюме диалога"
+    education_bot.create_embeddings = fake_embeddings(
+        Latency(args.embedding_latency, rng=random.Random(rng.random())), education_bot.get_embedding_backend().dimensions
+    )
+    search_latency = Latency(args.search_latency, rng=random.Random(rng.random()))
+
+    def find_videos(topic):
+        search_latency.wait("search")
+        return "https://www.youtube.com/watch?v=offline"
+
+    education_bot.find_videos = find_videos
+    seed_lancedb(education_bot.create_embeddings, args.chunks)
+
+    import main as bot_main
+    bot_main.find_videos = find_videos
+
+    samples = {}
+    errors = {}
+    lock = threading.Lock()
+    update_ids = count(1)
+    message_ids = count(1)
+    deadline = time.monotonic() + args.duration
+
+    def send(user_id, text):
+        update = types.Update.de_json({
+            'update_id': next(update_ids),
+            'message': {
+                'message_id': next(message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Студент', 'username': f"s{user_id}"},
+                'text': text,
+            },
+        })
+        done = threading.Event()
+        failed = []
+
+        def process():
+            try:
+                # Обработка в том же пуле и с тем же порядком, что и в боте
+                bot_main.telebot.TeleBot.process_new_updates(bot_main.bot, [update])
+            except Exception as e:
+                failed.append(e)
+            finally:
+                done.set()
+
+        started = time.perf_counter()
+        bot_main.update_executor.submit(user_id, process)
+        done.wait()
+        return time.perf_counter() - started, bool(failed)
+
+    def student(user_id):
+        student_rng = random.Random(user_id)
+        while time.monotonic() < deadline:
+            _, steps = scenario(student_rng)
+            for step, text in steps:
+                elapsed, failed = send(user_id, text)
+                with lock:
+                    samples.setdefault(step, []).append(elapsed)
+                    if failed:
+                        errors[step] = errors.get(step, 0) + 1
+                time.sleep(student_rng.uniform(0, 2 * args.think_time))
+                if time.monotonic() >= deadline:
+                    break
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=student, args=(100000 + i,)) for i in range(args.students)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+    bot_main.write_queue.close()
+
+    total = sum(len(s) for s in samples.values())
+    print(f"Студентов: {args.students}, воркеров: {args.workers}, длительность: {wall:.1f} с")
+    print(f"Обработано сообщений: {total} ({total / wall:.1f}/с), вызовов Bot API: {telegram.calls}")
+    print(f"\n{'шаг':<28} {'кол-во':>7} {'ошибки':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+    for step in sorted(samples):
+        values = samples[step]
+        print(f"{step:<28} {len(values):>7} {errors.get(step, 0):>7} "
+              f"{percentile(values, 50) * 1000:>9.0f} {percentile(values, 95) * 1000:>9.0f} "
+              f"{percentile(values, 99) * 1000:>9.0f}")
+    print(f"\nОчередь обработки: {bot_main.update_executor.metrics()}")
+    print(f"Регулятор GPT-4: {education_bot.chat_governor.stats()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
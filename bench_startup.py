@@ -0,0 +1,76 @@
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+# Бенчмарк времени запуска бота на основе python -X importtime.
+# Завершается с кодом 1, если импорт main превысил бюджет или при запуске
+# загрузились тяжёлые зависимости, которые должны подключаться лениво.
+#   python bench_startup.py --budget-ms 800
+
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "800"))
+LAZY_MODULES = ["langchain", "langchain_core", "langchain_openai", "langchain_community",
+                "openai", "lancedb", "matplotlib", "networkx", "mysql", "tenacity",
+                "numpy", "sentence_transformers"]
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module, runs):
+    env = dict(os.environ)
+    # Токен нужен только для создания TeleBot, к API запросы не выполняются
+    env.setdefault("TELEGRAM_BOT_TOKEN", "0:startup-benchmark")
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            env=env, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            raise SystemExit(f"Не удалось импортировать {module}")
+        imports = {}
+        for line in completed.stderr.splitlines():
+            match = IMPORT_LINE.match(line)
+            if match:
+                imports[match.group(4)] = (int(match.group(1)), int(match.group(2)), len(match.group(3)))
+        results.append(imports)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка времени запуска бота")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    results = measure(args.module, args.runs)
+    totals = sorted(r[args.module][1] / 1000 for r in results)
+    median = totals[len(totals) // 2]
+    last = results[-1]
+
+    print(f"Импорт {args.module}: медиана {median:.0f} мс (минимум {totals[0]:.0f}, максимум {totals[-1]:.0f}), "
+          f"бюджет {args.budget_ms:.0f} мс")
+    print("\nСамые тяжёлые пакеты верхнего уровня (cumulative):")
+    top_level = [(name, cumulative) for name, (_, cumulative, indent) in last.items()
+                 if indent == 1 and name != args.module]
+    for name, cumulative in sorted(top_level, key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} мс  {name}")
+
+    eager = sorted({name.split(".")[0] for name in last} & set(LAZY_MODULES))
+    failed = False
+    if eager:
+        print(f"\nПри запуске загружены модули, которые должны импортироваться лениво: {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"\nВремя запуска {median:.0f} мс превышает бюджет {args.budget_ms:.0f} мс")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pyarrow as pa
+import lancedb
+import vector_index
+
+# Бенчмарк ANN-индекса: recall@k относительно точного поиска и задержки p50/p99
+# на синтетических корпусах. Пример:
+#   python bench_vector_index.py --sizes 10000 100000 1000000 --nprobes 10 20 50 --refine 0 10
+
+
+def synthetic_batches(num_rows, dim, batch_size, num_clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dim), dtype=np.float32)
+    for start in range(0, num_rows, batch_size):
+        count = min(batch_size, num_rows - start)
+        labels = rng.integers(0, num_clusters, count)
+        vectors = centers[labels] + 0.5 * rng.standard_normal((count, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield pa.table({
+            "id": pa.array(np.arange(start, start + count, dtype=np.int64)),
+            "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel()), dim),
+        })
+
+
+def make_queries(num_queries, dim, num_clusters, seed):
+    # Запросы из того же распределения, но не совпадающие с документами
+    batch = next(synthetic_batches(num_queries, dim, num_queries, num_clusters, seed + 1))
+    return batch.column("vector").to_numpy(zero_copy_only=False).reshape(num_queries, dim)
+
+
+def run_queries(table, queries, k, configure):
+    ids, latencies = [], []
+    for q in queries:
+        started = time.perf_counter()
+        result = configure(table.search(q)).limit(k).select(["id"]).to_arrow()
+        latencies.append(time.perf_counter() - started)
+        ids.append(set(result.column("id").to_pylist()))
+    return ids, np.array(latencies) * 1000
+
+
+def recall(found, exact):
+    return float(np.mean([len(f & e) / len(e) for f, e in zip(found, exact) if e]))
+
+
+def bench_size(db, num_rows, args):
+    name = f"bench_{num_rows}"
+    batches = synthetic_batches(num_rows, args.dim, args.batch_size, args.clusters, args.seed)
+    table = db.create_table(name, data=next(batches), mode="overwrite")
+    for batch in batches:
+        table.add(batch)
+    queries = make_queries(args.queries, args.dim, args.clusters, args.seed)
+
+    exact, exact_ms = run_queries(table, queries, args.k, lambda q: q.metric(vector_index.METRIC))
+    print(f"\n{num_rows} строк, dim={args.dim}: точный поиск p50={np.percentile(exact_ms, 50):.1f} мс "
+          f"p99={np.percentile(exact_ms, 99):.1f} мс")
+
+    started = time.perf_counter()
+    vector_index.build_index(table, index_type=args.index_type)
+    print(f"Индекс {args.index_type} построен за {time.perf_counter() - started:.1f} с")
+
+    print(f"{'nprobes':>8} {'refine':>7} {'recall@' + str(args.k):>10} {'p50, мс':>9} {'p99, мс':>9}")
+    for nprobes in args.nprobes:
+        for refine in args.refine:
+            found, ms = run_queries(
+                table, queries, args.k,
+                lambda q: vector_index.apply_search_params(q, nprobes=nprobes, refine_factor=refine)
+            )
+            print(f"{nprobes:>8} {refine:>7} {recall(found, exact):>10.3f} "
+                  f"{np.percentile(ms, 50):>9.1f} {np.percentile(ms, 99):>9.1f}")
+    db.drop_table(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк ANN-индекса LanceDB")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--index-type", default=vector_index.INDEX_TYPE)
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[10, 20, 50])
+    parser.add_argument("--refine", type=int, nargs="+", default=[0, 10])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db-path", default=None, help="по умолчанию временный каталог")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = lancedb.connect(args.db_path or tmp)
+        for num_rows in args.sizes:
+            bench_size(db, num_rows, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
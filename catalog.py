@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+import db_pool
+
+# Кешированный каталог курсов и тем.
+# Каталог загружается целиком без длинной колонки text (она подгружается лениво)
+# и перечитывается только если после истечения TTL изменилась версия таблиц
+# (число строк и максимальный updated_at курсов и тем).
+
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "60"))
+
+
+class CatalogSnapshot:
+    def __init__(self, courses, topics, version):
+        self.version = version
+        self.courses = courses
+        self.courses_by_id = {c['course_id']: c for c in courses}
+        self.topics = topics
+        self.topics_by_id = {t['topic_id']: t for t in topics}
+        self.topics_by_course = {}
+        self.topics_by_name = {}
+        self.topics_by_course_and_name = {}
+        for topic in sorted(topics, key=lambda t: (t['course_id'], t['position'])):
+            self.topics_by_course.setdefault(topic['course_id'], []).append(topic)
+            # При совпадении названий в разных курсах побеждает первый курс, как и раньше
+            self.topics_by_name.setdefault(topic['topic_name'], topic)
+            self.topics_by_course_and_name[(topic['course_id'], topic['topic_name'])] = topic
+
+
+class Catalog:
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def _load(self, version):
+        courses = db_pool.fetch_all("catalog_courses")
+        topics = db_pool.fetch_all("catalog_topics")
+        return CatalogSnapshot(courses, topics, version)
+
+    def _version(self):
+        row = db_pool.fetch_one("catalog_version")
+        return tuple(row.values())
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.ttl:
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.ttl:
+                return self._snapshot
+            version = self._version()
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self._load(version)
+                self._texts = {}
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+
+    def courses(self):
+        return list(self.snapshot().courses)
+
+    def course(self, course_id):
+        return self.snapshot().courses_by_id.get(course_id)
+
+    def topics(self):
+        return list(self.snapshot().topics)
+
+    def course_topics(self, course_id):
+        return list(self.snapshot().topics_by_course.get(course_id, []))
+
+    def find_topic(self, topic_name, course_id=None):
+        snapshot = self.snapshot()
+        if course_id is not None:
+            topic = snapshot.topics_by_course_and_name.get((course_id, topic_name))
+            if topic is not None:
+                return topic
+        return snapshot.topics_by_name.get(topic_name)
+
+    def has_topic(self, topic_name):
+        return topic_name in self.snapshot().topics_by_name
+
+    # Текст темы загружается при первом обращении и кешируется до смены версии
+    def topic_text(self, topic_id):
+        snapshot = self.snapshot()
+        with self._lock:
+            text = self._texts.get(topic_id)
+        if text is None:
+            row = db_pool.fetch_one("topic_text", (topic_id,))
+            if row is None:
+                return None
+            text = row['text']
+            with self._lock:
+                # Каталог мог перезагрузиться, пока шёл запрос: текст старой версии не сохраняем
+                if self._snapshot is snapshot:
+                    self._texts[topic_id] = text
+        return text
+
+
+catalog = Catalog()
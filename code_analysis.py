@@ -0,0 +1,285 @@
+import os
+import re
+import ast
+import io
+import hashlib
+import builtins
+import tokenize
+from embedding_cache import LRUCache
+from context_builder import count_tokens, truncate_tokens
+
+# Локальный статический анализ решений перед код-ревью: синтаксические ошибки
+# возвращаются сразу без LLM, метрики (сложность, вложенность), неиспользуемые имена
+# и типичные ошибки начинающих передаются в промпт, большой код сжимается.
+# Результаты кешируются по хешу кода.
+
+CODE_REVIEW_CODE_TOKENS = int(os.getenv("CODE_REVIEW_CODE_TOKENS", "2000"))
+CODE_ANALYSIS_CACHE_SIZE = int(os.getenv("CODE_ANALYSIS_CACHE_SIZE", "1024"))
+CODE_ANALYSIS_CACHE_TTL = float(os.getenv("CODE_ANALYSIS_CACHE_TTL", str(24 * 3600)))
+COMPLEXITY_LIMIT = 10
+FUNCTION_LINES_LIMIT = 50
+NESTING_LIMIT = 4
+
+analysis_cache = LRUCache(max_items=CODE_ANALYSIS_CACHE_SIZE, ttl=CODE_ANALYSIS_CACHE_TTL)
+
+_FENCE = re.compile(r"^\s*```[\w+-]*\s*\n(.*?)\n\s*```\s*$", re.S)
+# Признаки кода не на Python: его синтаксическую ошибку не показываем, а отдаём ревью LLM
+_OTHER_LANGUAGE = re.compile(
+    r"^\s*(#include\b|using namespace\b|(public|private|protected|static)\s+\w+|function\s+\w+\s*\(|"
+    r"(var|let|const)\s+\w+\s*=|console\.log\(|System\.out\.|fn\s+\w+\s*\()|[;{]\s*$",
+    re.M
+)
+_BUILTIN_NAMES = {name for name in dir(builtins) if not name.startswith("_")}
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+def strip_fences(code):
+    match = _FENCE.match(code)
+    return match.group(1) if match else code
+
+
+def looks_like_python(code):
+    return len(_OTHER_LANGUAGE.findall(code)) < 2
+
+
+class CodeReport:
+    def __init__(self, code):
+        self.code = code
+        self.syntax_error = None
+        self.metrics = {}
+        self.issues = []
+        self.condensed = code
+
+    def add(self, node, text):
+        self.issues.append((getattr(node, "lineno", 0), text))
+
+    def syntax_error_message(self):
+        error = self.syntax_error
+        lines = [f"Код не запускается: синтаксическая ошибка в строке {error.lineno}: {error.msg}"]
+        if error.text:
+            source_line = error.text.rstrip("\n")
+            lines.append(f"\n{source_line}")
+            if error.offset:
+                # Позиция ошибки с учётом отступа исходной строки
+                lines.append(" " * (error.offset - 1) + "^")
+        lines.append("\nИсправьте ошибку и отправьте код снова - тогда я проведу полное ревью.")
+        return "\n".join(lines)
+
+    # Текст для промпта: метрики и найденные замечания
+    def summary(self):
+        parts = [", ".join(f"{name}: {value}" for name, value in self.metrics.items())]
+        for line, text in sorted(self.issues):
+            parts.append(f"- строка {line}: {text}" if line else f"- {text}")
+        if self.condensed is not self.code:
+            parts.append("Код большой и передан в сокращённом виде: комментарии удалены, "
+                         "повторяющиеся и простые функции свёрнуты.")
+        return "\n".join(parts)
+
+
+def complexity(node):
+    score = 1
+    for child in ast.walk(node):
+        if isinstance(child, (ast.If, ast.For, ast.AsyncFor, ast.While, ast.IfExp, ast.ExceptHandler, ast.Assert)):
+            score += 1
+        elif isinstance(child, ast.BoolOp):
+            score += len(child.values) - 1
+        elif isinstance(child, ast.comprehension):
+            score += 1 + len(child.ifs)
+        elif isinstance(child, getattr(ast, "match_case", ())):
+            score += 1
+    return score
+
+
+def nesting_depth(node, depth=0):
+    blocks = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.With, ast.AsyncWith, ast.Try)
+    deepest = depth
+    for child in ast.iter_child_nodes(node):
+        child_depth = depth + 1 if isinstance(child, blocks) else depth
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            child_depth = 0
+        deepest = max(deepest, nesting_depth(child, child_depth))
+    return deepest
+
+
+def _functions(tree):
+    return [n for n in ast.walk(tree) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+
+
+def _loaded_names(node):
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load):
+            names.add(child.id)
+        elif isinstance(child, ast.Attribute):
+            # a.b.c: используется имя a
+            root = child
+            while isinstance(root, ast.Attribute):
+                root = root.value
+            if isinstance(root, ast.Name):
+                names.add(root.id)
+    return names
+
+
+def _check_unused(tree, report):
+    loaded = _loaded_names(tree)
+    exported = set()
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "__all__" for t in node.targets):
+            exported |= {e.value for e in getattr(node.value, "elts", []) if isinstance(e, ast.Constant)}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                name = (alias.asname or alias.name).split(".")[0]
+                if name != "*" and name not in loaded and name not in exported:
+                    report.add(node, f"импорт {name} не используется")
+    for function in _functions(tree):
+        declared = set()
+        for child in ast.walk(function):
+            if isinstance(child, (ast.Global, ast.Nonlocal)):
+                declared |= set(child.names)
+        function_loaded = _loaded_names(function)
+        stored = {}
+        for child in ast.walk(function):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                stored.setdefault(child.id, child)
+        for name, node in stored.items():
+            if name not in function_loaded and name not in declared and not name.startswith("_"):
+                report.add(node, f"переменная {name} в функции {function.name} присваивается, но не используется")
+
+
+def _is_constant(node, values):
+    return isinstance(node, ast.Constant) and any(node.value is v for v in values)
+
+
+def _check_patterns(tree, report):
+    with_items = {id(item.context_expr) for n in ast.walk(tree) if isinstance(n, (ast.With, ast.AsyncWith)) for item in n.items}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ExceptHandler):
+            if node.type is None:
+                report.add(node, "голый except: перехватывает даже KeyboardInterrupt и SystemExit")
+            if len(node.body) == 1 and isinstance(node.body[0], ast.Pass):
+                report.add(node, "исключение молча игнорируется (except ...: pass)")
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for default in node.args.defaults + [d for d in node.args.kw_defaults if d is not None]:
+                if isinstance(default, (ast.List, ast.Dict, ast.Set)):
+                    report.add(node, f"изменяемое значение по умолчанию в аргументах {node.name}")
+            for arg in node.args.args + node.args.kwonlyargs:
+                if arg.arg in _BUILTIN_NAMES:
+                    report.add(node, f"аргумент {arg.arg} перекрывает встроенное имя")
+            length = (node.end_lineno or node.lineno) - node.lineno + 1
+            if length > FUNCTION_LINES_LIMIT:
+                report.add(node, f"функция {node.name} слишком длинная ({length} строк)")
+            score = complexity(node)
+            if score > COMPLEXITY_LIMIT:
+                report.add(node, f"высокая цикломатическая сложность {node.name}: {score}")
+        elif isinstance(node, ast.Compare):
+            for op, right in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.Eq, ast.NotEq)) and _is_constant(right, (None,)):
+                    report.add(node, "сравнение с None через ==/!=, нужно is / is not")
+                elif isinstance(op, (ast.Eq, ast.NotEq)) and _is_constant(right, (True, False)):
+                    report.add(node, "сравнение с True/False, достаточно самого условия")
+            if (isinstance(node.left, ast.Call) and isinstance(node.left.func, ast.Name)
+                    and node.left.func.id == "type"):
+                report.add(node, "проверка типа через type(...) ==, лучше isinstance")
+        elif isinstance(node, ast.For):
+            iterator = node.iter
+            if (isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Name) and iterator.func.id == "range"
+                    and len(iterator.args) == 1 and isinstance(iterator.args[0], ast.Call)
+                    and isinstance(iterator.args[0].func, ast.Name) and iterator.args[0].func.id == "len"):
+                report.add(node, "for i in range(len(...)): лучше перебирать элементы или enumerate")
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            if node.func.id in ("eval", "exec"):
+                report.add(node, f"использование {node.func.id}")
+            elif node.func.id == "open" and id(node) not in with_items:
+                report.add(node, "файл открыт без with и может остаться незакрытым")
+        elif isinstance(node, ast.Global):
+            report.add(node, f"global {', '.join(node.names)}: лучше передавать значения через аргументы")
+        elif isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+            report.add(node, f"from {node.module} import *")
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store) and node.id in _BUILTIN_NAMES:
+            report.add(node, f"переменная {node.id} перекрывает встроенное имя")
+
+
+def _code_lines(code):
+    lines = set()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type not in (tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT,
+                                  tokenize.DEDENT, tokenize.ENDMARKER):
+                lines.update(range(token.start[0], token.end[0] + 1))
+    except (tokenize.TokenError, SyntaxError):
+        return len([line for line in code.splitlines() if line.strip()])
+    return len(lines)
+
+
+def _strip_docstring(node):
+    body = getattr(node, "body", None)
+    if (isinstance(body, list) and body and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str)):
+        node.body = body[1:] or [ast.Pass()]
+
+
+# Сокращённый код для промпта: без комментариев и docstring, функции с одинаковым телом
+# оставлены в одном экземпляре, при нехватке бюджета простые функции свёрнуты до сигнатуры
+def condense(tree, budget=CODE_REVIEW_CODE_TOKENS):
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            _strip_docstring(node)
+    first = {}
+    copies = {}
+    for function in _functions(tree):
+        key = ast.dump(ast.Module(body=function.body, type_ignores=[]))
+        if key in first:
+            copies.setdefault(first[key], []).append(function)
+        else:
+            first[key] = function
+    removed = {id(f) for functions in copies.values() for f in functions}
+    for node in ast.walk(tree):
+        if isinstance(getattr(node, "body", None), list):
+            node.body = [child for child in node.body if id(child) not in removed] or [ast.Pass()]
+    for function, duplicates in copies.items():
+        names = ", ".join(f.name for f in duplicates[:10])
+        if len(duplicates) > 10:
+            names += f" и ещё {len(duplicates) - 10}"
+        function.body.insert(0, ast.Expr(ast.Constant(f"такое же тело у функций: {names}")))
+    text = ast.unparse(tree)
+    for function in sorted(_functions(tree), key=complexity):
+        if count_tokens(text) <= budget:
+            break
+        function.body = [ast.Expr(ast.Constant(...))]
+        text = ast.unparse(tree)
+    return truncate_tokens(text, budget)
+
+
+def analyze(code):
+    key = code_hash(code)
+    report = analysis_cache.get(key)
+    if report is not None:
+        return report
+    report = CodeReport(code)
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        report.syntax_error = e
+        analysis_cache.set(key, report)
+        return report
+    functions = _functions(tree)
+    report.metrics = {
+        "строк кода": _code_lines(code),
+        "функций": len(functions),
+        "классов": sum(1 for n in ast.walk(tree) if isinstance(n, ast.ClassDef)),
+        "макс. сложность": max((complexity(f) for f in functions), default=complexity(tree)),
+        "макс. вложенность": nesting_depth(tree),
+    }
+    if report.metrics["макс. вложенность"] > NESTING_LIMIT:
+        report.add(None, f"глубокая вложенность блоков ({report.metrics['макс. вложенность']})")
+    _check_unused(tree, report)
+    _check_patterns(tree, report)
+    report.issues = sorted(set(report.issues))
+    if count_tokens(code) > CODE_REVIEW_CODE_TOKENS:
+        report.condensed = condense(tree)
+    analysis_cache.set(key, report)
+    return report
@@ -0,0 +1,132 @@
+import os
+import sys
+import math
+import argparse
+from vector_index import apply_search_params
+from embedding_backends import BACKENDS, table_metadata, describe
+
+# Компактные векторы для первого прохода поиска: эмбеддинг text-embedding-3 усекается
+# до первых COMPACT_VECTOR_DIMENSIONS координат (Matryoshka), нормируется заново и
+# хранится в float16 в колонке vector_small (256 измерений - 512 байт вместо 6 КБ).
+# Кандидаты ищутся по vector_small, затем COMPACT_RERANK_FACTOR * limit лучших
+# переранжируются по полному вектору.
+
+COMPACT_DIMENSIONS = int(os.getenv("COMPACT_VECTOR_DIMENSIONS", "256"))  # 0 - не использовать
+COMPACT_RERANK_FACTOR = int(os.getenv("COMPACT_RERANK_FACTOR", "8"))
+COMPACT_COLUMN = "vector_small"
+FULL_COLUMN = "vector"
+
+
+def compact_field(dimensions=COMPACT_DIMENSIONS):
+    import pyarrow as pa
+    return pa.field(COMPACT_COLUMN, pa.list_(pa.float16(), dimensions))
+
+
+def truncate(vector, dimensions=COMPACT_DIMENSIONS):
+    head = list(vector[:dimensions])
+    norm = math.sqrt(sum(x * x for x in head)) or 1.0
+    return [x / norm for x in head]
+
+
+# Усечённый префикс - тоже эмбеддинг только у Matryoshka-моделей (text-embedding-3);
+# векторы остальных бэкендов после усечения бессмысленны
+def supports_compact(matryoshka, dimensions):
+    return matryoshka and 0 < COMPACT_DIMENSIONS < dimensions
+
+
+def table_supports_compact(table):
+    metadata = table_metadata(table, FULL_COLUMN)
+    backend = BACKENDS.get(metadata["embedding_backend"])
+    return backend is not None and supports_compact(backend.matryoshka, int(metadata["embedding_dimensions"]))
+
+
+# Ширина vector_small берётся из схемы таблицы: колонка могла быть заполнена
+# при другом COMPACT_VECTOR_DIMENSIONS. 0 - колонки нет или компактные векторы отключены
+def compact_width(table):
+    if COMPACT_DIMENSIONS <= 0 or COMPACT_COLUMN not in table.schema.names:
+        return 0
+    return table.schema.field(COMPACT_COLUMN).type.list_size
+
+
+# Точная оценка кандидатов по полному вектору. Векторы нормированы, поэтому
+# _distance записывается как квадрат L2: 2 - 2 * cos
+def rerank(query_vector, rows, limit):
+    import numpy as np
+    if not rows:
+        return rows
+    full = np.asarray([row[FULL_COLUMN] for row in rows], dtype=np.float32)
+    distances = 2.0 - 2.0 * (full @ np.asarray(query_vector, dtype=np.float32))
+    for row, distance in zip(rows, distances):
+        row["_distance"] = float(distance)
+        row.pop(COMPACT_COLUMN, None)
+    rows.sort(key=lambda row: row["_distance"])
+    return rows[:limit]
+
+
+# Поиск с первым проходом по vector_small; для таблиц без колонки - обычный поиск по vector
+def search(table, query_vector, limit):
+    width = compact_width(table)
+    if not width:
+        return apply_search_params(table.search(query_vector)).limit(limit).to_list()
+    query = table.search(truncate(query_vector, width), vector_column_name=COMPACT_COLUMN)
+    candidates = apply_search_params(query).limit(limit * COMPACT_RERANK_FACTOR).to_list()
+    return rerank(query_vector, candidates, limit)
+
+
+# Усечение и нормировка пачки векторов в numpy; результат - FixedSizeList float16
+def compact_array(vectors, dimensions=COMPACT_DIMENSIONS):
+    import numpy as np
+    import pyarrow as pa
+    full = vectors.flatten().to_numpy(zero_copy_only=False).reshape(len(vectors), -1)
+    head = full[:, :dimensions].astype(np.float32)
+    norms = np.linalg.norm(head, axis=1, keepdims=True)
+    head /= np.where(norms > 0, norms, 1.0)
+    return pa.FixedSizeListArray.from_arrays(pa.array(head.astype(np.float16).ravel()), dimensions)
+
+
+# Добавление vector_small в существующую таблицу: колонка считается из vector
+# пачками по batch_size строк и дописывается к фрагментам без повторного эмбеддинга
+def backfill(table, batch_size=4096):
+    if not table_supports_compact(table):
+        raise ValueError(f"Векторы {describe(table_metadata(table))} нельзя усечь до {COMPACT_DIMENSIONS} измерений")
+    import lance
+    import pyarrow as pa
+    dataset = table.to_lance()
+    schema = pa.schema([compact_field()])
+
+    @lance.batch_udf(output_schema=schema)
+    def compact_batch(batch):
+        return pa.record_batch([compact_array(batch.column(FULL_COLUMN))], schema=schema)
+
+    dataset.add_columns(compact_batch, read_columns=[FULL_COLUMN], batch_size=batch_size)
+    return dataset.count_rows()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Добавление колонки vector_small в таблицу LanceDB")
+    parser.add_argument("--db-path", default=os.getenv("LANCE_DB_PATH") or "lancedb")
+    parser.add_argument("--table", default="pdf_docs")
+    args = parser.parse_args(argv)
+
+    if COMPACT_DIMENSIONS <= 0:
+        print("COMPACT_VECTOR_DIMENSIONS = 0, компактные векторы отключены")
+        return 1
+    import lancedb
+    from vector_index import ensure_index
+    table = lancedb.connect(args.db_path).open_table(args.table)
+    if not table_supports_compact(table):
+        print(f"Векторы {args.table} ({describe(table_metadata(table))}) нельзя усечь до "
+              f"{COMPACT_DIMENSIONS} измерений: это не Matryoshka-эмбеддинги или они не длиннее")
+        return 1
+    if COMPACT_COLUMN in table.schema.names:
+        print(f"В таблице {args.table} уже есть {COMPACT_COLUMN}")
+    else:
+        print(f"Добавлено {COMPACT_COLUMN} для {backfill(table)} строк")
+        table.checkout_latest()
+    if ensure_index(table, COMPACT_COLUMN):
+        print(f"ANN-индекс по {COMPACT_COLUMN} построен")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import os
+from functools import lru_cache
+
+# Сборка контекста промпта в пределах бюджета токенов:
+# найденные фрагменты и история диалога с постепенным сжатием старых реплик в резюме.
+
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+HISTORY_TOKENS = int(os.getenv("HISTORY_TOKENS", "1500"))
+SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "400"))
+# Сколько последних реплик не более хранится дословно после сжатия
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+# После сжатия дословные реплики занимают не больше этой доли бюджета,
+# чтобы следующие несколько ходов снова не вызывали резюмирование
+HISTORY_LOW_WATER = float(os.getenv("HISTORY_LOW_WATER", "0.5"))
+# Жёсткий предел числа хранимых реплик на сессию
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "12"))
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gpt-4")
+
+
+@lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except (ImportError, KeyError):
+        return None
+
+
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Грубая оценка без tiktoken: для русского текста около 3 символов на токен
+    return (len(text) + 2) // 3
+
+
+# tail=True - сохраняется конец текста, а не начало
+def truncate_tokens(text, budget, tail=False):
+    if budget <= 0:
+        return ""
+    encoding = _encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        if len(tokens) <= budget:
+            return text
+        return encoding.decode(tokens[-budget:] if tail else tokens[:budget])
+    return text[-budget * 3:] if tail else text[:budget * 3]
+
+
+# Берёт фрагменты по порядку релевантности, пока они помещаются в бюджет;
+# последний фрагмент при необходимости обрезается
+def fit_chunks(chunks, budget=RAG_CONTEXT_TOKENS, separator="\n\n", min_tail_tokens=50):
+    selected = []
+    remaining = budget
+    separator_tokens = count_tokens(separator)
+    for chunk in chunks:
+        cost = count_tokens(chunk) + (separator_tokens if selected else 0)
+        if cost <= remaining:
+            selected.append(chunk)
+            remaining -= cost
+            continue
+        if remaining >= min_tail_tokens:
+            selected.append(truncate_tokens(chunk, remaining - separator_tokens))
+        break
+    return separator.join(selected)
+
+
+# Память диалога хранится в сессии пользователя, поэтому это обычный словарь:
+# {'summary': str, 'turns': [[роль, текст], ...]}
+def new_memory():
+    return {'summary': '', 'turns': []}
+
+
+def add_turn(memory, role, text):
+    memory['turns'].append([role, text])
+
+
+def _format_turn(turn):
+    return f"{turn[0]}: {turn[1]}"
+
+
+# Текст для промпта: резюме ранней части диалога и последние реплики в пределах бюджета
+def dialog_context(memory, budget=HISTORY_TOKENS):
+    parts = []
+    remaining = budget
+    if memory['summary']:
+        summary = "Краткое содержание предыдущего диалога: " + memory['summary']
+        summary = truncate_tokens(summary, min(SUMMARY_TOKENS, budget // 2))
+        remaining -= count_tokens(summary)
+        parts.append(summary)
+    recent = []
+    for turn in reversed(memory['turns']):
+        text = _format_turn(turn)
+        cost = count_tokens(text)
+        if cost > remaining:
+            if not recent:
+                # Последняя реплика пользователя попадает в промпт всегда, пусть и обрезанной
+                recent.append(truncate_tokens(text, remaining))
+            break
+        recent.append(text)
+        remaining -= cost
+    return "\n".join(parts + list(reversed(recent)))
+
+
+# Сжимает старые реплики в резюме, когда история перестаёт помещаться в бюджет.
+# Дословно остаются последние реплики в пределах HISTORY_LOW_WATER бюджета.
+# Последняя остаётся всегда; если она длиннее, сохраняется её конец (обычно там
+# вопрос, на который сейчас отвечает студент), а начало уходит в резюме.
+# summarize(summary, turns_text) -> новое резюме (например, вызов LLM)
+def compact_memory(memory, summarize, budget=HISTORY_TOKENS):
+    turns = memory['turns']
+    costs = [count_tokens(_format_turn(t)) for t in turns]
+    if sum(costs) <= budget and len(turns) <= HISTORY_MAX_TURNS:
+        return False
+    low_water = int(budget * HISTORY_LOW_WATER)
+    keep, kept_tokens = 1, costs[-1]
+    while keep < min(HISTORY_KEEP_TURNS, len(turns)) and kept_tokens + costs[-keep - 1] <= low_water:
+        kept_tokens += costs[-keep - 1]
+        keep += 1
+    old, recent = turns[:-keep], turns[-keep:]
+    overflow = []
+    if kept_tokens > low_water:
+        role, text = recent[0]
+        tail = truncate_tokens(text, low_water, tail=True)
+        recent[0] = [role, tail]
+        overflow = [[role, text[:len(text) - len(tail)]]]
+    memory['turns'] = recent
+    if not old and not overflow:
+        return False
+    old_text = "\n".join(_format_turn(t) for t in old + overflow)
+    try:
+        summary = summarize(memory['summary'], old_text)
+    except Exception:
+        # Без LLM сохраняем хотя бы начало старых реплик
+        summary = (memory['summary'] + "\n" + old_text).strip()
+    memory['summary'] = truncate_tokens(summary, SUMMARY_TOKENS)
+    return True
@@ -0,0 +1,144 @@
+import os
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+import metrics
+from embedding_cache import LRUCache
+
+# Отрисовка графа курса без глобального состояния pyplot (Figure на каждый вызов),
+# с кешем раскладки по курсу и кешем PNG по (курс, хеш оценок пользователя).
+# matplotlib и networkx загружаются только при первой отрисовке.
+
+PNG_CACHE_SIZE = int(os.getenv("COURSE_GRAPH_CACHE_SIZE", "512"))
+USER_KEYS_SIZE = int(os.getenv("COURSE_GRAPH_USER_KEYS", "10000"))
+# Инвалидация по оценке действует только внутри процесса; оценки, изменённые
+# другим процессом бота, становятся видны не позже чем через столько секунд
+USER_KEYS_TTL = float(os.getenv("COURSE_GRAPH_USER_KEYS_TTL", "300"))
+
+
+class CourseLayout:
+    def __init__(self, topics):
+        import networkx as nx
+        self.graph = nx.DiGraph()
+        self.pos = {}
+        self.topic_ids = []
+        for i, topic in enumerate(topics):
+            name = topic['topic_name']
+            self.graph.add_node(name)
+            if i > 0:
+                self.graph.add_edge(topics[i-1]['topic_name'], name)
+            self.pos[name] = (i, -i*0.5)
+            self.topic_ids.append((topic['topic_id'], name))
+
+
+def mark_color(mark):
+    # Цвет в зависимости от прогресса
+    if mark == None:
+        return '#ff0000'
+    return '#ff0000' if mark < 50 else '#ff9900' if mark < 80 else '#00aa00'
+
+
+def render(layout, marks):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import networkx as nx
+
+    nodes = list(layout.graph.nodes())
+    node_marks = {name: marks.get(topic_id, 0) for topic_id, name in layout.topic_ids}
+    colors = [mark_color(node_marks[n]) for n in nodes]
+    labels = {n: f"{n}\n({node_marks[n]}%)" for n in nodes}
+
+    figure = Figure(figsize=(12, 8))
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    nx.draw_networkx_edges(layout.graph, layout.pos, ax=ax, arrowsize=20, edge_color='gray',
+                           node_size=3000)
+    nx.draw_networkx_nodes(layout.graph, layout.pos, ax=ax, nodelist=nodes, node_size=3000,
+                           node_color=colors)
+    nx.draw_networkx_labels(layout.graph, layout.pos, ax=ax, labels=labels, font_size=8,
+                            font_weight='bold')
+    ax.set_axis_off()
+
+    img_bytes = BytesIO()
+    canvas.print_png(img_bytes)
+    return img_bytes.getvalue()
+
+
+class CourseGraphCache:
+    def __init__(self, max_items=PNG_CACHE_SIZE, max_users=USER_KEYS_SIZE, user_ttl=USER_KEYS_TTL):
+        self.max_items = max_items
+        self._layouts = {}
+        self._images = OrderedDict()
+        # user_id -> {course_id: ключ PNG}; сбрасывается при изменении оценки
+        self._user_keys = LRUCache(max_items=max_users, ttl=user_ttl)
+        self._lock = threading.Lock()
+
+    def layout(self, course_id, catalog_version, topics):
+        key = (course_id, catalog_version)
+        layout = self._layouts.get(key)
+        if layout is None:
+            layout = CourseLayout(topics)
+            with self._lock:
+                # Устаревшие раскладки курса больше не понадобятся
+                for old in [k for k in self._layouts if k[0] == course_id]:
+                    del self._layouts[old]
+                self._layouts[key] = layout
+        return layout
+
+    def get(self, key):
+        with self._lock:
+            png = self._images.get(key)
+            if png is not None:
+                self._images.move_to_end(key)
+            return png
+
+    def put(self, key, png):
+        with self._lock:
+            self._images[key] = png
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_items:
+                self._images.popitem(last=False)
+
+    def user_key(self, user_id, course_id):
+        keys = self._user_keys.get(user_id)
+        return keys.get(course_id) if keys else None
+
+    def remember_user_key(self, user_id, course_id, key):
+        with self._lock:
+            keys = dict(self._user_keys.get(user_id) or {})
+            keys[course_id] = key
+            self._user_keys.set(user_id, keys)
+
+    def invalidate_user(self, user_id):
+        self._user_keys.discard(user_id)
+
+
+graph_cache = CourseGraphCache()
+
+
+def marks_hash(marks):
+    raw = ",".join(f"{topic_id}:{mark}" for topic_id, mark in sorted(marks.items()))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+# topics_loader и progress_loader вызываются только при промахе кеша
+def course_graph_png(course_id, user_id, catalog_version, topics_loader, progress_loader):
+    key = graph_cache.user_key(user_id, course_id)
+    if key is not None and key[1] == catalog_version:
+        png = graph_cache.get(key)
+        if png is not None:
+            return BytesIO(png)
+
+    marks = {p['topic_id']: p['mark'] for p in progress_loader()}
+    key = (course_id, catalog_version, marks_hash(marks))
+    graph_cache.remember_user_key(user_id, course_id, key)
+    png = graph_cache.get(key)
+    if png is None:
+        layout = graph_cache.layout(course_id, catalog_version, topics_loader())
+        with metrics.span("render"):
+            png = render(layout, marks)
+        graph_cache.put(key, png)
+    return BytesIO(png)
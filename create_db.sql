@@ -38,6 +38,7 @@ DROP TABLE IF EXISTS `students_db_for_tgbot`.`course` ;
 CREATE TABLE IF NOT EXISTS `students_db_for_tgbot`.`course` (
   `course_id` INT NOT NULL AUTO_INCREMENT,
   `course_name` VARCHAR(255) NOT NULL,
+  `updated_at` TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
   PRIMARY KEY (`course_id`),
   UNIQUE INDEX `course_id_UNIQUE` (`course_id` ASC) VISIBLE)
 ENGINE = InnoDB;
@@ -54,6 +55,7 @@ CREATE TABLE IF NOT EXISTS `students_db_for_tgbot`.`topic` (
   `position` INT NOT NULL,
   `text` TEXT NOT NULL,
   `difficulty` ENUM('beginner', 'intermediate', 'advanced') NOT NULL,
+  `updated_at` TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
   PRIMARY KEY (`topic_id`, `course_id`),
   UNIQUE INDEX `topic_id_UNIQUE` (`topic_id` ASC) VISIBLE,
   INDEX `fk_topic_course1_idx` (`course_id` ASC) VISIBLE,
@@ -88,6 +90,49 @@ CREATE TABLE IF NOT EXISTS `students_db_for_tgbot`.`user_has_topic` (
     ON UPDATE NO ACTION)
 ENGINE = InnoDB;
 
+-- -----------------------------------------------------
+-- Table `students_db_for_tgbot`.`topic_quiz`
+-- -----------------------------------------------------
+DROP TABLE IF EXISTS `students_db_for_tgbot`.`topic_quiz` ;
+
+CREATE TABLE IF NOT EXISTS `students_db_for_tgbot`.`topic_quiz` (
+  `quiz_id` INT NOT NULL AUTO_INCREMENT,
+  `topic_id` INT NOT NULL,
+  `questions` JSON NOT NULL,
+  `served_count` INT NOT NULL DEFAULT 0,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`quiz_id`),
+  INDEX `fk_topic_quiz_topic1_idx` (`topic_id` ASC, `served_count` ASC) VISIBLE,
+  CONSTRAINT `fk_topic_quiz_topic1`
+    FOREIGN KEY (`topic_id`)
+    REFERENCES `students_db_for_tgbot`.`topic` (`topic_id`)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB;
+
+-- -----------------------------------------------------
+-- Table `students_db_for_tgbot`.`user_has_quiz`
+-- -----------------------------------------------------
+DROP TABLE IF EXISTS `students_db_for_tgbot`.`user_has_quiz` ;
+
+CREATE TABLE IF NOT EXISTS `students_db_for_tgbot`.`user_has_quiz` (
+  `user_id` BIGINT NOT NULL,
+  `quiz_id` INT NOT NULL,
+  `served_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`user_id`, `quiz_id`),
+  INDEX `fk_user_has_quiz_quiz1_idx` (`quiz_id` ASC) VISIBLE,
+  CONSTRAINT `fk_user_has_quiz_user1`
+    FOREIGN KEY (`user_id`)
+    REFERENCES `students_db_for_tgbot`.`user` (`user_id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_user_has_quiz_topic_quiz1`
+    FOREIGN KEY (`quiz_id`)
+    REFERENCES `students_db_for_tgbot`.`topic_quiz` (`quiz_id`)
+    ON DELETE CASCADE
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB;
+
 SET SQL_MODE=@OLD_SQL_MODE;
 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;
 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;
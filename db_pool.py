@@ -0,0 +1,197 @@
+import os
+import time
+import threading
+import weakref
+from contextlib import contextmanager
+import metrics
+
+# Пул соединений MySQL и кеш подготовленных выражений для фиксированного набора запросов.
+# Безопасен для вызова из рабочих потоков telebot: каждый поток берёт своё соединение.
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Соединение, простоявшее дольше этого времени, проверяется перед выдачей
+HEALTHCHECK_INTERVAL = float(os.getenv("DB_HEALTHCHECK_INTERVAL", "30"))
+
+QUERIES = {
+    "catalog_courses": "SELECT course_id, course_name FROM course ORDER BY course_id",
+    "catalog_topics": """
+        SELECT topic_id, course_id, topic_name, position, difficulty
+        FROM topic
+        ORDER BY course_id, position
+    """,
+    # Дешёвый маркер изменений: updated_at обновляет сам MySQL, удаление меняет COUNT(*)
+    "catalog_version": """
+        SELECT
+            (SELECT COUNT(*) FROM course) AS courses,
+            (SELECT MAX(updated_at) FROM course) AS courses_updated,
+            COUNT(*) AS topics,
+            MAX(updated_at) AS topics_updated
+        FROM topic
+    """,
+    "topic_text": "SELECT text FROM topic WHERE topic_id = %s",
+    "user_progress": """
+        SELECT t.topic_id, t.topic_name, uht.mark
+        FROM topic t
+        LEFT JOIN user_has_topic uht ON t.topic_id = uht.topic_id AND uht.user_id = %s
+        WHERE t.course_id = %s
+        ORDER BY t.position
+    """,
+    "quiz_count": "SELECT COUNT(*) AS quizzes FROM topic_quiz WHERE topic_id = %s",
+    "quiz_insert": "INSERT INTO topic_quiz (topic_id, questions) VALUES (%s, %s)",
+    # Сначала тесты, которые пользователь ещё не проходил, затем давно пройденные
+    "quiz_pick": """
+        SELECT q.quiz_id, q.questions, uq.served_at
+        FROM topic_quiz q
+        LEFT JOIN user_has_quiz uq ON uq.quiz_id = q.quiz_id AND uq.user_id = %s
+        WHERE q.topic_id = %s
+        ORDER BY uq.served_at IS NOT NULL, uq.served_at, q.served_count, q.quiz_id
+        LIMIT 1
+    """,
+    "quiz_served": "UPDATE topic_quiz SET served_count = served_count + 1 WHERE quiz_id = %s",
+    "quiz_user_served": """
+        INSERT INTO user_has_quiz (user_id, quiz_id) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE served_at = CURRENT_TIMESTAMP
+    """,
+}
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+# Пул выдаёт каждый раз новую обёртку PooledMySQLConnection; подготовленные выражения
+# живут в физическом соединении под ней, а публичного доступа к нему mysql.connector не даёт
+def _physical(conn):
+    return getattr(conn, "_cnx", conn)
+
+
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT, healthcheck_interval=HEALTHCHECK_INTERVAL):
+        self.size = size
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # физическое соединение -> (время последнего использования, {имя запроса: курсор});
+        # запись исчезает вместе с соединением, поэтому повторно использованный id её не унаследует
+        self._state = weakref.WeakKeyDictionary()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    from mysql.connector import pooling
+                    # autocommit: SELECT не держат открытую транзакцию со старым снимком данных;
+                    # без reset_session подготовленные выражения переживают возврат в пул
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name="education_bot",
+                        pool_size=self.size,
+                        pool_reset_session=False,
+                        autocommit=True,
+                        host=os.getenv("DB_HOST"),
+                        user=os.getenv("DB_USER"),
+                        password=os.getenv("DB_PASSWORD"),
+                        database=os.getenv("DB_NAME")
+                    )
+        return self._pool
+
+    # Стандартный пул mysql.connector не ждёт свободного соединения, поэтому
+    # ограничиваем число выданных соединений семафором
+    def checkout(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError("Нет свободных соединений с базой данных")
+        try:
+            conn = self._get_pool().get_connection()
+            self._healthcheck(conn)
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, healthy=True):
+        try:
+            raw = _physical(conn)
+            if raw is not None and raw in self._state:
+                # После ошибки соединение будет проверено при следующей выдаче
+                last_used = time.monotonic() if healthy else 0.0
+                self._state[raw] = (last_used, self._state[raw][1])
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def _healthcheck(self, conn):
+        raw = _physical(conn)
+        last_used, statements = self._state.get(raw, (0.0, None))
+        if statements is not None and time.monotonic() - last_used < self.healthcheck_interval:
+            return
+        if statements is not None and raw.is_connected():
+            return
+        if statements is not None:
+            raw.reconnect(attempts=3, delay=1)
+        # После переподключения подготовленные выражения на сервере потеряны
+        self._state[raw] = (time.monotonic(), {})
+
+    def statement(self, conn, name):
+        statements = self._state[_physical(conn)][1]
+        cursor = statements.get(name)
+        if cursor is None:
+            cursor = conn.cursor(prepared=True)
+            statements[name] = cursor
+        return cursor
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        healthy = False
+        try:
+            yield conn
+            healthy = True
+        finally:
+            self.release(conn, healthy)
+
+
+pool = ConnectionPool()
+
+
+def _rows_as_dicts(cursor, rows):
+    columns = cursor.column_names
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def fetch_all(name, params=()):
+    with metrics.span("mysql", query=name), pool.connection() as conn:
+        cursor = pool.statement(conn, name)
+        cursor.execute(QUERIES[name], params)
+        return _rows_as_dicts(cursor, cursor.fetchall())
+
+
+def fetch_one(name, params=()):
+    rows = fetch_all(name, params)
+    return rows[0] if rows else None
+
+
+def execute(name, params=()):
+    with metrics.span("mysql", query=name), pool.connection() as conn:
+        cursor = pool.statement(conn, name)
+        cursor.execute(QUERIES[name], params)
+        return cursor.rowcount
+
+
+def insert(name, params=()):
+    with metrics.span("mysql", query=name), pool.connection() as conn:
+        cursor = pool.statement(conn, name)
+        cursor.execute(QUERIES[name], params)
+        return cursor.lastrowid
+
+
+# Произвольный запрос без подготовки (например, многострочный INSERT переменной длины)
+def execute_sql(sql, params=()):
+    with metrics.span("mysql", query=sql.split("(", 1)[0].strip()), pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+        finally:
+            cursor.close()
@@ -0,0 +1,125 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Параллельная обработка обновлений Telegram с сохранением порядка для каждого пользователя.
+# Обновления разных пользователей выполняются в пуле потоков, а обновления одного
+# пользователя - строго последовательно, поэтому register_next_step_handler и
+# current_tests остаются согласованными.
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.getenv("BOT_WORKERS", "16"))
+# Сколько обновлений может ждать обработки, прежде чем приём новых притормозит
+MAX_PENDING = int(os.getenv("BOT_MAX_PENDING", "1000"))
+
+
+class KeyedExecutor:
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bot-worker")
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.pending = 0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def submit(self, key, fn, *args):
+        self._slots.acquire()
+        with self._lock:
+            queue = self._queues.setdefault(key, deque())
+            queue.append((fn, args))
+            self.pending += 1
+            self.max_depth = max(self.max_depth, self.pending)
+            # Если по ключу уже идёт обработка, задача дождётся своей очереди
+            if len(queue) == 1:
+                try:
+                    self._pool.submit(self._run_next, key)
+                except RuntimeError:
+                    # Пул уже остановлен: задача не выполнится, слот возвращаем
+                    queue.pop()
+                    del self._queues[key]
+                    self.pending -= 1
+                    self._slots.release()
+                    if not self._queues:
+                        self._idle.notify_all()
+                    raise
+
+    def _run_next(self, key):
+        with self._lock:
+            fn, args = self._queues[key][0]
+            self.pending -= 1
+            self.active += 1
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("Ошибка при обработке обновления пользователя %s", key)
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.processed += 1
+                queue = self._queues[key]
+                queue.popleft()
+                if queue:
+                    # Ставим следующую задачу в конец общей очереди, чтобы не занимать поток
+                    self._pool.submit(self._run_next, key)
+                else:
+                    del self._queues[key]
+                    if not self._queues:
+                        self._idle.notify_all()
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "pending": self.pending,
+                "active": self.active,
+                "keys": len(self._queues),
+                "processed": self.processed,
+                "failed": self.failed,
+                "max_depth": self.max_depth,
+            }
+
+    # Дожидается обработки всех принятых обновлений (для корректной остановки)
+    def drain(self, timeout=None):
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._queues, timeout=timeout)
+
+    def shutdown(self, wait=True):
+        if wait:
+            self.drain()
+        self._pool.shutdown(wait=wait)
+
+
+def update_key(update):
+    for name in ("message", "edited_message", "callback_query", "inline_query"):
+        event = getattr(update, name, None)
+        if event is not None and getattr(event, "from_user", None) is not None:
+            return event.from_user.id
+    return update.update_id
+
+
+# Подменяет bot.process_new_updates: каждое обновление уходит в очередь своего пользователя.
+# Бот должен быть создан с threaded=False, чтобы обработчики выполнялись в потоке пула.
+def install(bot, executor):
+    process_updates = bot.process_new_updates
+
+    def dispatch(updates):
+        # telebot сдвигает last_update_id внутри process_new_updates, а polling запрашивает
+        # offset=last_update_id + 1; без этого те же обновления приходили бы снова
+        if updates:
+            bot.last_update_id = max(getattr(bot, "last_update_id", 0), *(u.update_id for u in updates))
+        for update in updates:
+            executor.submit(update_key(update), process_updates, [update])
+
+    bot.process_new_updates = dispatch
+    return executor
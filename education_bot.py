@@ -1,108 +1,279 @@
 import os
 from dotenv import load_dotenv
-import mysql.connector
-import networkx as nx
-import matplotlib.pyplot as plt
-from io import BytesIO
-import lancedb
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import LanceDB
-from langchain_community.tools import TavilySearchResults
-from langchain.agents import create_openai_tools_agent, AgentExecutor
-from langchain_core.output_parsers import StrOutputParser
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from openai import OpenAI
-import openai
-
-# Загрузка переменных окружения
+
+# Загрузка переменных окружения (до импорта модулей, читающих настройки)
 load_dotenv()
 
-# Инициализация моделей и инструментов
-llm = ChatOpenAI(model="gpt-4", temperature=0.7)
-embedding = OpenAIEmbeddings()
-search = TavilySearchResults()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Подключение к MySQL
-def connect_to_db():
-    return mysql.connector.connect(
-        host=os.getenv("DB_HOST"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
+import hashlib
+import logging
+from functools import lru_cache
+import compact_vectors
+from lance_registry import get_table, registry
+import db_pool
+from write_behind import write_queue
+from catalog import catalog
+from course_graph import course_graph_png, graph_cache
+from lexical_search import lexical_indexes, reciprocal_rank_fusion
+from context_builder import fit_chunks, count_tokens, truncate_tokens
+import metrics
+from embedding_cache import EmbeddingCache, SQLiteEmbeddingStore, LRUCache, DISK_PATH
+import video_search
+import lecture_docs
+import code_analysis
+from answer_cache import answer_caches, ANSWER_CACHE_ENABLED
+from rate_governor import chat_governor, COMPLETION_TOKENS_ESTIMATE
+from embedding_backends import get_backend as get_embedding_backend, embed as embed_texts, is_compatible
+
+logger = logging.getLogger(__name__)
+
+# Инициализация моделей и инструментов.
+# langchain, openai и клиенты тяжёлые, поэтому загружаются при первом использовании
+@lru_cache(maxsize=None)
+def get_llm():
+    from langchain_openai import ChatOpenAI
+    # Повторы при 429 выполняет rate_governor, а не клиент
+    return ChatOpenAI(model="gpt-4", temperature=0.7, max_retries=0)
+
+# Эмбеддинги берутся из выбранного бэкенда (EMBEDDING_BACKEND), см. embedding_backends
+def get_embedding():
+    return get_embedding_backend()
+
+@lru_cache(maxsize=None)
+def get_search():
+    from langchain_community.tools import TavilySearchResults
+    return TavilySearchResults()
+
+# Поиск только по YouTube для подбора видео
+@lru_cache(maxsize=None)
+def get_video_search():
+    from langchain_community.tools import TavilySearchResults
+    return TavilySearchResults(
+        max_results=video_search.VIDEO_SEARCH_RESULTS,
+        include_domains=video_search.VIDEO_DOMAINS
     )
 
+@lru_cache(maxsize=None)
+def get_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# Прежние глобальные имена (education_bot.llm и т.п.) остаются доступными
+_LAZY_ATTRIBUTES = {"llm": get_llm, "embedding": get_embedding, "search": get_search, "client": get_client}
+
+def __getattr__(name):
+    factory = _LAZY_ATTRIBUTES.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return factory()
+
+def chat_prompt(messages):
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_messages(messages)
+
 # Подключение к LanceDB
 def connect_to_lancedb():
-    db = lancedb.connect(os.getenv("LANCE_DB_PATH"))
-    return db.open_table("pdf_docs")
+    return get_table(os.getenv("LANCE_DB_PATH"), "pdf_docs")
 
-# Функции для работы с курсами
+# Функции для работы с курсами (курсы и темы берутся из кешированного каталога)
 def get_all_courses():
-    conn = connect_to_db()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM course")
-    courses = cursor.fetchall()
-    conn.close()
-    return courses
+    return catalog.courses()
+
+def get_course(course_id):
+    return catalog.course(course_id)
+
+def get_all_topics():
+    return catalog.topics()
+
+def get_topic_by_name(topic_name, course_id=None):
+    return catalog.find_topic(topic_name, course_id)
+
+def get_topic_text(topic_id):
+    return catalog.topic_text(topic_id)
+
+def is_topic_name(text):
+    return catalog.has_topic(text)
 
 def get_course_topics(course_id):
-    conn = connect_to_db()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM topic WHERE course_id = %s ORDER BY position", (course_id,))
-    topics = cursor.fetchall()
-    conn.close()
-    return topics
+    return catalog.course_topics(course_id)
 
+# Оценки ещё не записанные в базу (write_behind) накладываются на результат запроса
 def get_user_progress(user_id, course_id):
-    conn = connect_to_db()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT t.topic_id, t.topic_name, uht.mark 
-        FROM topic t
-        LEFT JOIN user_has_topic uht ON t.topic_id = uht.topic_id AND uht.user_id = %s
-        WHERE t.course_id = %s
-        ORDER BY t.position
-    """, (user_id, course_id))
-    progress = cursor.fetchall()
-    conn.close()
+    progress = db_pool.fetch_all("user_progress", (user_id, course_id))
+    pending = write_queue.pending_marks(user_id)
+    for row in progress:
+        if row['topic_id'] in pending:
+            row['mark'] = pending[row['topic_id']]
     return progress
 
 def update_user_mark(user_id, topic_id, mark):
-    conn = connect_to_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO user_has_topic (user_id, topic_id, mark) 
-        VALUES (%s, %s, %s)
-        ON DUPLICATE KEY UPDATE mark = VALUES(mark)
-    """, (user_id, topic_id, mark))
-    conn.commit()
-    conn.close()
-
-# Генерация конспекта
-def generate_summary(text):
-    prompt = ChatPromptTemplate.from_messages([
+    write_queue.set_mark(user_id, topic_id, mark)
+    graph_cache.invalidate_user(user_id)
+
+def add_user(user_id, username):
+    write_queue.add_user(user_id, username)
+
+def _request_key(*parts):
+    return hashlib.sha256("\x00".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+# Запуск цепочки "промпт -> GPT-4 -> строка" через общий регулятор запросов:
+# одинаковые одновременные промпты выполняются одним вызовом.
+# При stream=True возвращается итератор фрагментов ответа (chain.stream)
+def run_chain(prompt, inputs, stream=False):
+    from langchain_core.output_parsers import StrOutputParser
+    chain = prompt | get_llm() | StrOutputParser()
+    prompt_text = prompt.format(**inputs)
+    prompt_tokens = count_tokens(prompt_text)
+    reserved = prompt_tokens + COMPLETION_TOKENS_ESTIMATE
+    handler = metrics.current_handler()
+
+    def finished(text):
+        completion_tokens = count_tokens(text)
+        chat_governor.settle(reserved, prompt_tokens + completion_tokens)
+        metrics.count_llm_tokens(prompt_tokens, completion_tokens, handler)
+
+    key = _request_key("gpt-4", prompt_text)
+    if stream:
+        return metrics.timed_stream("llm", lambda granted: chat_governor.run(
+            key, lambda: chain.stream(inputs), reserved, stream=True, on_finish=finished, on_grant=granted))
+    with metrics.queued_span("llm") as granted:
+        return chat_governor.run(key, lambda: chain.invoke(inputs), reserved, on_finish=finished, on_grant=granted)
+
+# Генерация конспекта. Длинный текст конспектируется по фрагментам (map-reduce)
+def generate_summary(text, stream=False):
+    if count_tokens(text) > lecture_docs.SUMMARY_DIRECT_TOKENS:
+        chunks = lecture_docs.iter_chunks([text])
+        return _summarize_chunks(chunks, "text:" + lecture_docs.text_hash(text), stream)
+    prompt = chat_prompt([
         ("system", "Вы - помощник для создания конспектов. Создайте краткое изложение текста, выделяя ключевые моменты."),
         ("human", "{text}")
     ])
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke({"text": text})
-
-# Код-ревью
-def code_review(task, code):
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Вы - опытный программист. Проведите ревью кода, укажите ошибки и предложите оптимизации."),
-        ("human", "Задание: {task}\n\nКод:\n{code}")
+    return run_chain(prompt, {"text": text}, stream)
+
+# Конспект загруженного документа (PDF/DOCX/TXT), kind - из lecture_docs.document_kind
+def summarize_document(path, kind, content_hash=None, stream=False):
+    key = "document:" + (content_hash or lecture_docs.file_hash(path))
+    chunks = lecture_docs.iter_chunks(lecture_docs.iter_document_text(path, kind))
+    return _summarize_chunks(chunks, key, stream)
+
+def summarize_part(text):
+    prompt = chat_prompt([
+        ("system", "Вы - помощник для создания конспектов. Это фрагмент длинной лекции. "
+                   "Кратко изложите его ключевые моменты, сохраняя определения, формулы и примеры."),
+        ("human", "{text}")
     ])
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke({"task": task, "code": code})
+    return run_chain(prompt, {"text": text})
 
-# Поиск видео
+def combine_summaries(summaries, stream=False):
+    prompt = chat_prompt([
+        ("system", "Вы - помощник для создания конспектов. Ниже конспекты последовательных частей одной лекции. "
+                   "Объедините их в единый краткий конспект, выделяя ключевые моменты и убирая повторы."),
+        ("human", "{text}")
+    ])
+    return run_chain(prompt, {"text": "\n\n".join(summaries)}, stream)
+
+# Фрагменты конспектируются параллельно, затем конспекты сводятся; итог кешируется по хешу содержимого
+def _summarize_chunks(chunks, key, stream=False):
+    cached = lecture_docs.summary_cache.get(key)
+    if cached is not None:
+        return cached
+    with metrics.span("summary_map"):
+        summaries = lecture_docs.map_chunks(chunks, summarize_part)
+    if not summaries:
+        return "Не удалось извлечь текст из документа."
+    with metrics.span("summary_reduce"):
+        summaries = lecture_docs.reduce_summaries(summaries, combine_summaries)
+    summary = combine_summaries(summaries, stream)
+    if not stream:
+        lecture_docs.summary_cache.set(key, summary)
+        return summary
+    return _cache_stream(lecture_docs.summary_cache, key, summary)
+
+# Потоковый ответ, который после завершения сохраняется в кеш
+def _cache_stream(cache, key, chunks):
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, "".join(parts))
+
+# Код-ревью: сначала локальный анализ (code_analysis). Код с синтаксической ошибкой
+# разбирается без LLM, в промпт попадают найденные замечания и сжатый код.
+# Повторная отправка того же решения отвечается из кеша
+review_cache = LRUCache(max_items=code_analysis.CODE_ANALYSIS_CACHE_SIZE, ttl=code_analysis.CODE_ANALYSIS_CACHE_TTL)
+
+def code_review(task, code, stream=False):
+    code = code_analysis.strip_fences(code)
+    with metrics.span("code_analysis"):
+        report = code_analysis.analyze(code)
+    if report.syntax_error is not None and code_analysis.looks_like_python(code):
+        return report.syntax_error_message()
+    key = code_analysis.code_hash(f"{task}\x00{code}")
+    cached = review_cache.get(key)
+    if cached is not None:
+        return cached
+    if report.syntax_error is not None:
+        # Код не на Python: локальный анализ неприменим
+        prompt = chat_prompt([
+            ("system", "Вы - опытный программист. Проведите ревью кода, укажите ошибки и предложите оптимизации."),
+            ("human", "Задание: {task}\n\nКод:\n{code}")
+        ])
+        inputs = {"task": task, "code": truncate_tokens(code, code_analysis.CODE_REVIEW_CODE_TOKENS)}
+    else:
+        prompt = chat_prompt([
+            ("system", "Вы - опытный программист. Проведите ревью кода, укажите ошибки и предложите оптимизации. "
+                       "Результаты автоматической проверки приложены: не перечисляйте их заново, "
+                       "а объясните важные из них и сосредоточьтесь на логике, правильности решения задания и стиле."),
+            ("human", "Задание: {task}\n\nКод:\n{code}\n\nАвтоматическая проверка:\n{analysis}")
+        ])
+        inputs = {"task": task, "code": report.condensed, "analysis": report.summary()}
+    answer = run_chain(prompt, inputs, stream)
+    if not stream:
+        review_cache.set(key, answer)
+        return answer
+    return _cache_stream(review_cache, key, answer)
+
+# Поиск видео: один запрос к поиску и ранжирование ссылок без LLM,
+# агент с инструментами - запасной путь (VIDEO_SEARCH_MODE, VIDEO_AGENT_FALLBACK)
 def find_videos(topic):
+    key = video_search.cache_key(topic)
+    cached = video_search.video_cache.get(key)
+    if cached is not None:
+        return cached
+    links = []
+    failed = False
+    if video_search.VIDEO_SEARCH_MODE != "agent":
+        try:
+            with metrics.span("video_search"):
+                results = get_video_search().invoke({"query": video_search.video_query(topic)})
+            links = video_search.rank_videos(topic, results)
+        except Exception:
+            logger.exception("Ошибка поиска видео по теме %r", topic)
+            failed = True
+    output = None
+    if not links and (video_search.VIDEO_SEARCH_MODE == "agent" or video_search.VIDEO_AGENT_FALLBACK):
+        output = _find_videos_agent(topic)
+        if output is None:
+            failed = True
+        else:
+            links = video_search.youtube_links(output)[:video_search.VIDEO_LIMIT]
+    if links:
+        answer = "\n".join(links)
+        video_search.video_cache.set(key, answer)
+        return answer
+    if output:
+        return output
+    if failed:
+        return "Произошла ошибка при поиске видео. Пожалуйста, попробуйте позже."
+    return "Не удалось найти видео по данной теме."
+
+def _find_videos_agent(topic):
     try:
+        from langchain_core.prompts import MessagesPlaceholder
+        from langchain_community.tools import TavilySearchResults
+        from langchain.agents import create_openai_tools_agent, AgentExecutor
+
         # Создаем правильный промпт для агента с учетом всех обязательных переменных
-        prompt = ChatPromptTemplate.from_messages([
+        prompt = chat_prompt([
             ("system", """Ты помощник, который ищет образовательные видео на YouTube. 
             Используй предоставленные инструменты для поиска актуальной информации.
             Отвечай кратко и предоставляй только ссылки на YouTube."""),
@@ -115,7 +286,7 @@ def find_videos(topic):
         
         # Создаем агента с правильным промптом
         agent = create_openai_tools_agent(
-            llm=llm,
+            llm=get_llm(),
             tools=tools,
             prompt=prompt
         )
@@ -124,136 +295,200 @@ def find_videos(topic):
         agent_executor = AgentExecutor(
             agent=agent,
             tools=tools,
-            verbose=True,
+            verbose=False,
             handle_parsing_errors=True
         )
         
         # Выполняем поиск
-        result = agent_executor.invoke({
-            "input": f"Найди 3 лучших образовательных видео на YouTube по теме: {topic}",
-            "agent_scratchpad": []
-        })
+        with metrics.span("agent"):
+            result = agent_executor.invoke({
+                "input": f"Найди 3 лучших образовательных видео на YouTube по теме: {topic}",
+                "agent_scratchpad": []
+            })
         
-        # Обрабатываем результат
-        if "output" in result:
-            # Извлекаем только ссылки на YouTube из результата
-            import re
-            youtube_links = re.findall(r'(https?://(?:www\.)?youtube\.com/watch\?v=[\w-]+)', result["output"])
-            if youtube_links:
-                return "\n".join(youtube_links[:3])  # Возвращаем не более 3 ссылок
-            return result["output"]
-        return "Не удалось найти видео по данной теме."
-    except Exception as e:
-        return "Произошла ошибка при поиске видео. Пожалуйста, попробуйте позже."
+        return result.get("output", "")
+    except Exception:
+        logger.exception("Ошибка агента при поиске видео по теме %r", topic)
+        return None
 
 def create_embedding(text):
-    response = client.embeddings.create(
-        model="text-embedding-3-large",
-        input=text,
-        dimensions=1536
+    return create_embeddings([text])[0]
+
+# Пакетное получение эмбеддингов: один вызов бэкенда на весь список текстов
+def create_embeddings(texts):
+    return embed_texts(texts)
+
+# Ответы из кеша по фрагментам, изменившимся при повторной загрузке, удаляются
+registry.on_version_change(answer_caches.on_version_change)
+
+# Кеш эмбеддингов вопросов (пустой EMBEDDING_CACHE_PATH отключает дисковый уровень)
+query_embedding_cache = EmbeddingCache(disk=SQLiteEmbeddingStore() if DISK_PATH else None)
+
+def create_query_embedding(text):
+    backend = get_embedding_backend()
+    return query_embedding_cache.get_or_compute(
+        text, f"{backend.name}/{backend.model}", backend.dimensions, create_embedding
     )
-    return response.data[0].embedding
 
-@retry(
-    stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=1, max=60),
-    retry=retry_if_exception_type((openai.RateLimitError, openai.APIError, openai.APIConnectionError))
-)
+# 429 обрабатывает rate_governor; здесь повторяются только сетевые и серверные ошибки бэкенда
 def search_in_table(query_text, table, limit=3):
+    from tenacity import Retrying, stop_after_attempt, wait_exponential, retry_if_exception_type
+    for attempt in Retrying(
+        stop=stop_after_attempt(5),
+        wait=wait_exponential(multiplier=1, min=1, max=60),
+        retry=retry_if_exception_type(get_embedding_backend().transient_errors())
+    ):
+        with attempt:
+            query_embedding = create_query_embedding(query_text)
+            with metrics.span("lancedb_search"):
+                return compact_vectors.search(table, query_embedding, limit)
+
+# Гибридный поиск: BM25 по тексту фрагментов + векторный поиск, слияние через RRF.
+# Если лексический поиск уверен в результате, эмбеддинг запроса не вычисляется.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+
+# Кандидаты BM25 и признак того, что лучший из них найден уверенно
+def lexical_candidates(query, table, index_key=None):
+    lexical_index = lexical_indexes.get(index_key, table) if index_key else None
+    if lexical_index is None:
+        return [], False
+    with metrics.span("lexical_search"):
+        results, terms = lexical_index.search(query, HYBRID_CANDIDATES)
+    return [doc for doc, _ in results], lexical_index.is_confident(results, terms)
+
+# use_vectors=False - векторы таблицы построены другим бэкендом, ищем только по тексту;
+# lexical - уже посчитанный результат lexical_candidates
+def retrieve_chunks(query, table, limit=3, index_key=None, use_vectors=True, lexical=None):
+    lexical, confident = lexical or lexical_candidates(query, table, index_key)
+    if confident or not use_vectors:
+        return lexical[:limit]
     try:
-        query_embedding = create_embedding(query_text)
-        results = table.search(query_embedding).limit(limit).to_pandas()
-        return results
-    except Exception as e:
-        raise
+        vector = search_in_table(query, table, limit=HYBRID_CANDIDATES)
+    except Exception:
+        # Бэкенд эмбеддингов недоступен: отвечаем по результатам BM25, если они есть
+        if not lexical:
+            raise
+        logger.warning("Векторный поиск не удался, используются только результаты BM25", exc_info=True)
+        return lexical[:limit]
+    return reciprocal_rank_fusion([lexical, vector], limit)
 
 
+# Таблицы с векторами другого бэкенда (предупреждение пишется один раз)
+_incompatible_tables = set()
+
 # Поиск в векторной БД
-def search_in_vector_db(query, db_path="lancedb", table_name="pdf_docs"):
+def search_in_vector_db(query, db_path="lancedb", table_name="pdf_docs", stream=False):
     try:
-        # Подключаемся к базе данных
+        # Берём общий для всех потоков дескриптор таблицы
         if not db_path:
             db_path = "lancedb"
             
-        db = lancedb.connect(db_path)
-        table = db.open_table(table_name)
+        table = get_table(db_path, table_name)
+        use_vectors = is_compatible(table)
+        if not use_vectors and (db_path, table_name) not in _incompatible_tables:
+            _incompatible_tables.add((db_path, table_name))
+            logger.warning("Векторы %s построены другим бэкендом эмбеддингов, используется только поиск по тексту", table_name)
+        
+        # Уверенный ответ BM25 не требует эмбеддинга вопроса - кеш ответов при этом не проверяется
+        lexical = lexical_candidates(query, table, (db_path, table_name))
+        
+        # Похожий вопрос по тем же фрагментам уже задавали - отвечаем из кеша
+        cache = answer_caches.get(db_path, table_name) if ANSWER_CACHE_ENABLED and use_vectors and not lexical[1] else None
+        query_vector = None
+        if cache is not None:
+            try:
+                query_vector = create_query_embedding(query)
+            except Exception:
+                logger.warning("Не удалось получить эмбеддинг вопроса, кеш ответов пропущен", exc_info=True)
+                # Повторять запрос к бэкенду в векторном поиске бессмысленно, если BM25 что-то нашёл
+                use_vectors = not lexical[0]
+            cached = cache.lookup(query_vector, table) if query_vector is not None else None
+            if cached is not None:
+                return cached
         
         # Выполняем поиск
-        results = search_in_table(query, table, limit=3)
+        results = retrieve_chunks(query, table, limit=3, index_key=(db_path, table_name), use_vectors=use_vectors, lexical=lexical)
         
-        if results is None or len(results) == 0:
+        if not results:
             return "Не удалось найти ответ в векторной базе данных"
         
+        chunk_hashes = [r.get('content_hash') for r in results]
+        
+        def remember(answer):
+            if query_vector is not None and all(chunk_hashes):
+                cache.store(query, query_vector, chunk_hashes, answer)
+        
         # Формируем контекст из найденных результатов
-        context = "\n\n".join(results['text'].tolist())
+        context = fit_chunks([r['text'] for r in results])
         
         # Создаем промпт и цепочку для генерации ответа
-        prompt = ChatPromptTemplate.from_messages([
+        prompt = chat_prompt([
             ("system", "Ответьте на вопрос пользователя на основе предоставленного контекста."),
             ("human", "Контекст:\n{context}\n\nВопрос: {query}")
         ])
         
-        chain = prompt | llm | StrOutputParser()
-        return chain.invoke({"context": context, "query": query})
+        if stream:
+            return _stream_or_fallback(run_chain(prompt, {"context": context, "query": query}, stream=True), remember)
+        answer = run_chain(prompt, {"context": context, "query": query})
+        remember(answer)
+        return answer
         
     except Exception as e:
         return "Не удалось найти ответ в векторной базе данных"
 
+# on_finish(answer) вызывается только для полностью полученного ответа
+def _stream_or_fallback(chunks, on_finish=None):
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    except Exception:
+        yield "\n\nНе удалось найти ответ в векторной базе данных"
+        return
+    if on_finish is not None:
+        on_finish("".join(parts))
+
 # Генерация теста
 def generate_test(topic_info):
-    prompt = ChatPromptTemplate.from_messages([
+    prompt = chat_prompt([
         ("system", """
         Создайте тест из 6-10 вопросов по теме. Для каждого вопроса предоставьте 4 варианта ответа и укажите правильный.
         Формат: вопрос | вариант1 | вариант2 | вариант3 | вариант4 | правильный_ответ
         """),
         ("human", "Тема: {topic}")
     ])
-    chain = prompt | llm | StrOutputParser()
-    test = chain.invoke({"topic": topic_info})
-    return [q.split("|") for q in test.split("\n") if q.strip()]
+    test = run_chain(prompt, {"topic": topic_info})
+    return parse_test(test)
 
-# Генерация графа курса
+# Разбор ответа модели: оставляем только корректные вопросы
+# (4 варианта, правильный ответ совпадает с одним из них)
+def parse_test(text):
+    questions = []
+    for line in text.split("\n"):
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) != 6 or not all(fields):
+            continue
+        question, options, correct = fields[0], fields[1:5], fields[5]
+        # Номер варианта - только если ответ не совпадает ни с одним вариантом (варианты могут быть числами)
+        if correct not in options and correct.isdigit() and 1 <= int(correct) <= 4:
+            correct = options[int(correct) - 1]
+        if correct not in options or len(set(options)) != 4:
+            continue
+        questions.append([question, *options, correct])
+    return questions
+
+# Генерация графа курса (PNG кешируется до изменения оценок пользователя)
 def generate_course_graph(course_id, user_id):
-    topics = get_course_topics(course_id)
-    progress = get_user_progress(user_id, course_id)
-    
-    G = nx.DiGraph()
-    pos = {}
-    
-    for i, topic in enumerate(topics):
-        topic_id = topic['topic_id']
-        progress_data = next((p for p in progress if p['topic_id'] == topic_id), None)
-        mark = progress_data['mark'] if progress_data else 0
-        
-        # Цвет в зависимости от прогресса
-        if mark == None:
-            color = '#ff0000'
-        else:
-            color = '#ff0000' if mark < 50 else '#ff9900' if mark < 80 else '#00aa00'
-        
-        G.add_node(topic['topic_name'], color=color, mark=mark)
-        if i > 0:
-            G.add_edge(topics[i-1]['topic_name'], topic['topic_name'])
-        
-        pos[topic['topic_name']] = (i, -i*0.5)
-    
-    plt.figure(figsize=(12, 8))
-    colors = [G.nodes[n]['color'] for n in G.nodes()]
-    labels = {n: f"{n}\n({G.nodes[n]['mark']}%)" for n in G.nodes()}
-    
-    nx.draw(G, pos, with_labels=True, labels=labels, node_size=3000, 
-            node_color=colors, font_size=8, font_weight='bold', 
-            arrowsize=20, edge_color='gray')
-    
-    img_bytes = BytesIO()
-    plt.savefig(img_bytes, format='png')
-    plt.close()
-    img_bytes.seek(0)
-    return img_bytes
+    return course_graph_png(
+        course_id, user_id, catalog.snapshot().version,
+        lambda: get_course_topics(course_id),
+        lambda: get_user_progress(user_id, course_id)
+    )
 
 # Объяснение темы
-def explain_topic(topic_info):
-    prompt = ChatPromptTemplate.from_messages([
+def explain_topic(topic_info, stream=False):
+    prompt = chat_prompt([
         ("system", """
         Вы - преподаватель. Объясните тему студенту:
         1. Начните с краткого определения
@@ -263,5 +498,34 @@ def explain_topic(topic_info):
         """),
         ("human", "Тема: {topic}")
     ])
-    chain = prompt | llm | StrOutputParser()
-    return chain.invoke({"topic": topic_info})
+    return run_chain(prompt, {"topic": topic_info}, stream)
+
+# Наводящие вопросы в режиме решения задач
+def solve_problem_step(dialog, stream=False):
+    prompt = chat_prompt([
+        ("system", """
+        Вы - преподаватель. Помогите студенту решить задачу, задавая наводящие вопросы.
+        Не давайте готового решения, только направляйте.
+        Если студент прислал ответ на ваш предыдущий вопрос, проанализируйте его и задайте следующий уточняющий вопрос.
+        Будьте дружелюбны и терпеливы.
+        """),
+        ("human", "{problem}")
+    ])
+    return run_chain(prompt, {"problem": dialog}, stream)
+
+# Сжатие ранней части диалога в резюме (для памяти режима решения задач)
+def summarize_dialog(summary, turns):
+    prompt = chat_prompt([
+        ("system", "Кратко перескажите ход диалога преподавателя со студентом: условие задачи, "
+                   "что студент уже понял и на каком шаге остановились. Не более 5 предложений."),
+        ("human", "Предыдущее резюме:\n{summary}\n\nНовые реплики:\n{turns}")
+    ])
+    return run_chain(prompt, {"summary": summary or "-", "turns": turns})
+
+# Ответ на вопрос по выбранной теме курса
+def answer_topic_question(topic, question, stream=False):
+    prompt = chat_prompt([
+        ("system", f"Вы - преподаватель. Отвечайте на вопросы по теме '{topic}'."),
+        ("human", "{question}")
+    ])
+    return run_chain(prompt, {"question": question}, stream)
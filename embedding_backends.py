@@ -0,0 +1,249 @@
+import os
+import sys
+import math
+import zlib
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
+from collections import Counter
+import metrics
+from lexical_search import tokenize, STEMMER
+from rate_governor import embedding_governor
+from context_builder import count_tokens
+
+# Бэкенды эмбеддингов (EMBEDDING_BACKEND):
+#   openai  - text-embedding-3-large через API (по умолчанию)
+#   local   - локальная модель sentence-transformers из LOCAL_EMBEDDING_MODEL_PATH на CPU
+#   hashing - хеширующий TF-IDF кодировщик на NumPy, без сети и без модели
+# Каждая таблица LanceDB хранит в метаданных схемы, каким бэкендом и какой
+# размерности построены её векторы; векторы разных бэкендов не смешиваются.
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
+OPENAI_EMBEDDING_DIMENSIONS = int(os.getenv("OPENAI_EMBEDDING_DIMENSIONS", "1536"))
+LOCAL_EMBEDDING_MODEL_PATH = os.getenv("LOCAL_EMBEDDING_MODEL_PATH", "models/embedding")
+LOCAL_EMBEDDING_BATCH = int(os.getenv("LOCAL_EMBEDDING_BATCH", "64"))
+HASHING_DIMENSIONS = int(os.getenv("HASHING_EMBEDDING_DIMENSIONS", "1024"))
+# Веса IDF по корзинам (.npy), см. main: python embedding_backends.py fit-idf
+HASHING_IDF_PATH = os.getenv("HASHING_IDF_PATH", "")
+
+METADATA_KEYS = ("embedding_backend", "embedding_model", "embedding_dimensions")
+# Таблицы, созданные до появления метаданных, построены OpenAI-эмбеддингами
+LEGACY_BACKEND = ("openai", "text-embedding-3-large")
+
+
+class OpenAIBackend:
+    name = "openai"
+    # text-embedding-3 обучены как Matryoshka: префикс вектора - тоже эмбеддинг
+    matryoshka = True
+
+    def __init__(self, model=OPENAI_EMBEDDING_MODEL, dimensions=OPENAI_EMBEDDING_DIMENSIONS):
+        self.model = model
+        self.dimensions = dimensions
+        self._openai = None
+
+    def _client(self):
+        if self._openai is None:
+            from openai import OpenAI
+            # Повторы при 429 выполняет rate_governor, а не клиент
+            self._openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return self._openai
+
+    def transient_errors(self):
+        import openai
+        return (openai.APIConnectionError, openai.InternalServerError)
+
+    def embed(self, texts):
+        def request():
+            response = self._client().embeddings.create(model=self.model, input=texts, dimensions=self.dimensions)
+            # API не гарантирует порядок, поэтому сортируем по индексу
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+        key = hashlib.sha256("\x00".join([self.model, str(self.dimensions), *texts]).encode("utf-8")).hexdigest()
+        return embedding_governor.run(key, request, sum(count_tokens(t) for t in texts))
+
+
+class LocalModelBackend:
+    name = "local"
+    matryoshka = False
+
+    def __init__(self, path=LOCAL_EMBEDDING_MODEL_PATH, batch_size=LOCAL_EMBEDDING_BATCH):
+        self.path = path
+        self.model = os.path.basename(os.path.normpath(path))
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    # Модель загружается при первом обращении, а не при импорте
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.path, device="cpu")
+        return self._model
+
+    @property
+    def dimensions(self):
+        return self._load().get_sentence_embedding_dimension()
+
+    def transient_errors(self):
+        return ()
+
+    def embed(self, texts):
+        vectors = self._load().encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        )
+        return vectors.astype("float32").tolist()
+
+
+class HashingBackend:
+    name = "hashing"
+    matryoshka = False
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS, idf_path=HASHING_IDF_PATH):
+        self.dimensions = dimensions
+        self.idf_path = idf_path
+        self._idf = None
+        # Векторы зависят от стеммера (snowball или упрощённый), поэтому он входит в имя модели
+        self.model = f"hashing-{STEMMER}-{dimensions}"
+        if idf_path:
+            with open(idf_path, "rb") as f:
+                self.model += "-idf" + hashlib.sha256(f.read()).hexdigest()[:8]
+
+    def transient_errors(self):
+        return ()
+
+    def _weights(self):
+        if self._idf is None and self.idf_path:
+            import numpy as np
+            self._idf = np.load(self.idf_path).astype(np.float32)
+        return self._idf
+
+    # Признаки: основы слов и пары соседних основ; знак корзины берётся из старшего бита хеша
+    def features(self, text):
+        stems = tokenize(text)
+        return Counter(stems + [f"{a} {b}" for a, b in zip(stems, stems[1:])])
+
+    def _hash(self, feature):
+        h = zlib.crc32(feature.encode("utf-8"))
+        return h % self.dimensions, 1.0 if h & 0x80000000 else -1.0
+
+    def counts(self, texts):
+        import numpy as np
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, tf in self.features(text).items():
+                col, sign = self._hash(feature)
+                rows.append(row)
+                cols.append(col)
+                values.append(sign * (1.0 + math.log(tf)))
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)),
+                  np.asarray(values, dtype=np.float32))
+        return matrix
+
+    def embed(self, texts):
+        import numpy as np
+        matrix = self.counts(texts)
+        idf = self._weights()
+        if idf is not None:
+            matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        return matrix.tolist()
+
+
+# IDF по корзинам хеширующего кодировщика: log((1 + N) / (1 + df)) + 1
+def fit_idf(texts, backend):
+    import numpy as np
+    df = np.zeros(backend.dimensions, dtype=np.float64)
+    total = 0
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) >= 1024:
+            df += (backend.counts(batch) != 0).sum(axis=0)
+            total += len(batch)
+            batch = []
+    if batch:
+        df += (backend.counts(batch) != 0).sum(axis=0)
+        total += len(batch)
+    return (np.log((1 + total) / (1 + df)) + 1).astype(np.float32)
+
+
+BACKENDS = {"openai": OpenAIBackend, "local": LocalModelBackend, "hashing": HashingBackend}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name=EMBEDDING_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный EMBEDDING_BACKEND: {name}")
+    return BACKENDS[name]()
+
+
+def embed(texts, backend=None):
+    backend = backend or get_backend()
+    texts = list(texts)
+    with metrics.span("embedding", backend=backend.name):
+        return backend.embed(texts)
+
+
+def backend_metadata(backend=None):
+    backend = backend or get_backend()
+    return {
+        "embedding_backend": backend.name,
+        "embedding_model": backend.model,
+        "embedding_dimensions": str(backend.dimensions),
+    }
+
+
+# Метаданные таблицы: из схемы, а для старых таблиц - по размерности колонки vector
+def table_metadata(table, column="vector"):
+    metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+    if all(key in metadata for key in METADATA_KEYS):
+        return {key: metadata[key] for key in METADATA_KEYS}
+    return {
+        "embedding_backend": LEGACY_BACKEND[0],
+        "embedding_model": LEGACY_BACKEND[1],
+        "embedding_dimensions": str(table.schema.field(column).type.list_size),
+    }
+
+
+def is_compatible(table, backend=None, column="vector"):
+    return table_metadata(table, column) == backend_metadata(backend)
+
+
+def describe(metadata):
+    return f"{metadata['embedding_backend']}/{metadata['embedding_model']} ({metadata['embedding_dimensions']})"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бэкенды эмбеддингов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="показать бэкенд таблицы и текущий бэкенд")
+    fit = commands.add_parser("fit-idf", help="посчитать IDF хеширующего кодировщика по таблице фрагментов")
+    for command in (show, fit):
+        command.add_argument("--db-path", default=os.getenv("LANCE_DB_PATH") or "lancedb")
+        command.add_argument("--table", default="pdf_docs")
+    fit.add_argument("--out", required=True, help="файл .npy для HASHING_IDF_PATH")
+    args = parser.parse_args(argv)
+
+    import lancedb
+    table = lancedb.connect(args.db_path).open_table(args.table)
+    if args.command == "show":
+        print(f"Таблица {args.table}: {describe(table_metadata(table))}")
+        print(f"Текущий бэкенд: {describe(backend_metadata())}")
+        return 0 if is_compatible(table) else 1
+
+    import numpy as np
+    backend = HashingBackend(idf_path="")
+    texts = (row["text"] for batch in table.to_lance().to_batches(columns=["text"]) for row in batch.to_pylist())
+    np.save(args.out, fit_idf(texts, backend))
+    print(f"IDF сохранён в {args.out}; векторы таблиц с другим HASHING_IDF_PATH нужно пересчитать")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+
+# Двухуровневый кеш эмбеддингов запросов: LRU в памяти + SQLite на диске
+
+MEMORY_MAX_ITEMS = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+MEMORY_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "3600"))
+DISK_TTL = float(os.getenv("EMBEDDING_CACHE_DISK_TTL", str(30 * 24 * 3600)))
+DISK_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+# Просроченные записи удаляются при открытии базы и раз в столько записей
+DISK_PURGE_EVERY = int(os.getenv("EMBEDDING_CACHE_PURGE_EVERY", "1000"))
+
+
+# Нормализация текста вопроса: регистр и пробелы не влияют на ключ
+def normalize_query(text):
+    return " ".join(text.casefold().replace("ё", "е").split())
+
+
+def cache_key(text, model, dimensions):
+    raw = f"{model}\x00{dimensions}\x00{normalize_query(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_items=MEMORY_MAX_ITEMS, ttl=MEMORY_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteEmbeddingStore:
+    def __init__(self, path=DISK_PATH, ttl=DISK_TTL, purge_every=DISK_PURGE_EVERY):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+    # Файл базы открывается при первом обращении, а не при импорте
+    @property
+    def _conn(self):
+        if self._db is None:
+            self._db = self._open()
+        return self._db
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embedding (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("DELETE FROM query_embedding WHERE created_at < ?", (time.time() - self.ttl,))
+        conn.commit()
+        return conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM query_embedding WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] + self.ttl < time.time():
+            return None
+        return array("f", row[0]).tolist()
+
+    def set(self, key, vector):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embedding (key, vector, created_at) VALUES (?, ?, ?)",
+                (key, array("f", vector).tobytes(), time.time())
+            )
+            self._conn.commit()
+            self._writes += 1
+            purge = self.purge_every > 0 and self._writes % self.purge_every == 0
+        if purge:
+            self.purge_expired()
+
+    def purge_expired(self):
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM query_embedding WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+
+class EmbeddingCache:
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory or LRUCache()
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get_or_compute(self, text, model, dimensions, compute):
+        key = cache_key(text, model, dimensions)
+        vector = self.memory.get(key)
+        if vector is not None:
+            self._count("memory_hits")
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self._count("disk_hits")
+                self.memory.set(key, vector)
+                return vector
+        self._count("misses")
+        vector = compute(text)
+        self.memory.set(key, vector)
+        if self.disk is not None:
+            self.disk.set(key, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            total = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_items": len(self.memory),
+            }
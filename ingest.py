@@ -0,0 +1,249 @@
+import os
+import sys
+import argparse
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import lancedb
+from pypdf import PdfReader
+from tenacity import Retrying, stop_after_attempt, wait_exponential, retry_if_exception_type
+from education_bot import create_embeddings
+from embedding_backends import get_backend, backend_metadata, table_metadata, is_compatible, describe
+from vector_index import ensure_index
+from compact_vectors import COMPACT_COLUMN, compact_field, compact_width, supports_compact, truncate
+
+# Параметры загрузки (можно переопределить через переменные окружения)
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "200"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "128"))
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", "2048"))
+
+TABLE_NAME = "pdf_docs"
+
+
+# В метаданных схемы записывается бэкенд и размерность эмбеддингов (см. embedding_backends)
+def pdf_docs_schema():
+    backend = get_backend()
+    fields = [
+        pa.field("vector", pa.list_(pa.float32(), backend.dimensions)),
+        pa.field("text", pa.string()),
+        pa.field("source", pa.string()),
+        pa.field("page", pa.int32()),
+        pa.field("chunk_id", pa.string()),
+        pa.field("content_hash", pa.string()),
+    ]
+    if supports_compact(backend.matryoshka, backend.dimensions):
+        fields.append(compact_field())
+    return pa.schema(fields, metadata=backend_metadata(backend))
+
+
+# Хеш фрагмента: зависит от файла и текста, но не от позиции,
+# поэтому сдвиг текста по страницам не вызывает повторного эмбеддинга
+def chunk_hash(source, text):
+    return hashlib.sha256(f"{source}\x00{text}".encode("utf-8")).hexdigest()
+
+
+# Разбиение текста страницы на перекрывающиеся фрагменты по границам слов
+def split_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    text = " ".join(text.split())
+    if not text:
+        return
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start + chunk_size // 2, end)
+            if space != -1:
+                end = space
+        yield text[start:end].strip()
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+
+
+# Постраничное чтение PDF: в памяти одновременно находится только одна страница.
+# source - путь относительно каталога загрузки, чтобы одноимённые файлы из разных
+# подкаталогов не вытесняли фрагменты друг друга при prune
+def iter_pdf_chunks(path, root=None):
+    source = os.path.relpath(path, root or os.path.dirname(path) or ".").replace(os.sep, "/")
+    reader = PdfReader(path)
+    for page_number, page in enumerate(reader.pages, start=1):
+        page_text = page.extract_text() or ""
+        for i, text in enumerate(split_text(page_text)):
+            if text:
+                yield {
+                    "text": text,
+                    "source": source,
+                    "page": page_number,
+                    "chunk_id": f"{source}:{page_number}:{i}",
+                    "content_hash": chunk_hash(source, text),
+                }
+
+
+# (путь к PDF, каталог загрузки, относительно которого считается source)
+def iter_pdf_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(".pdf"):
+                        yield os.path.join(root, name), path
+        elif path.lower().endswith(".pdf"):
+            yield path, os.path.dirname(path) or "."
+
+
+# 429 повторяет rate_governor; здесь - только сетевые сбои бэкенда (у локальных их нет)
+def embed_batch(chunks, compact=0):
+    for attempt in Retrying(
+        stop=stop_after_attempt(5),
+        wait=wait_exponential(multiplier=1, min=1, max=60),
+        retry=retry_if_exception_type(get_backend().transient_errors())
+    ):
+        with attempt:
+            vectors = create_embeddings([c["text"] for c in chunks])
+    for chunk, vector in zip(chunks, vectors):
+        chunk["vector"] = vector
+        if compact:
+            chunk[COMPACT_COLUMN] = truncate(vector, compact)
+    return chunks
+
+
+def open_or_create_table(db):
+    if TABLE_NAME not in db.table_names():
+        return db.create_table(TABLE_NAME, schema=pdf_docs_schema())
+    table = db.open_table(TABLE_NAME)
+    if not is_compatible(table):
+        raise SystemExit(
+            f"Таблица {TABLE_NAME} построена эмбеддингами {describe(table_metadata(table))}, "
+            f"текущий бэкенд - {describe(backend_metadata())}. Выберите тот же EMBEDDING_BACKEND "
+            f"или загрузите лекции в новую базу (--db-path)"
+        )
+    return table
+
+
+# Хеши уже проиндексированных фрагментов (читаем только одну колонку)
+def load_existing_hashes(table):
+    if table.count_rows() == 0:
+        return set()
+    column = table.to_lance().to_table(columns=["content_hash"]).column("content_hash")
+    return set(column.to_pylist())
+
+
+class Ingestor:
+    def __init__(self, table, existing_hashes):
+        self.table = table
+        self.existing_hashes = existing_hashes
+        # Таблицы, созданные до появления vector_small, пополняются без неё (см. compact_vectors.py);
+        # ширина vector_small - как в схеме таблицы
+        self.compact = compact_width(table)
+        self.seen_hashes = set()
+        self.sources = set()
+        self.embedded = 0
+        self.skipped = 0
+        self._pending = []
+        self._rows = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(EMBED_CONCURRENCY * 2)
+        self._pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY)
+        self.errors = []
+
+    def add(self, chunk):
+        self.sources.add(chunk["source"])
+        if chunk["content_hash"] in self.seen_hashes:
+            return
+        self.seen_hashes.add(chunk["content_hash"])
+        if chunk["content_hash"] in self.existing_hashes:
+            self.skipped += 1
+            return
+        self._pending.append(chunk)
+        if len(self._pending) >= EMBED_BATCH_SIZE:
+            self._submit()
+
+    # Ограничиваем число пакетов "в полёте", чтобы не держать весь корпус в памяти
+    def _submit(self):
+        batch, self._pending = self._pending, []
+        self._slots.acquire()
+        future = self._pool.submit(embed_batch, batch, self.compact)
+        future.add_done_callback(self._on_embedded)
+        self._write_ready()
+
+    # Колбэк только передаёт строки основному потоку: запись в LanceDB идёт в add/finish
+    def _on_embedded(self, future):
+        try:
+            rows = future.result()
+        except Exception as e:
+            with self._lock:
+                self.errors.append(e)
+        else:
+            with self._lock:
+                self._rows.extend(rows)
+        finally:
+            self._slots.release()
+
+    def _write_ready(self, force=False):
+        with self._lock:
+            if not self._rows or (not force and len(self._rows) < WRITE_BATCH_SIZE):
+                return
+            rows, self._rows = self._rows, []
+        self.table.add(rows)
+        self.embedded += len(rows)
+
+    def finish(self):
+        if self._pending:
+            self._submit()
+        self._pool.shutdown(wait=True)
+        self._write_ready(force=True)
+        if self.errors:
+            raise self.errors[0]
+
+    # Удаляем фрагменты изменившихся или удалённых страниц обработанных файлов
+    def prune(self, prune_all=False):
+        stale = self.existing_hashes - self.seen_hashes
+        if not stale:
+            return 0
+        if not prune_all:
+            rows = self.table.to_lance().to_table(columns=["source", "content_hash"]).to_pylist()
+            stale = {r["content_hash"] for r in rows
+                     if r["source"] in self.sources and r["content_hash"] in stale}
+        stale = sorted(stale)
+        for i in range(0, len(stale), 500):
+            values = ", ".join(f"'{h}'" for h in stale[i:i + 500])
+            self.table.delete(f"content_hash IN ({values})")
+        return len(stale)
+
+
+def ingest(paths, db_path, prune_all=False):
+    db = lancedb.connect(db_path)
+    table = open_or_create_table(db)
+    ingestor = Ingestor(table, load_existing_hashes(table))
+    try:
+        for pdf_path, root in iter_pdf_files(paths):
+            print(f"Обработка {pdf_path}...")
+            for chunk in iter_pdf_chunks(pdf_path, root):
+                ingestor.add(chunk)
+    finally:
+        ingestor.finish()
+    # Удаление выполняем только после успешной загрузки всех пакетов
+    removed = ingestor.prune(prune_all=prune_all)
+    if ensure_index(table):
+        print("ANN-индекс перестроен")
+    if ingestor.compact and ensure_index(table, COMPACT_COLUMN):
+        print(f"ANN-индекс по {COMPACT_COLUMN} перестроен")
+    print(f"Добавлено фрагментов: {ingestor.embedded}, без изменений: {ingestor.skipped}, удалено: {removed}")
+    return ingestor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Загрузка PDF-лекций в таблицу pdf_docs LanceDB")
+    parser.add_argument("paths", nargs="+", help="PDF-файлы или каталоги с PDF")
+    parser.add_argument("--db-path", default=os.getenv("LANCE_DB_PATH") or "lancedb")
+    parser.add_argument("--prune-all", action="store_true",
+                        help="удалить фрагменты файлов, которых нет среди переданных путей")
+    args = parser.parse_args(argv)
+    ingest(args.paths, args.db_path, prune_all=args.prune_all)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import os
+import threading
+from datetime import timedelta
+
+# Реестр долгоживущих подключений и таблиц LanceDB.
+# Таблица открывается один раз и разделяется между потоками обработчиков;
+# новые версии после загрузки данных подхватываются не чаще, чем раз в
+# LANCE_RELOAD_INTERVAL секунд (read_consistency_interval LanceDB).
+
+RELOAD_INTERVAL = float(os.getenv("LANCE_RELOAD_INTERVAL", "10"))
+
+
+class TableRegistry:
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._connections = {}
+        self._tables = {}
+        self._versions = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def connection(self, db_path):
+        db = self._connections.get(db_path)
+        if db is None:
+            with self._lock:
+                db = self._connections.get(db_path)
+                if db is None:
+                    import lancedb
+                    db = lancedb.connect(
+                        db_path,
+                        read_consistency_interval=timedelta(seconds=self.reload_interval)
+                    )
+                    self._connections[db_path] = db
+        return db
+
+    def get_table(self, db_path, table_name):
+        key = (db_path, table_name)
+        table = self._tables.get(key)
+        if table is None:
+            with self._lock:
+                table = self._tables.get(key)
+                if table is None:
+                    table = self.connection(db_path).open_table(table_name)
+                    self._tables[key] = table
+                    self._versions[key] = table.version
+        self._check_version(key, table)
+        return table
+
+    # Подписка на смену версии таблицы (перестроение индексов, сброс кешей)
+    def on_version_change(self, callback):
+        self._listeners.append(callback)
+
+    def _check_version(self, key, table):
+        version = table.version
+        if version == self._versions.get(key):
+            return
+        with self._lock:
+            previous = self._versions.get(key)
+            if version == previous:
+                return
+            self._versions[key] = version
+        for callback in self._listeners:
+            callback(key[0], key[1], table, previous, version)
+
+    # Принудительно перечитать последнюю версию (например, сразу после ingest)
+    def reload(self, db_path, table_name):
+        table = self._tables.get((db_path, table_name))
+        if table is not None:
+            table.checkout_latest()
+            self._check_version((db_path, table_name), table)
+        return table
+
+    def forget(self, db_path, table_name):
+        with self._lock:
+            self._tables.pop((db_path, table_name), None)
+            self._versions.pop((db_path, table_name), None)
+
+
+registry = TableRegistry()
+
+
+def get_table(db_path, table_name):
+    return registry.get_table(db_path, table_name)
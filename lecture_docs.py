@@ -0,0 +1,212 @@
+import os
+import re
+import codecs
+import hashlib
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from xml.etree.ElementTree import iterparse
+import metrics
+from embedding_cache import LRUCache
+from context_builder import count_tokens, truncate_tokens
+
+# Конспекты длинных лекций: потоковое скачивание документа из Telegram во временный файл,
+# чтение PDF/DOCX/TXT по частям, разбиение на фрагменты по токенам и map-reduce:
+# фрагменты конспектируются параллельно, частичные конспекты сводятся иерархически.
+# Готовые конспекты и конспекты фрагментов кешируются по хешу содержимого.
+
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "3000"))
+# Текст до этого размера конспектируется одним запросом, как раньше
+SUMMARY_DIRECT_TOKENS = int(os.getenv("SUMMARY_DIRECT_TOKENS", "6000"))
+# Предел суммарного размера частичных конспектов на входе одного шага сведения
+SUMMARY_REDUCE_TOKENS = int(os.getenv("SUMMARY_REDUCE_TOKENS", "6000"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "8"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "2048"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", str(7 * 24 * 3600)))
+MAX_DOCUMENT_BYTES = int(os.getenv("MAX_DOCUMENT_BYTES", str(20 * 1024 * 1024)))  # предел getFile в Bot API
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+TEXT_READ_CHARS = 64 * 1024
+
+DOCUMENT_KINDS = {".pdf": "pdf", ".docx": "docx", ".txt": "txt", ".md": "txt"}
+TELEGRAM_FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
+
+summary_cache = LRUCache(max_items=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+
+
+def document_kind(file_name, mime_type=None):
+    kind = DOCUMENT_KINDS.get(os.path.splitext(file_name or "")[1].lower())
+    if kind is None and mime_type == "application/pdf":
+        kind = "pdf"
+    if kind is None and (mime_type or "").startswith("text/"):
+        kind = "txt"
+    return kind
+
+
+# Скачивание файла из Telegram частями (bot.download_file держит весь файл в памяти).
+# Возвращает путь к временному файлу и sha256 содержимого; файл удаляет вызывающий
+def download_document(bot, document, timeout=60):
+    import requests
+    from telebot import apihelper
+    if document.file_size and document.file_size > MAX_DOCUMENT_BYTES:
+        raise ValueError(f"Файл больше {MAX_DOCUMENT_BYTES // (1024 * 1024)} МБ")
+    file_info = bot.get_file(document.file_id)
+    url = (apihelper.FILE_URL or TELEGRAM_FILE_URL).format(bot.token, file_info.file_path)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="lecture-", suffix=os.path.splitext(document.file_name or "")[1])
+    try:
+        with os.fdopen(fd, "wb") as out, requests.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for block in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                size += len(block)
+                if size > MAX_DOCUMENT_BYTES:
+                    raise ValueError(f"Файл больше {MAX_DOCUMENT_BYTES // (1024 * 1024)} МБ")
+                digest.update(block)
+                out.write(block)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_pdf(path):
+    from pypdf import PdfReader
+    for page in PdfReader(path).pages:
+        yield page.extract_text() or ""
+
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+# DOCX читается потоковым разбором word/document.xml, без python-docx и без дерева в памяти
+def _iter_docx(path):
+    with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+        parts = []
+        for event, element in iterparse(xml, events=("end",)):
+            if element.tag == _W_NS + "t":
+                parts.append(element.text or "")
+            elif element.tag == _W_NS + "tab":
+                parts.append("\t")
+            elif element.tag == _W_NS + "p":
+                yield "".join(parts) + "\n"
+                parts = []
+                element.clear()
+
+
+# Кодировка определяется по началу файла: UTF-8, иначе cp1251
+def _text_encoding(path):
+    with open(path, "rb") as f:
+        sample = f.read(TEXT_READ_CHARS)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1251"
+
+
+def _iter_txt(path):
+    with open(path, encoding=_text_encoding(path), errors="replace") as f:
+        for block in iter(lambda: f.read(TEXT_READ_CHARS), ""):
+            yield block
+
+
+def iter_document_text(path, kind):
+    readers = {"pdf": _iter_pdf, "docx": _iter_docx, "txt": _iter_txt}
+    return readers[kind](path)
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+# Фрагменты не длиннее chunk_tokens, по границам предложений и абзацев
+def iter_chunks(segments, chunk_tokens=SUMMARY_CHUNK_TOKENS):
+    current = []
+    current_tokens = 0
+    tail = ""
+    for segment in segments:
+        pieces = _SENTENCE_END.split(tail + segment)
+        # Последний кусок может быть оборван на границе блока чтения
+        tail = pieces.pop()
+        if len(tail) > TEXT_READ_CHARS:
+            # Текст без знаков препинания и переносов режется как есть
+            pieces.append(tail)
+            tail = ""
+        for piece in pieces:
+            piece = piece.strip()
+            if not piece:
+                continue
+            cost = count_tokens(piece) + 1
+            if current and current_tokens + cost > chunk_tokens:
+                yield " ".join(current)
+                current, current_tokens = [], 0
+            while cost > chunk_tokens:
+                head = truncate_tokens(piece, chunk_tokens)
+                yield head
+                piece = piece[len(head):].strip()
+                cost = count_tokens(piece) + 1
+            if piece:
+                current.append(piece)
+                current_tokens += cost
+    if tail.strip():
+        current.append(tail.strip())
+    if current:
+        yield " ".join(current)
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Map: конспекты фрагментов в исходном порядке. Фрагменты читаются из итератора
+# по мере освобождения воркеров, поэтому документ целиком в памяти не держится
+def map_chunks(chunks, summarize, workers=SUMMARY_WORKERS):
+    results = []
+
+    def run(index, chunk):
+        key = "chunk:" + text_hash(chunk)
+        summary = summary_cache.get(key)
+        if summary is None:
+            summary = summarize(chunk)
+            summary_cache.set(key, summary)
+        return index, summary
+
+    # Потоки пула отчитываются в метриках от имени обработчика, запустившего конспект
+    bound = metrics.bind_handler(run)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary") as pool:
+        pending = set()
+        for index, chunk in enumerate(chunks):
+            pending.add(pool.submit(bound, index, chunk))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+        results.extend(future.result() for future in pending)
+    return [summary for _, summary in sorted(results)]
+
+
+# Reduce: соседние частичные конспекты объединяются группами в пределах бюджета,
+# пока всё не поместится в один запрос
+def reduce_summaries(summaries, combine, budget=SUMMARY_REDUCE_TOKENS, workers=SUMMARY_WORKERS):
+    while len(summaries) > 1 and sum(count_tokens(s) for s in summaries) > budget:
+        groups = [[]]
+        group_tokens = 0
+        for summary in summaries:
+            cost = count_tokens(summary)
+            if groups[-1] and group_tokens + cost > budget:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += cost
+        if len(groups) == len(summaries):
+            # Каждый конспект сам по себе занимает весь бюджет: сводим попарно
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary") as pool:
+            summaries = list(pool.map(metrics.bind_handler(combine), groups))
+    return summaries
@@ -0,0 +1,186 @@
+import os
+import re
+import math
+import heapq
+import logging
+import threading
+from collections import Counter, defaultdict
+
+# Локальный полнотекстовый индекс BM25 по фрагментам pdf_docs с русской токенизацией
+# и стеммингом, а также слияние лексической и векторной выдачи (reciprocal rank fusion).
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Порог уверенности лексического поиска, при котором эмбеддинг запроса не вычисляется:
+# все значимые слова запроса есть в лучшем фрагменте, и он заметно опережает второй
+LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", "1.0"))
+LEXICAL_MIN_MARGIN = float(os.getenv("LEXICAL_MIN_MARGIN", "1.5"))
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", "3.0"))
+
+STOPWORDS = set("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было
+вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас
+нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их
+чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при
+наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве три
+эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно
+всю между это такое такие такая зачем почему объясни расскажи
+the a an of to in is are and or for what how
+""".split())
+
+# Окончания для упрощённого стемминга, если snowballstemmer не установлен (от длинных к коротким)
+_ENDINGS = sorted("""
+иями ями ами ией ием иях ях ах ов ев ей ий ый ой ая яя ое ее ие ые ого его ому ему ыми ими ую юю
+ом ем ам ям ой ей ть ться тся ешь ет ем ете ут ют ит им ите ат ят ал ала али ало ил ила или ило
+ость ости ение ения ению ением ении ия ие ью а я о е и ы у ю ь
+""".split(), key=len, reverse=True)
+
+
+def _load_stemmer():
+    try:
+        import snowballstemmer
+        return snowballstemmer.stemmer("russian").stemWord
+    except ImportError:
+        return None
+
+
+_snowball = _load_stemmer()
+STEMMER = "snowball" if _snowball is not None else "suffix"
+
+
+def stem(word):
+    if _snowball is not None:
+        return _snowball(word)
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    words = _TOKEN.findall(text.casefold().replace("ё", "е"))
+    return [stem(w) for w in words if w not in STOPWORDS and len(w) > 1]
+
+
+class BM25Index:
+    def __init__(self, docs):
+        # docs - список словарей с ключами text и (необязательно) content_hash
+        self.docs = docs
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_id, doc in enumerate(docs):
+            counts = Counter(tokenize(doc["text"]))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((doc_id, tf))
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if docs else 0.0
+        self.idf = {
+            term: math.log(1 + (len(docs) - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self.postings.items()
+        }
+
+    def search(self, query, k=10):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.docs:
+            return [], terms
+        scores = defaultdict(float)
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.docs[doc_id], score) for doc_id, score in top], terms
+
+    # Доля значимых слов запроса, встречающихся во фрагменте
+    def coverage(self, terms, doc):
+        doc_terms = set(tokenize(doc["text"]))
+        return sum(1 for t in terms if t in doc_terms) / len(terms) if terms else 0.0
+
+    def is_confident(self, results, terms):
+        if not results:
+            return False
+        top_score = results[0][1]
+        second_score = results[1][1] if len(results) > 1 else 0.0
+        return (top_score >= LEXICAL_MIN_SCORE
+                and top_score >= LEXICAL_MIN_MARGIN * second_score
+                and self.coverage(terms, results[0][0]) >= LEXICAL_MIN_COVERAGE)
+
+
+def _read_docs(table):
+    columns = ["text"]
+    if "content_hash" in table.schema.names:
+        columns.append("content_hash")
+    try:
+        data = table.to_lance().to_table(columns=columns)
+    except (AttributeError, ImportError):
+        data = table.to_arrow().select(columns)
+    return data.to_pylist()
+
+
+# Индексы по таблицам; перестраиваются при смене версии таблицы,
+# пока идёт перестроение, запросы обслуживает прежний индекс
+class LexicalIndexRegistry:
+    def __init__(self):
+        self._indexes = {}
+        self._building = set()
+        self._lock = threading.Lock()
+
+    def _build(self, key, table, version):
+        try:
+            index = BM25Index(_read_docs(table))
+            with self._lock:
+                self._indexes[key] = (version, index)
+        except Exception:
+            logger.exception("Не удалось построить полнотекстовый индекс %s", key)
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    def get(self, key, table):
+        version = table.version
+        with self._lock:
+            current = self._indexes.get(key)
+            if current is not None and current[0] == version:
+                return current[1]
+            start = key not in self._building
+            if start:
+                self._building.add(key)
+        if current is None:
+            # Первое построение выполняем синхронно, чтобы сразу было чем отвечать
+            if start:
+                self._build(key, table, version)
+            current = self._indexes.get(key)
+            return current[1] if current else None
+        if start:
+            threading.Thread(target=self._build, args=(key, table, version), daemon=True).start()
+        return current[1]
+
+
+lexical_indexes = LexicalIndexRegistry()
+
+
+def doc_key(doc):
+    return doc.get("content_hash") or doc["text"]
+
+
+# Reciprocal rank fusion: score = sum(1 / (RRF_K + rank)) по всем спискам
+def reciprocal_rank_fusion(result_lists, limit):
+    scores = defaultdict(float)
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc_key(doc)
+            scores[key] += 1.0 / (RRF_K + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [docs[key] for key in ranked[:limit]]
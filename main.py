@@ -1,28 +1,75 @@
 import os
+import logging
 import telebot
-from telebot import types
+from telebot import types, apihelper
 from education_bot import *
+import dispatcher
+from streaming import reply_with
+from context_builder import new_memory, add_turn, dialog_context, compact_memory
+from quiz_bank import quiz_bank
+from write_behind import write_queue
+import metrics
+from rate_governor import chat_governor, embedding_governor
+from session_store import create_backend, SessionMap, SessionHandlerBackend
+import lecture_docs
+
+logger = logging.getLogger(__name__)
+
+# Адрес Bot API можно подменить локальным сервером (например, заглушкой Telegram в тестах)
+if os.getenv("TELEGRAM_API_URL"):
+    apihelper.API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Хранилище сессий (SESSION_BACKEND): общее для всех процессов бота и переживает перезапуск
+session_backend = create_backend()
+
+# Обработчики выполняются в пуле dispatcher с порядком обновлений внутри пользователя;
+# next-step обработчики хранятся в хранилище сессий и восстанавливаются по имени функции
+bot = telebot.TeleBot(
+    os.getenv("TELEGRAM_BOT_TOKEN"),
+    threaded=False,
+    next_step_backend=SessionHandlerBackend(session_backend, lambda name: globals()[name])
+)
+update_executor = dispatcher.install(bot, dispatcher.KeyedExecutor())
+
+# Замеры времени обработчиков и запросов к Bot API, эндпоинт /metrics на METRICS_PORT
+metrics.instrument_bot(bot)
+metrics.instrument_telegram(apihelper)
+metrics.register_gauges(
+    "dispatcher", "Состояние очереди обработки обновлений",
+    lambda: {(("field", k),): v for k, v in update_executor.metrics().items()}
+)
+metrics.register_gauges(
+    "openai_governor", "Очередь и лимиты запросов к OpenAI",
+    lambda: {
+        (("governor", g.name), ("field", k)): v
+        for g in (chat_governor, embedding_governor) for k, v in g.stats().items()
+    }
+)
+metrics.register_gauges(
+    "answer_cache", "Счётчики семантического кеша ответов",
+    lambda: {
+        (("table", table), ("field", k)): v
+        for table, stats in answer_caches.stats().items() for k, v in stats.items()
+    }
+)
+metrics.register_gauges(
+    "query_embedding_cache", "Счётчики кеша эмбеддингов вопросов",
+    lambda: {(("field", k),): v for k, v in query_embedding_cache.stats().items()}
+)
 
-bot = telebot.TeleBot(os.getenv("TELEGRAM_BOT_TOKEN"))
-
-# Состояния пользователей
-user_states = {}
-current_tests = {}
+# Состояния пользователей (значения - копии: после изменения записываются обратно)
+user_states = SessionMap(session_backend, "user_states")
+current_tests = SessionMap(session_backend, "current_tests")
 
 @bot.message_handler(commands=['start'])
 def start(message):
     user_id = message.from_user.id
     username = message.from_user.username or str(user_id)
     
-    conn = connect_to_db()
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT IGNORE INTO user (user_id, username) VALUES (%s, %s)", (user_id, username))
-        conn.commit()
+        add_user(user_id, username)
     except:
         pass
-    finally:
-        conn.close()
     
     main_menu(message)
 
@@ -69,44 +116,62 @@ def handle_problem_solving(message):
         return
     
     # Если пользователь не завершает, продолжаем помогать
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """
-        Вы - преподаватель. Помогите студенту решить задачу, задавая наводящие вопросы.
-        Не давайте готового решения, только направляйте.
-        Если студент прислал ответ на ваш предыдущий вопрос, проанализируйте его и задайте следующий уточняющий вопрос.
-        Будьте дружелюбны и терпеливы.
-        """),
-        ("human", "{problem}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    
-    # Получаем историю предыдущих сообщений в этом режиме
-    history = user_states.get(user_id, {}).get('problem_history', [])
-    history.append(f"Пользователь: {message.text}")
-    full_context = "\n".join(history[-5:])  # Берем последние 5 сообщений для контекста
-    
-    response = chain.invoke({"problem": full_context})
-    
-    history.append(f"Ассистент: {response}")
-    user_states[user_id]['problem_history'] = history
-    
-    msg = bot.send_message(
-        message.chat.id, 
-        response + "\n\nПродолжайте отвечать на вопросы или напишите 'Завершить', чтобы закончить.",
+    # История режима: последние реплики дословно, более ранние - в виде резюме
+    state = user_states.get(user_id, {})
+    memory = state.get('problem_memory') or new_memory()
+    add_turn(memory, "Пользователь", message.text)
+    full_context = dialog_context(memory)
+    
+    response = reply_with(
+        bot, message.chat.id, solve_problem_step, full_context,
+        suffix="\n\nПродолжайте отвечать на вопросы или напишите 'Завершить', чтобы закончить.",
         reply_markup=create_problem_solving_keyboard()
     )
-    bot.register_next_step_handler(msg, handle_problem_solving)
+    
+    add_turn(memory, "Ассистент", response)
+    compact_memory(memory, summarize_dialog)
+    state['problem_memory'] = memory
+    user_states[user_id] = state
+    
+    bot.register_next_step_handler(message, handle_problem_solving)
 
 @bot.message_handler(func=lambda m: m.text == 'Конспект лекции')
 def lecture_summary(message):
-    msg = bot.send_message(message.chat.id, "Отправьте текст лекции для создания конспекта:")
+    msg = bot.send_message(message.chat.id, "Отправьте текст лекции или файл (PDF, DOCX, TXT) для создания конспекта:")
     bot.register_next_step_handler(msg, process_lecture)
 
 def process_lecture(message):
-    summary = generate_summary(message.text)
-    bot.send_message(message.chat.id, f"Краткий конспект:\n\n{summary}")
+    if message.content_type == 'document':
+        process_lecture_document(message)
+    elif message.text:
+        reply_with(bot, message.chat.id, generate_summary, message.text, prefix="Краткий конспект:\n\n")
+    else:
+        bot.send_message(message.chat.id, "Пришлите текст лекции или файл в формате PDF, DOCX или TXT.")
     main_menu(message)
 
+def process_lecture_document(message):
+    document = message.document
+    kind = lecture_docs.document_kind(document.file_name, document.mime_type)
+    if kind is None:
+        bot.send_message(message.chat.id, "Поддерживаются только файлы PDF, DOCX и TXT.")
+        return
+    bot.send_message(message.chat.id, "Документ получен, готовлю конспект. Для длинных лекций это может занять пару минут.")
+    path = None
+    try:
+        path, content_hash = lecture_docs.download_document(bot, document)
+        reply_with(
+            bot, message.chat.id, summarize_document, path, kind, content_hash,
+            prefix="Краткий конспект:\n\n"
+        )
+    except ValueError as e:
+        bot.send_message(message.chat.id, f"Не удалось обработать файл: {e}")
+    except Exception:
+        logger.exception("Ошибка конспектирования документа %s", document.file_name)
+        bot.send_message(message.chat.id, "Произошла ошибка при обработке документа. Попробуйте позже.")
+    finally:
+        if path is not None:
+            os.remove(path)
+
 @bot.message_handler(func=lambda m: m.text == 'Код-ревью')
 def code_review_menu(message):
     msg = bot.send_message(message.chat.id, "Отправьте описание задания:")
@@ -120,8 +185,7 @@ def get_code_for_review(message):
 def process_code_review(message):
     user_id = message.from_user.id
     task = user_states.get(user_id, {}).get('task', '')
-    review = code_review(task, message.text)
-    bot.send_message(message.chat.id, f"Результат ревью:\n\n{review}")
+    reply_with(bot, message.chat.id, code_review, task, message.text, prefix="Результат ревью:\n\n")
     main_menu(message)
 
 @bot.message_handler(func=lambda m: m.text == 'Подбор видео')
@@ -162,8 +226,7 @@ def question_answering(message):
     bot.register_next_step_handler(msg, process_question)
 
 def process_question(message):
-    answer = search_in_vector_db(message.text)
-    bot.send_message(message.chat.id, answer)
+    reply_with(bot, message.chat.id, search_in_vector_db, message.text)
     main_menu(message)
 
 @bot.message_handler(func=lambda m: m.text == 'Прохождение курсов')
@@ -225,7 +288,7 @@ def explain_topic_menu(message):
     markup.row('Назад к курсу')
     bot.send_message(message.chat.id, "Выберите тему для объяснения:", reply_markup=markup)
 
-@bot.message_handler(func=lambda m: any(t['topic_name'] == m.text for t in get_all_topics()) and user_states.get(m.from_user.id, {}).get('mode') != 'topic_qa')
+@bot.message_handler(func=lambda m: is_topic_name(m.text) and user_states.get(m.from_user.id, {}).get('mode') != 'topic_qa')
 def start_test(message):
     user_id = message.from_user.id
     topic_name = message.text
@@ -235,14 +298,12 @@ def start_test(message):
         return
     
     # Получаем информацию о теме
-    conn = connect_to_db()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM topic WHERE topic_name = %s", (topic_name,))
-    topic = cursor.fetchone()
-    conn.close()
-    
-    if topic:
-        test = generate_test(topic['text'])
+    topic = get_topic_by_name(topic_name, user_states.get(user_id, {}).get('course_id'))
+    
+    test = quiz_bank.get_quiz(user_id, topic['topic_id']) if topic else None
+    if topic and not test:
+        bot.send_message(message.chat.id, "Не удалось составить тест по этой теме. Попробуйте позже.")
+    elif topic:
         current_tests[user_id] = {
             'topic_id': topic['topic_id'],
             'test': test,
@@ -255,11 +316,10 @@ def start_test(message):
     else:
         bot.send_message(message.chat.id, "Ошибка: тема не найдена.")
 
-@bot.message_handler(func=lambda m: any(t['topic_name'] == m.text for t in get_all_topics()))
+@bot.message_handler(func=lambda m: is_topic_name(m.text))
 def process_topic_explanation(message):
     topic_name = message.text
-    explanation = explain_topic(topic_name)
-    bot.send_message(message.chat.id, explanation)
+    reply_with(bot, message.chat.id, explain_topic, topic_name)
     
     user_id = message.from_user.id
     user_states[user_id] = {
@@ -296,11 +356,7 @@ def handle_topic_questions(message):
             markup.row('Пройти тест')
             markup.row('Назад к курсам')
             
-            conn = connect_to_db()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT course_name FROM course WHERE course_id = %s", (course_id,))
-            course = cursor.fetchone()
-            conn.close()
+            course = get_course(course_id)
             
             if course:
                 bot.send_message(
@@ -316,22 +372,15 @@ def handle_topic_questions(message):
     
     topic = user_state.get('topic', '')
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", f"Вы - преподаватель. Отвечайте на вопросы по теме '{topic}'."),
-        ("human", "{question}")
-    ])
-    chain = prompt | llm | StrOutputParser()
-    response = chain.invoke({"question": message.text})
-    
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.row('Выход')
     
-    msg = bot.send_message(
-        message.chat.id, 
-        response + "\n\nМожете задать еще вопрос или нажмите 'Выход'",
+    reply_with(
+        bot, message.chat.id, answer_topic_question, topic, message.text,
+        suffix="\n\nМожете задать еще вопрос или нажмите 'Выход'",
         reply_markup=markup
     )
-    bot.register_next_step_handler(msg, handle_topic_questions)
+    bot.register_next_step_handler(message, handle_topic_questions)
 
 @bot.message_handler(func=lambda m: m.text == 'Пройти тест')
 def take_test_menu(message):
@@ -379,7 +428,13 @@ def process_test_answer(message):
     
     question_data = test_data['test'][test_data['current_question']]
     correct_answer = question_data[5].strip()
-    user_answer = message.text.split('.')[1].strip()
+    # Кнопки имеют вид "N. вариант"; сам вариант может содержать точку ("3.14", "os.path")
+    options = [opt.strip() for opt in question_data[1:5]]
+    number, _, text = (message.text or "").partition('.')
+    if number.strip().isdigit() and 1 <= int(number) <= len(options):
+        user_answer = options[int(number) - 1]
+    else:
+        user_answer = text.strip() or (message.text or "").strip()
     
     # Проверяем ответ
     if user_answer == correct_answer:
@@ -387,6 +442,7 @@ def process_test_answer(message):
     
     test_data['current_question'] += 1
     test_data['answers'].append((question_data[0], user_answer, correct_answer))
+    current_tests[user_id] = test_data
     
     if test_data['current_question'] < len(test_data['test']):
         ask_question(message, user_id)
@@ -430,11 +486,7 @@ def back_to_course(message):
             'action': None
         }
         
-        conn = connect_to_db()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT course_name FROM course WHERE course_id = %s", (course_id,))
-        course = cursor.fetchone()
-        conn.close()
+        course = get_course(course_id)
         
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
         markup.row('Граф курса')
@@ -462,14 +514,16 @@ def back_to_courses(message):
 def back_to_main(message):
     main_menu(message)
 
-def get_all_topics():
-    conn = connect_to_db()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM topic")
-    topics = cursor.fetchall()
-    conn.close()
-    return topics
-
 if __name__ == '__main__':
     print("Бот запущен...")
-    bot.infinity_polling()
\ No newline at end of file
+    metrics.start_server()
+    quiz_bank.fill_all_async()
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        import webhook
+        webhook.run(bot, update_executor)
+    else:
+        bot.remove_webhook()
+        bot.infinity_polling()
+        update_executor.shutdown(wait=True)
+    # Дописываем в базу накопленные оценки и регистрации
+    write_queue.close()
\ No newline at end of file
@@ -0,0 +1,256 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Замеры времени по этапам обработки запроса (MySQL, эмбеддинги, LanceDB, LLM,
+# отрисовка графа, отправка в Telegram) с привязкой к обработчику бота.
+# Гистограммы отдаются в текстовом формате Prometheus на METRICS_PORT,
+# медленные запросы пишутся в лог с разбивкой по этапам.
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 - HTTP-эндпоинт не запускается
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))  # 0 - лог отключён
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PREFIX = "edubot"
+
+_local = threading.local()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+stage_seconds = Histogram(f"{PREFIX}_stage_seconds", "Длительность этапа обработки запроса")
+handler_seconds = Histogram(f"{PREFIX}_handler_seconds", "Полное время обработчика бота")
+llm_tokens = Counter(f"{PREFIX}_llm_tokens_total", "Токены промптов и ответов LLM")
+# Значения-датчики, вычисляемые при каждом запросе метрик: name -> (help, функция -> {labels: value})
+_gauges = {}
+
+
+def register_gauges(name, help_text, collect):
+    _gauges[f"{PREFIX}_{name}"] = (help_text, collect)
+
+
+def current_handler():
+    return getattr(_local, "handler", None) or "background"
+
+
+def _observe(stage, elapsed, handler=None, **labels):
+    stage_seconds.observe(elapsed, stage=stage, handler=handler or current_handler(), **labels)
+    stages = getattr(_local, "stages", None)
+    if stages is not None:
+        stages.append((stage, elapsed))
+
+
+@contextmanager
+def span(stage, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe(stage, time.perf_counter() - started, **labels)
+
+
+# Этап, которому предшествует ожидание в очереди (регулятор запросов OpenAI):
+# granted(at) отмечает момент допуска, ожидание до него пишется отдельным этапом {stage}_queue
+@contextmanager
+def queued_span(stage):
+    started = time.perf_counter()
+    mark = [started]
+
+    def granted(at):
+        if at is not None:
+            mark[0] = max(started, at)
+
+    try:
+        yield granted
+    finally:
+        _observe(f"{stage}_queue", mark[0] - started)
+        _observe(stage, time.perf_counter() - mark[0])
+
+
+# Обработчик верхнего уровня: вложенные вызовы других обработчиков считаются его частью
+@contextmanager
+def handler_span(name):
+    if getattr(_local, "handler", None) is not None:
+        yield
+        return
+    _local.handler = name
+    _local.stages = []
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        handler_seconds.observe(elapsed, handler=name)
+        if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}мс" for stage, seconds in _local.stages)
+            logger.warning("Медленный запрос %s: %.2f с (%s)", name, elapsed, breakdown)
+        _local.handler = None
+        _local.stages = None
+
+
+# Функция для пула потоков: её этапы относятся к обработчику, из которого она передана
+def bind_handler(fn):
+    handler = getattr(_local, "handler", None)
+    stages = getattr(_local, "stages", None)
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, "handler", None), getattr(_local, "stages", None)
+        _local.handler, _local.stages = handler, stages
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.handler, _local.stages = previous
+
+    return bound
+
+
+# Потоковый ответ: ожидание в очереди, время до первого фрагмента и полное время генерации.
+# start(granted) возвращает итератор фрагментов, granted(at) - как в queued_span
+def timed_stream(stage, start):
+    started = time.perf_counter()
+    mark = [started]
+    first = True
+    handler = current_handler()
+
+    def granted(at):
+        if at is not None:
+            mark[0] = max(started, at)
+
+    for chunk in start(granted):
+        if first:
+            _observe(f"{stage}_queue", mark[0] - started, handler)
+            _observe(f"{stage}_first_token", time.perf_counter() - mark[0], handler)
+            first = False
+        yield chunk
+    if first:
+        _observe(f"{stage}_queue", mark[0] - started, handler)
+    _observe(stage, time.perf_counter() - mark[0], handler)
+
+
+def count_llm_tokens(prompt_tokens, completion_tokens, handler=None):
+    handler = handler or current_handler()
+    llm_tokens.inc(prompt_tokens, direction="prompt", handler=handler)
+    llm_tokens.inc(completion_tokens, direction="completion", handler=handler)
+
+
+# Время каждого обработчика telebot (команды, текстовые фильтры и next-step обработчики)
+def instrument_bot(bot):
+    exec_task = bot._exec_task
+
+    def timed_task(task, *args, **kwargs):
+        with handler_span(getattr(task, "__name__", "unknown")):
+            return exec_task(task, *args, **kwargs)
+
+    bot._exec_task = timed_task
+
+
+# Все запросы к Bot API проходят через apihelper._make_request
+def instrument_telegram(apihelper):
+    make_request = apihelper._make_request
+
+    def timed_request(token, method_name, *args, **kwargs):
+        with span("telegram", method=method_name):
+            return make_request(token, method_name, *args, **kwargs)
+
+    apihelper._make_request = timed_request
+
+
+def expose():
+    lines = []
+    for metric in (handler_seconds, stage_seconds, llm_tokens):
+        lines.extend(metric.expose())
+    for name, (help_text, collect) in _gauges.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in collect().items():
+            lines.append(f"{name}{_format_labels(tuple(labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=METRICS_PORT):
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import db_pool
+import rate_governor
+from write_behind import write_queue
+from embedding_cache import LRUCache
+from education_bot import generate_test, get_all_topics, get_topic_text
+
+# Банк заранее сгенерированных тестов по темам (таблица topic_quiz).
+# Тест выдаётся мгновенно из банка; банк пополняется в фоне, когда тестов мало
+# или пользователь уже прошёл все имеющиеся. Живая генерация - только если банк пуст.
+
+logger = logging.getLogger(__name__)
+
+QUIZZES_PER_TOPIC = int(os.getenv("QUIZ_BANK_SIZE", "5"))
+MAX_QUIZZES_PER_TOPIC = int(os.getenv("QUIZ_BANK_MAX", "20"))
+GENERATION_WORKERS = int(os.getenv("QUIZ_BANK_WORKERS", "2"))
+# Меньше этого числа корректных вопросов - тест отбрасывается
+MIN_QUESTIONS = int(os.getenv("QUIZ_MIN_QUESTIONS", "4"))
+
+
+def _load_questions(raw):
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode("utf-8")
+    return json.loads(raw) if isinstance(raw, str) else raw
+
+
+class QuizBank:
+    def __init__(self, workers=GENERATION_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quiz-bank")
+        self._in_progress = set()
+        self._lock = threading.Lock()
+        # Одновременные генерации по теме сливаются rate_governor в один запрос,
+        # и каждый вызвавший получает тот же тест: сохраняем его один раз
+        self._stored = LRUCache(max_items=1024, ttl=3600)
+        self._store_lock = threading.Lock()
+
+    def quiz_count(self, topic_id):
+        return db_pool.fetch_one("quiz_count", (topic_id,))['quizzes']
+
+    def store(self, topic_id, questions):
+        raw = json.dumps(questions, ensure_ascii=False)
+        key = hashlib.sha256(f"{topic_id}\x00{raw}".encode("utf-8")).hexdigest()
+        with self._store_lock:
+            quiz_id = self._stored.get(key)
+            if quiz_id is None:
+                quiz_id = db_pool.insert("quiz_insert", (topic_id, raw))
+                self._stored.set(key, quiz_id)
+            return quiz_id
+
+    # Генерирует тест и сохраняет его, если он прошёл проверку
+    def generate(self, topic_id):
+        questions = generate_test(get_topic_text(topic_id))
+        if len(questions) < MIN_QUESTIONS:
+            logger.warning("Тест по теме %s отброшен: %d корректных вопросов", topic_id, len(questions))
+            return None
+        return self.store(topic_id, questions), questions
+
+    # Пополнение идёт с фоновым приоритетом и не отнимает лимит OpenAI у студентов
+    def _top_up(self, topic_id, target):
+        try:
+            with rate_governor.priority(rate_governor.BACKGROUND):
+                for _ in range(max(0, target - self.quiz_count(topic_id))):
+                    self.generate(topic_id)
+        except Exception:
+            logger.exception("Не удалось пополнить банк тестов по теме %s", topic_id)
+        finally:
+            with self._lock:
+                self._in_progress.discard(topic_id)
+
+    # Асинхронное пополнение; повторные запросы по той же теме не дублируются
+    def top_up_async(self, topic_id, target=QUIZZES_PER_TOPIC):
+        with self._lock:
+            if topic_id in self._in_progress:
+                return
+            self._in_progress.add(topic_id)
+        self._pool.submit(self._top_up, topic_id, min(target, MAX_QUIZZES_PER_TOPIC))
+
+    def fill_all_async(self):
+        for topic in get_all_topics():
+            self.top_up_async(topic['topic_id'])
+
+    def _mark_served(self, user_id, quiz_id):
+        try:
+            db_pool.execute("quiz_served", (quiz_id,))
+            # Регистрация нового пользователя может ещё ждать в очереди write_behind
+            write_queue.flush_user(user_id)
+            db_pool.execute("quiz_user_served", (user_id, quiz_id))
+        except Exception:
+            logger.exception("Не удалось отметить выдачу теста %s", quiz_id)
+
+    def get_quiz(self, user_id, topic_id):
+        row = db_pool.fetch_one("quiz_pick", (user_id, topic_id))
+        if row is None:
+            # Банк пуст: генерируем тест сразу и сохраняем его для следующих студентов
+            generated = self.generate(topic_id)
+            self.top_up_async(topic_id)
+            if generated is None:
+                return None
+            quiz_id, questions = generated
+        else:
+            quiz_id, questions = row['quiz_id'], _load_questions(row['questions'])
+            count = self.quiz_count(topic_id)
+            if row['served_at'] is not None:
+                # Пользователь прошёл все тесты банка - добавляем новый
+                self.top_up_async(topic_id, count + 1)
+            elif count < QUIZZES_PER_TOPIC:
+                self.top_up_async(topic_id)
+        self._mark_served(user_id, quiz_id)
+        return questions
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+quiz_bank = QuizBank()
+
+
+if __name__ == '__main__':
+    # Предварительное наполнение банка для всех тем
+    quiz_bank.fill_all_async()
+    quiz_bank.shutdown(wait=True)
+    sys.exit(0)
@@ -0,0 +1,315 @@
+import os
+import time
+import heapq
+import random
+import logging
+import threading
+from itertools import count
+from contextlib import contextmanager
+
+# Общий для процесса регулятор запросов к OpenAI: token bucket по запросам и токенам
+# в минуту, очередь с приоритетами (интерактивные ответы раньше фоновой генерации тестов),
+# общая пауза при 429 вместо независимых повторов в каждом потоке
+# и объединение одинаковых одновременных запросов в один вызов (single-flight).
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+OPENAI_CHAT_RPM = int(os.getenv("OPENAI_CHAT_RPM", "500"))
+OPENAI_CHAT_TPM = int(os.getenv("OPENAI_CHAT_TPM", "30000"))
+OPENAI_EMBEDDING_RPM = int(os.getenv("OPENAI_EMBEDDING_RPM", "3000"))
+OPENAI_EMBEDDING_TPM = int(os.getenv("OPENAI_EMBEDDING_TPM", "1000000"))
+# Оценка длины ответа при резервировании токенов; после ответа резерв уточняется
+COMPLETION_TOKENS_ESTIMATE = int(os.getenv("COMPLETION_TOKENS_ESTIMATE", "600"))
+# Доля ёмкости, которую фоновые задачи не расходуют (запас для интерактивных всплесков)
+BACKGROUND_RESERVE = float(os.getenv("OPENAI_BACKGROUND_RESERVE", "0.25"))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+_local = threading.local()
+
+
+# Приоритет запросов текущего потока: with priority(BACKGROUND): ...
+@contextmanager
+def priority(level):
+    previous = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    return getattr(_local, "priority", INTERACTIVE)
+
+
+def is_rate_limit(error):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Сколько ждать, чтобы после списания amount в корзине осталось не меньше reserve * capacity.
+    # Запрос больше ёмкости ждёт полной корзины и уводит её в минус
+    def wait_time(self, amount, reserve=0.0):
+        floor = reserve * self.capacity
+        amount = min(amount, self.capacity - floor)
+        return max(0.0, (amount + floor - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+# Один вызов, результат которого получают все присоединившиеся к нему потоки.
+# Потоковый ответ накапливается в chunks, каждый читатель идёт по нему со своей позиции
+class Flight:
+    def __init__(self):
+        self.chunks = []
+        self.value = None
+        self.error = None
+        self.done = False
+        self.granted = None  # perf_counter момента, когда регулятор допустил вызов
+        self._cond = threading.Condition()
+
+    def append(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, value=None, error=None):
+        with self._cond:
+            self.value = value
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def stream(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                if position < len(self.chunks):
+                    chunk = self.chunks[position]
+                    position += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            yield chunk
+
+    def result(self):
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+            return self.value
+
+
+def _granted(flight, fn):
+    flight.granted = time.perf_counter()
+    return fn()
+
+
+def _open_stream(make_stream):
+    iterator = iter(make_stream())
+    # Ошибка лимита приходит с первым фрагментом, поэтому он читается внутри повторов
+    for chunk in iterator:
+        return [chunk], iterator
+    return [], iterator
+
+
+class RateGovernor:
+    def __init__(self, name, rpm, tpm):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._tickets = count()
+        self._paused_until = 0.0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0, "throttled": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    # Ждёт своей очереди и резервирует запрос и tokens токенов
+    def acquire(self, tokens, level=None):
+        level = current_priority() if level is None else level
+        reserve = BACKGROUND_RESERVE if level >= BACKGROUND else 0.0
+        ticket = (level, next(self._tickets))
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            self._cond.notify_all()
+            try:
+                while True:
+                    delay = None
+                    if self._waiters[0] == ticket:
+                        now = time.monotonic()
+                        self.requests.refill(now)
+                        self.tokens.refill(now)
+                        delay = max(
+                            self._paused_until - now,
+                            self.requests.wait_time(1, reserve),
+                            self.tokens.wait_time(tokens, reserve),
+                        )
+                        if delay <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            break
+                    self._cond.wait(delay)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            self._stats["calls"] += 1
+            if waited > 0.01:
+                self._stats["throttled"] += 1
+                self._stats["wait_seconds"] += waited
+
+    # Уточнение резерва по фактическому расходу токенов
+    def settle(self, reserved, actual):
+        with self._cond:
+            if actual < reserved:
+                self.tokens.give_back(reserved - actual)
+            else:
+                self.tokens.take(actual - reserved)
+            self._cond.notify_all()
+
+    # После 429 все потоки ждут одну общую паузу, а не повторяют запросы по отдельности
+    def pause(self, attempt, seconds=None):
+        if seconds is None:
+            seconds = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats["rate_limited"] += 1
+            self._cond.notify_all()
+        logger.warning("OpenAI (%s): превышен лимит, пауза %.1f с", self.name, seconds)
+
+    def call(self, fn, tokens, level=None):
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire(tokens, level)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_rate_limit(e) or attempt == MAX_RETRIES:
+                    raise
+                self.pause(attempt, retry_after(e))
+
+    # Вызов с объединением: одновременные вызовы с одинаковым key получают один результат.
+    # fn() возвращает значение, а при stream=True - итератор фрагментов ответа.
+    # on_finish(value) вызывается один раз, у вызова, который действительно выполнялся.
+    # on_grant(at) вызывается в потоке вызывающего с моментом допуска вызова (для замера очереди)
+    def run(self, key, fn, tokens, stream=False, on_finish=None, on_grant=None):
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self._stats["coalesced"] += 1
+        if leader:
+            args = (key, flight, fn, tokens, current_priority(), on_finish)
+            if stream:
+                # Ответ читается в отдельном потоке, чтобы присоединившиеся не зависели от первого читателя
+                threading.Thread(target=self._pump_stream, args=args, name=f"{self.name}-stream", daemon=True).start()
+            else:
+                self._pump(*args)
+        if stream:
+            return self._follow(flight, on_grant)
+        try:
+            return flight.result()
+        finally:
+            if on_grant is not None:
+                on_grant(flight.granted)
+
+    def _follow(self, flight, on_grant):
+        for chunk in flight.stream():
+            if on_grant is not None:
+                on_grant(flight.granted)
+                on_grant = None
+            yield chunk
+        if on_grant is not None:
+            on_grant(flight.granted)
+
+    def _land(self, key):
+        with self._flights_lock:
+            self._flights.pop(key, None)
+
+    def _pump(self, key, flight, fn, tokens, level, on_finish):
+        try:
+            value = self.call(lambda: _granted(flight, fn), tokens, level)
+        except Exception as e:
+            self._land(key)
+            flight.finish(error=e)
+            return
+        self._land(key)
+        if isinstance(value, str):
+            flight.append(value)
+        flight.finish(value)
+        self._finished(on_finish, value)
+
+    def _pump_stream(self, key, flight, make_stream, tokens, level, on_finish):
+        try:
+            chunks, iterator = self.call(lambda: _granted(flight, lambda: _open_stream(make_stream)), tokens, level)
+            for chunk in chunks:
+                flight.append(chunk)
+            for chunk in iterator:
+                flight.append(chunk)
+        except Exception as e:
+            self._land(key)
+            flight.finish(error=e)
+            return
+        self._land(key)
+        value = "".join(flight.chunks)
+        flight.finish(value)
+        self._finished(on_finish, value)
+
+    def _finished(self, on_finish, value):
+        if on_finish is None:
+            return
+        try:
+            on_finish(value)
+        except Exception:
+            logger.exception("Ошибка обработки результата запроса к OpenAI (%s)", self.name)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._waiters)
+            stats["request_bucket"] = round(self.requests.level, 1)
+            stats["token_bucket"] = round(self.tokens.level, 1)
+        with self._flights_lock:
+            stats["in_flight"] = len(self._flights)
+        return stats
+
+
+chat_governor = RateGovernor("chat", OPENAI_CHAT_RPM, OPENAI_CHAT_TPM)
+embedding_governor = RateGovernor("embedding", OPENAI_EMBEDDING_RPM, OPENAI_EMBEDDING_TPM)
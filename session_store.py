@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from telebot import Handler
+from telebot.handler_backends import HandlerBackend
+
+# Хранилище состояния диалогов (user_states, current_tests, next-step обработчики).
+# Бэкенды: memory - в памяти процесса; sqlite - файл, общий для процессов на одной машине;
+# redis - любой сервер с протоколом Redis, общий для нескольких экземпляров бота.
+# Значения сериализуются в компактный JSON и истекают через SESSION_TTL секунд простоя:
+# чтение продлевает срок, чтобы активный диалог не обрывался посреди разговора.
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 3600)))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+KEY_PREFIX = os.getenv("SESSION_KEY_PREFIX", "edubot")
+
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(raw):
+    return json.loads(raw)
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key, ttl=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            now = time.time()
+            if expires_at < now:
+                del self._items[key]
+                return None
+            if ttl is not None:
+                self._items[key] = (value, now + ttl)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (value, time.time() + ttl)
+            self._writes += 1
+            # Периодически вычищаем истёкшие сессии, чтобы память не росла
+            if self._writes % 1000 == 0:
+                now = time.time()
+                for k in [k for k, (_, expires_at) in self._items.items() if expires_at < now]:
+                    del self._items[k]
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class SQLiteBackend:
+    def __init__(self, path=SESSION_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS session (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS session_expires_at ON session (expires_at)")
+        self._conn.commit()
+        self._writes = 0
+
+    def get(self, key, ttl=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session WHERE key = ? AND expires_at >= ?", (key, now)
+            ).fetchone()
+            if row is not None and ttl is not None:
+                self._conn.execute("UPDATE session SET expires_at = ? WHERE key = ?", (now + ttl, key))
+                self._conn.commit()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._conn.execute("DELETE FROM session WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM session WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+class RedisBackend:
+    # client - объект с интерфейсом redis-py (get/set/expire/delete), например локальная замена в тестах
+    def __init__(self, client=None, url=REDIS_URL):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+
+    def get(self, key, ttl=None):
+        value = self._client.get(key)
+        if value is not None and ttl is not None:
+            self._client.expire(key, ttl)
+        return value
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, ex=ttl)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+
+def create_backend(name=SESSION_BACKEND):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "redis":
+        return RedisBackend()
+    raise ValueError(f"Неизвестный бэкенд сессий: {name}")
+
+
+# Словарь поверх бэкенда: user_states[user_id] читает и пишет сериализованное значение.
+# Возвращаемые значения - копии, поэтому после изменения их нужно записать обратно.
+class SessionMap(MutableMapping):
+    def __init__(self, backend, namespace, ttl=SESSION_TTL):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f"{KEY_PREFIX}:{self.namespace}:{key}"
+
+    def __getitem__(self, key):
+        raw = self.backend.get(self._key(key), self.ttl)
+        if raw is None:
+            raise KeyError(key)
+        return loads(raw)
+
+    def __setitem__(self, key, value):
+        self.backend.set(self._key(key), dumps(value), self.ttl)
+
+    def __delitem__(self, key):
+        self.backend.delete(self._key(key))
+
+    def __contains__(self, key):
+        return self.backend.get(self._key(key), self.ttl) is not None
+
+    # Перебор ключей не поддерживается: в общем хранилище он слишком дорог
+    def __iter__(self):
+        raise TypeError("SessionMap не поддерживает перебор ключей")
+
+    def __len__(self):
+        raise TypeError("SessionMap не поддерживает подсчёт ключей")
+
+
+# Хранение next-step обработчиков telebot в том же хранилище.
+# Обработчик сохраняется по имени функции и восстанавливается через resolve(name).
+class SessionHandlerBackend(HandlerBackend):
+    def __init__(self, backend, resolve, ttl=SESSION_TTL):
+        super().__init__()
+        self.handlers = SessionMap(backend, "next_step", ttl)
+        self.resolve = resolve
+
+    def register_handler(self, handler_group_id, handler):
+        handlers = self.handlers.get(handler_group_id, [])
+        handlers.append({
+            "callback": handler.callback.__name__,
+            "args": list(handler.args),
+            "kwargs": handler.kwargs,
+        })
+        self.handlers[handler_group_id] = handlers
+
+    def clear_handlers(self, handler_group_id):
+        del self.handlers[handler_group_id]
+
+    def get_handlers(self, handler_group_id):
+        handlers = self.handlers.get(handler_group_id)
+        if handlers is None:
+            return None
+        del self.handlers[handler_group_id]
+        return [Handler(self.resolve(h["callback"]), *h["args"], **h["kwargs"]) for h in handlers]
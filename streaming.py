@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardMarkup
+
+# Потоковая отправка ответа LLM в Telegram: одно сообщение обновляется через
+# edit_message_text по мере генерации, длинный ответ переносится в новые сообщения.
+
+logger = logging.getLogger(__name__)
+
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "1") not in ("0", "false", "no")
+# Telegram ограничивает частоту правок одного чата примерно одной в секунду
+EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+MESSAGE_LIMIT = 4096
+EMPTY_ANSWER = "Не удалось сформировать ответ, попробуйте задать вопрос ещё раз."
+
+
+# Разбиение текста на части не длиннее лимита, по возможности по абзацам и словам
+def split_message(text, limit=MESSAGE_LIMIT):
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", limit // 2, limit)
+        if cut == -1:
+            cut = text.rfind(" ", limit // 2, limit)
+        if cut == -1:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    parts.append(text)
+    return parts
+
+
+# Вызов Bot API; при 429 (слишком частые запросы) ждёт retry_after и повторяет один раз
+def call_api(fn, *args, retry=True, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except ApiTelegramException as e:
+        if e.error_code != 429 or not retry:
+            raise
+        time.sleep(e.result_json.get("parameters", {}).get("retry_after", 1))
+        return fn(*args, **kwargs)
+
+
+class StreamedReply:
+    def __init__(self, bot, chat_id, reply_markup=None, edit_interval=EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.reply_markup = reply_markup
+        # Inline-клавиатура прикрепляется правкой к последнему сообщению в итоговой отрисовке.
+        # Обычную клавиатуру правкой добавить нельзя, а показывается она под полем ввода,
+        # поэтому она отправляется с первым сообщением
+        self._inline = isinstance(reply_markup, InlineKeyboardMarkup)
+        self.edit_interval = edit_interval
+        self.text = ""
+        self._messages = []  # [(message_id, показанный текст)]
+        self._last_render = 0.0
+
+    @property
+    def sent(self):
+        return bool(self._messages)
+
+    def append(self, piece):
+        self.text += piece
+        if not self._messages or time.monotonic() - self._last_render >= self.edit_interval:
+            self.render()
+
+    def _edit(self, i, part, final, markup):
+        message_id, shown = self._messages[i]
+        try:
+            if part == shown:
+                call_api(self.bot.edit_message_reply_markup, self.chat_id, message_id, reply_markup=markup)
+            else:
+                # Промежуточную правку можно пропустить: итоговая её повторит
+                call_api(self.bot.edit_message_text, part, self.chat_id, message_id,
+                         reply_markup=markup, retry=final)
+                self._messages[i] = (message_id, part)
+        except ApiTelegramException as e:
+            logger.warning("Не удалось обновить сообщение: %s", e)
+
+    def render(self, final_text=None):
+        final = final_text is not None
+        text = final_text if final else self.text
+        if not text.strip():
+            return
+        self._last_render = time.monotonic()
+        parts = split_message(text)
+        for i, part in enumerate(parts):
+            markup = self.reply_markup if final and self._inline and i == len(parts) - 1 else None
+            if i < len(self._messages):
+                if part != self._messages[i][1] or markup is not None:
+                    self._edit(i, part, final, markup)
+                continue
+            if not self._inline and not self._messages:
+                markup = self.reply_markup
+            # Пропустить отправку нельзя: следующие правки ссылаются на это сообщение
+            message = call_api(self.bot.send_message, self.chat_id, part, reply_markup=markup)
+            self._messages.append((message.message_id, part))
+
+
+# Отправляет ответ по мере генерации и возвращает полный текст.
+# answer может быть строкой (например, сообщением об ошибке) или итератором фрагментов.
+def send_streamed(bot, chat_id, answer, prefix="", suffix="", reply_markup=None):
+    if isinstance(answer, str):
+        text = answer
+        parts = split_message(prefix + answer + suffix)
+        # Клавиатура прикрепляется один раз - к последней части
+        for i, part in enumerate(parts):
+            call_api(bot.send_message, chat_id, part, reply_markup=reply_markup if i == len(parts) - 1 else None)
+        return text
+    bot.send_chat_action(chat_id, 'typing')
+    reply = StreamedReply(bot, chat_id, reply_markup=reply_markup)
+    reply.append(prefix)
+    for piece in answer:
+        reply.append(piece)
+    text = reply.text[len(prefix):]
+    reply.render(final_text=reply.text + suffix)
+    if not reply.sent:
+        # Модель вернула пустой ответ: пользователь не должен остаться без сообщения и клавиатуры
+        call_api(bot.send_message, chat_id, EMPTY_ANSWER, reply_markup=reply_markup)
+    return text
+
+
+# Вызывает функцию генерации в потоковом или обычном режиме и отправляет результат
+def reply_with(bot, chat_id, generate, *args, prefix="", suffix="", reply_markup=None):
+    return send_streamed(
+        bot, chat_id, generate(*args, stream=STREAM_RESPONSES),
+        prefix=prefix, suffix=suffix, reply_markup=reply_markup
+    )
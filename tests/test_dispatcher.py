@@ -0,0 +1,51 @@
+import threading
+from types import SimpleNamespace
+import dispatcher
+
+
+# Повторяет поведение telebot: polling запрашивает offset=last_update_id + 1,
+# а process_new_updates сдвигает last_update_id
+class PollingBot:
+    def __init__(self, server_updates):
+        self.server_updates = server_updates
+        self.last_update_id = 0
+        self.handled = []
+        self._lock = threading.Lock()
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            with self._lock:
+                self.handled.append(update.update_id)
+
+    def poll_once(self):
+        offset = self.last_update_id + 1
+        self.process_new_updates([u for u in self.server_updates if u.update_id >= offset])
+
+
+def make_update(update_id, user_id):
+    message = SimpleNamespace(from_user=SimpleNamespace(id=user_id))
+    return SimpleNamespace(update_id=update_id, message=message)
+
+
+def test_polling_does_not_requeue_dispatched_updates():
+    batch = [make_update(1, 10), make_update(2, 20), make_update(3, 10)]
+    bot = PollingBot(batch)
+    executor = dispatcher.install(bot, dispatcher.KeyedExecutor(max_workers=2))
+    # Второй цикл polling начинается до того, как пул обработал первый пакет
+    bot.poll_once()
+    bot.poll_once()
+    assert executor.drain(timeout=5)
+    executor.shutdown()
+    assert sorted(bot.handled) == [1, 2, 3]
+    assert bot.last_update_id == 3
+
+
+def test_same_user_updates_keep_order():
+    bot = PollingBot([make_update(i, 10) for i in range(1, 21)])
+    executor = dispatcher.install(bot, dispatcher.KeyedExecutor(max_workers=4))
+    bot.poll_once()
+    assert executor.drain(timeout=5)
+    executor.shutdown()
+    assert bot.handled == list(range(1, 21))
@@ -0,0 +1,44 @@
+import time
+import metrics
+import lecture_docs
+from rate_governor import RateGovernor
+
+
+def stage_sum(stage, handler):
+    key = (("handler", handler), ("stage", stage))
+    return metrics.stage_seconds._series[key][1]
+
+
+def test_llm_span_excludes_governor_queue():
+    governor = RateGovernor("test", 120, 100000)
+    governor.requests.level = 0  # следующий запрос допускается примерно через 0.5 с
+
+    def call():
+        time.sleep(0.1)
+        return "ok"
+
+    with metrics.handler_span("queued_handler"):
+        with metrics.queued_span("llm") as granted:
+            assert governor.run("key", call, 1, on_grant=granted) == "ok"
+    assert stage_sum("llm_queue", "queued_handler") >= 0.3
+    assert stage_sum("llm", "queued_handler") < 0.3
+
+
+def test_stream_reports_queue_separately():
+    governor = RateGovernor("test", 120, 100000)
+    governor.requests.level = 0
+
+    def start(granted):
+        return governor.run("key", lambda: iter(["a", "b"]), 1, stream=True, on_grant=granted)
+
+    with metrics.handler_span("stream_handler"):
+        assert list(metrics.timed_stream("llm", start)) == ["a", "b"]
+    assert stage_sum("llm_queue", "stream_handler") >= 0.3
+    assert stage_sum("llm", "stream_handler") < 0.3
+
+
+def test_summary_pool_keeps_handler_label():
+    with metrics.handler_span("summary_handler"):
+        labels = lecture_docs.map_chunks(["first chunk", "second chunk"], lambda chunk: metrics.current_handler())
+    assert labels == ["summary_handler", "summary_handler"]
+    assert metrics.current_handler() == "background"
@@ -0,0 +1,96 @@
+import pytest
+
+pytest.importorskip("telebot")
+from telebot import Handler
+import session_store
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+# Локальная замена Redis: подмножество redis-py, которое использует RedisBackend
+class FakeRedis:
+    def __init__(self, clock):
+        self.clock = clock
+        self.items = {}
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None or item[1] <= self.clock.time():
+            self.items.pop(key, None)
+            return None
+        return item[0]
+
+    def set(self, key, value, ex=None):
+        self.items[key] = (value, self.clock.time() + ex)
+
+    def expire(self, key, ttl):
+        if key in self.items:
+            self.items[key] = (self.items[key][0], self.clock.time() + ttl)
+
+    def delete(self, key):
+        self.items.pop(key, None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, "time", clock.time)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, clock, tmp_path):
+    if request.param == "memory":
+        return session_store.MemoryBackend()
+    if request.param == "sqlite":
+        return session_store.SQLiteBackend(str(tmp_path / "sessions.sqlite3"))
+    return session_store.RedisBackend(client=FakeRedis(clock))
+
+
+def test_round_trip(backend):
+    states = session_store.SessionMap(backend, "state", ttl=60)
+    states[42] = {"mode": "problem", "history": ["Привет"]}
+    assert 42 in states
+    assert states[42] == {"mode": "problem", "history": ["Привет"]}
+    del states[42]
+    assert 42 not in states
+    assert states.get(42) is None
+
+
+def test_idle_session_expires(backend, clock):
+    states = session_store.SessionMap(backend, "state", ttl=60)
+    states[1] = {"step": 1}
+    clock.now += 61
+    assert states.get(1) is None
+
+
+def test_reading_keeps_active_session_alive(backend, clock):
+    states = session_store.SessionMap(backend, "state", ttl=60)
+    states[1] = {"step": 1}
+    for _ in range(3):
+        clock.now += 40
+        assert states[1] == {"step": 1}
+    clock.now += 61
+    assert 1 not in states
+
+
+def process_answer(message, user_id):
+    return message, user_id
+
+
+def test_next_step_handlers_are_resolved_by_name(backend):
+    handlers = session_store.SessionHandlerBackend(backend, {"process_answer": process_answer}.__getitem__, ttl=60)
+    handlers.register_handler(7, Handler(process_answer, 7, mode="test"))
+    restored = handlers.get_handlers(7)
+    assert len(restored) == 1
+    assert restored[0].callback is process_answer
+    assert restored[0].args == (7,)
+    assert restored[0].kwargs == {"mode": "test"}
+    # Обработчик срабатывает один раз
+    assert handlers.get_handlers(7) is None
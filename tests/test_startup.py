@@ -0,0 +1,23 @@
+import os
+import sys
+import subprocess
+import pytest
+from bench_startup import LAZY_MODULES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Импорт main в отдельном процессе: бот создаётся на уровне модуля
+def test_main_imports_without_heavy_modules():
+    pytest.importorskip("telebot")
+    pytest.importorskip("dotenv")
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "0:smoke-test")
+    code = (
+        "import sys, main\n"
+        f"print(','.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({LAZY_MODULES!r}))))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
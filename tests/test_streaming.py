@@ -0,0 +1,66 @@
+import pytest
+
+telebot = pytest.importorskip("telebot")
+from types import SimpleNamespace
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+import streaming
+
+
+class FakeBot:
+    def __init__(self, fail_sends=0):
+        self.fail_sends = fail_sends
+        self.messages = {}
+        self.markups = {}
+        self.ids = iter(range(1, 1000))
+
+    def send_chat_action(self, chat_id, action):
+        pass
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        if self.fail_sends:
+            self.fail_sends -= 1
+            raise ApiTelegramException("sendMessage", None, {
+                "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 0}
+            })
+        message_id = next(self.ids)
+        self.messages[message_id] = text
+        self.markups[message_id] = reply_markup
+        return SimpleNamespace(message_id=message_id)
+
+    def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        self.messages[message_id] = text
+        self.markups[message_id] = reply_markup
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self.markups[message_id] = reply_markup
+
+
+def inline_keyboard():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("Ещё", callback_data="more"))
+    return markup
+
+
+def test_inline_keyboard_goes_to_last_streamed_part():
+    bot = FakeBot()
+    markup = inline_keyboard()
+    pieces = ["слово " * 500, "слово " * 500]
+    streaming.send_streamed(bot, 1, iter(pieces), reply_markup=markup)
+    assert len(bot.messages) == 2
+    assert bot.markups == {1: None, 2: markup}
+
+
+def test_empty_stream_sends_fallback_with_keyboard():
+    bot = FakeBot()
+    markup = types.ReplyKeyboardMarkup()
+    streaming.send_streamed(bot, 1, iter(["", "  "]), reply_markup=markup)
+    assert list(bot.messages.values()) == [streaming.EMPTY_ANSWER]
+    assert bot.markups[1] is markup
+
+
+def test_send_is_retried_after_429():
+    bot = FakeBot(fail_sends=1)
+    text = streaming.send_streamed(bot, 1, iter(["Ответ", " готов"]))
+    assert text == "Ответ готов"
+    assert list(bot.messages.values()) == ["Ответ готов"]
@@ -0,0 +1,60 @@
+import json
+import time
+import threading
+import urllib.request
+import pytest
+
+pytest.importorskip("telebot")
+import dispatcher
+import webhook
+
+
+class FakeBot:
+    def __init__(self, delay):
+        self.delay = delay
+        self.handled = []
+        self._lock = threading.Lock()
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            time.sleep(self.delay)
+            with self._lock:
+                self.handled.append(update.update_id)
+
+
+def post(port, update_id, user_id):
+    body = json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "Привет",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Студент"},
+        },
+    }).encode("utf-8")
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{webhook.WEBHOOK_PATH}", data=body,
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status
+
+
+def test_posted_updates_are_processed_and_drained_on_shutdown():
+    bot = FakeBot(delay=0.05)
+    executor = dispatcher.install(bot, dispatcher.KeyedExecutor(max_workers=4))
+    server = webhook.WebhookServer(bot, executor, listen="127.0.0.1", port=0, secret="")
+    port = server.httpd.server_address[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        statuses = [post(port, update_id, user_id=update_id % 3) for update_id in range(1, 13)]
+        # Повторная доставка того же обновления отбрасывается
+        statuses.append(post(port, 5, user_id=2))
+    finally:
+        server.shutdown(drain_timeout=10)
+        thread.join(timeout=5)
+    assert statuses == [200] * 13
+    assert sorted(bot.handled) == list(range(1, 13))
+    assert server.duplicates == 1
+    # Обновления одного пользователя обработаны по порядку
+    for user_id in range(3):
+        own = [u for u in bot.handled if u % 3 == user_id]
+        assert own == sorted(own)
@@ -0,0 +1,90 @@
+import write_behind
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class FakeDatabase:
+    def __init__(self, bad_topics=(), down=False):
+        self.bad_topics = set(bad_topics)
+        self.down = down
+        self.users = {}
+        self.marks = {}
+
+    def execute_sql(self, sql, params):
+        if self.down:
+            raise ConnectionError("MySQL недоступен")
+        if sql.startswith(write_behind.INSERT_USERS):
+            for i in range(0, len(params), 2):
+                self.users.setdefault(params[i], params[i + 1])
+            return
+        rows = [params[i:i + 3] for i in range(0, len(params), 3)]
+        if any(topic in self.bad_topics or user not in self.users for user, topic, _ in rows):
+            raise IntegrityError("foreign key")
+        for user, topic, mark in rows:
+            self.marks[(user, topic)] = mark
+
+
+def make_queue(monkeypatch, db):
+    monkeypatch.setattr(write_behind.db_pool, "execute_sql", db.execute_sql)
+    monkeypatch.setattr(write_behind, "_is_permanent", lambda e: isinstance(e, IntegrityError))
+    return write_behind.WriteBehindQueue()
+
+
+def test_bad_row_does_not_block_batch(monkeypatch):
+    db = FakeDatabase(bad_topics={99})
+    queue = make_queue(monkeypatch, db)
+    queue.add_user(1, "a")
+    queue.set_mark(1, 10, 80)
+    queue.set_mark(1, 99, 50)
+    for _ in range(write_behind.MAX_ATTEMPTS):
+        queue.flush()
+    assert db.marks == {(1, 10): 80}
+    assert queue.dropped == 1
+    assert queue.pending_marks(1) == {}
+    queue.close()
+
+
+def test_outage_keeps_events_until_database_returns(monkeypatch):
+    db = FakeDatabase(down=True)
+    queue = make_queue(monkeypatch, db)
+    queue.add_user(1, "a")
+    queue.set_mark(1, 10, 80)
+    for _ in range(write_behind.MAX_ATTEMPTS + 2):
+        queue.flush()
+    assert queue.pending_marks(1) == {10: 80}
+    db.down = False
+    queue.flush()
+    assert db.users == {1: "a"} and db.marks == {(1, 10): 80}
+    assert queue.dropped == 0
+    queue.close()
+
+
+def test_flush_user_writes_pending_registration(monkeypatch):
+    db = FakeDatabase()
+    queue = make_queue(monkeypatch, db)
+    queue.add_user(7, "new")
+    queue.flush_user(7)
+    assert db.users == {7: "new"}
+    queue.close()
+
+
+def test_mark_stays_visible_while_batch_fails(monkeypatch):
+    db = FakeDatabase(down=True)
+    queue = make_queue(monkeypatch, db)
+    seen = []
+    write = db.execute_sql
+
+    def execute_sql(sql, params):
+        seen.append(queue.pending_marks(1))
+        return write(sql, params)
+
+    monkeypatch.setattr(write_behind.db_pool, "execute_sql", execute_sql)
+    queue.add_user(1, "a")
+    queue.set_mark(1, 10, 80)
+    queue.flush()
+    assert seen == [{10: 80}]
+    assert queue.pending_marks(1) == {10: 80}
+    db.down = False
+    queue.close()
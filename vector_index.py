@@ -0,0 +1,98 @@
+import os
+import sys
+import math
+import argparse
+
+# Управление ANN-индексом таблицы pdf_docs и параметры поиска
+
+INDEX_TYPE = os.getenv("LANCE_INDEX_TYPE", "IVF_PQ")
+METRIC = os.getenv("LANCE_METRIC", "L2")
+NUM_PARTITIONS = int(os.getenv("LANCE_NUM_PARTITIONS", "0"))  # 0 - подобрать по размеру таблицы
+NUM_SUB_VECTORS = int(os.getenv("LANCE_NUM_SUB_VECTORS", "0"))  # 0 - размерность / 16
+HNSW_M = int(os.getenv("LANCE_HNSW_M", "20"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("LANCE_HNSW_EF_CONSTRUCTION", "300"))
+NPROBES = int(os.getenv("LANCE_NPROBES", "20"))
+REFINE_FACTOR = int(os.getenv("LANCE_REFINE_FACTOR", "10"))
+# Меньше этого числа строк полный перебор быстрее индекса (и PQ не обучить)
+MIN_ROWS_FOR_INDEX = int(os.getenv("LANCE_INDEX_MIN_ROWS", "5000"))
+# Доля непроиндексированных строк, после которой индекс перестраивается
+REINDEX_RATIO = float(os.getenv("LANCE_REINDEX_RATIO", "0.2"))
+
+VECTOR_COLUMN = "vector"
+
+
+def default_num_partitions(num_rows):
+    return max(1, min(4096, int(math.sqrt(num_rows))))
+
+
+def vector_dimension(table, column=VECTOR_COLUMN):
+    return table.schema.field(column).type.list_size
+
+
+def build_index(table, column=VECTOR_COLUMN, index_type=INDEX_TYPE,
+                num_partitions=NUM_PARTITIONS, num_sub_vectors=NUM_SUB_VECTORS):
+    num_rows = table.count_rows()
+    params = {
+        "metric": METRIC,
+        "vector_column_name": column,
+        "num_partitions": num_partitions or default_num_partitions(num_rows),
+        "replace": True,
+        "index_type": index_type,
+    }
+    if index_type == "IVF_PQ":
+        params["num_sub_vectors"] = num_sub_vectors or max(1, vector_dimension(table, column) // 16)
+    elif index_type.startswith("IVF_HNSW"):
+        params["m"] = HNSW_M
+        params["ef_construction"] = HNSW_EF_CONSTRUCTION
+    table.create_index(**params)
+
+
+def find_vector_index(table, column=VECTOR_COLUMN):
+    for index in table.list_indices():
+        if column in index.columns:
+            return index
+    return None
+
+
+# Создаёт индекс, если его нет, и перестраивает, когда накопилось много новых строк
+def ensure_index(table, column=VECTOR_COLUMN):
+    num_rows = table.count_rows()
+    if num_rows < MIN_ROWS_FOR_INDEX:
+        return False
+    index = find_vector_index(table, column)
+    if index is None:
+        build_index(table, column)
+        return True
+    stats = table.index_stats(index.name)
+    if stats is not None and stats.num_unindexed_rows > REINDEX_RATIO * num_rows:
+        build_index(table, column)
+        return True
+    return False
+
+
+# Применение параметров поиска к запросу table.search(...)
+def apply_search_params(query, nprobes=NPROBES, refine_factor=REFINE_FACTOR):
+    query = query.metric(METRIC).nprobes(nprobes)
+    if refine_factor:
+        query = query.refine_factor(refine_factor)
+    return query
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Построение ANN-индекса для таблицы LanceDB")
+    parser.add_argument("--db-path", default=os.getenv("LANCE_DB_PATH") or "lancedb")
+    parser.add_argument("--table", default="pdf_docs")
+    parser.add_argument("--index-type", default=INDEX_TYPE, choices=["IVF_PQ", "IVF_HNSW_SQ", "IVF_HNSW_PQ"])
+    parser.add_argument("--num-partitions", type=int, default=NUM_PARTITIONS)
+    parser.add_argument("--num-sub-vectors", type=int, default=NUM_SUB_VECTORS)
+    args = parser.parse_args(argv)
+
+    import lancedb
+    table = lancedb.connect(args.db_path).open_table(args.table)
+    build_index(table, index_type=args.index_type,
+                num_partitions=args.num_partitions, num_sub_vectors=args.num_sub_vectors)
+    print(f"Индекс {args.index_type} для {args.table} построен ({table.count_rows()} строк)")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
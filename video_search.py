@@ -0,0 +1,73 @@
+import os
+import re
+from embedding_cache import LRUCache, normalize_query
+from lexical_search import tokenize
+
+# Подбор видео без агента: один запрос к поисковому инструменту,
+# детерминированный отбор ссылок на YouTube и ранжирование по совпадению с темой.
+# Результаты кешируются по нормализованной теме.
+
+# direct - прямой поиск с агентом как запасным вариантом, agent - только агент
+VIDEO_SEARCH_MODE = os.getenv("VIDEO_SEARCH_MODE", "direct")
+VIDEO_AGENT_FALLBACK = os.getenv("VIDEO_AGENT_FALLBACK", "1") == "1"
+VIDEO_SEARCH_RESULTS = int(os.getenv("VIDEO_SEARCH_RESULTS", "10"))
+VIDEO_LIMIT = 3
+VIDEO_CACHE_TTL = float(os.getenv("VIDEO_CACHE_TTL", str(24 * 3600)))
+VIDEO_CACHE_SIZE = int(os.getenv("VIDEO_CACHE_SIZE", "1024"))
+VIDEO_DOMAINS = ["youtube.com", "youtu.be"]
+
+# watch?v=ID, youtu.be/ID, shorts/ID, embed/ID -> идентификатор ролика
+_VIDEO_ID = re.compile(
+    r"https?://(?:www\.|m\.)?(?:youtube\.com/(?:watch\?(?:[^\s#]*&)?v=|shorts/|embed/)|youtu\.be/)([\w-]{11})"
+)
+# Короткие ролики (shorts) редко подходят для объяснения темы и ранжируются ниже
+_SHORTS = re.compile(r"youtube\.com/shorts/")
+EDUCATIONAL_WORDS = set(tokenize("урок лекция курс туториал объяснение разбор основы для начинающих tutorial lecture course"))
+
+video_cache = LRUCache(max_items=VIDEO_CACHE_SIZE, ttl=VIDEO_CACHE_TTL)
+
+
+def video_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def video_query(topic):
+    return f"{topic} обучающее видео"
+
+
+def youtube_links(text):
+    return list(dict.fromkeys(video_url(m.group(1)) for m in _VIDEO_ID.finditer(text)))
+
+
+def _score(topic_terms, result, position):
+    text_terms = set(tokenize(f"{result.get('title', '')} {result.get('content', '')}"))
+    coverage = sum(1 for t in topic_terms if t in text_terms) / len(topic_terms) if topic_terms else 0.0
+    educational = 0.2 if text_terms & EDUCATIONAL_WORDS else 0.0
+    shorts = -0.3 if _SHORTS.search(result.get("url", "")) else 0.0
+    # Оценка поисковика и исходная позиция учитываются, но слабее совпадения с темой
+    relevance = float(result.get("score") or 0.0)
+    return coverage + educational + shorts + 0.5 * relevance - 0.01 * position
+
+
+# results - выдача TavilySearchResults: список словарей с url, title, content, score
+def rank_videos(topic, results, limit=VIDEO_LIMIT):
+    if not isinstance(results, list):
+        return []
+    topic_terms = list(dict.fromkeys(tokenize(topic)))
+    best = {}
+    for position, result in enumerate(results):
+        if not isinstance(result, dict):
+            continue
+        match = _VIDEO_ID.search(result.get("url", ""))
+        if match is None:
+            continue
+        score = _score(topic_terms, result, position)
+        video_id = match.group(1)
+        if video_id not in best or score > best[video_id]:
+            best[video_id] = score
+    ranked = sorted(best, key=lambda video_id: best[video_id], reverse=True)
+    return [video_url(video_id) for video_id in ranked[:limit]]
+
+
+def cache_key(topic):
+    return normalize_query(topic)
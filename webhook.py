@@ -0,0 +1,134 @@
+import os
+import json
+import signal
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot import types
+
+# Режим webhook: HTTP-сервер принимает обновления Telegram, сразу отвечает 200
+# и передаёт обновление в пул обработчиков (dispatcher.KeyedExecutor).
+# Повторные доставки отбрасываются по update_id, при остановке принятые
+# обновления дообрабатываются.
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://bot.example.com/telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+DEDUP_WINDOW = int(os.getenv("WEBHOOK_DEDUP_WINDOW", "10000"))
+DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "60"))
+
+
+class UpdateDeduplicator:
+    def __init__(self, window=DEDUP_WINDOW):
+        self.window = window
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    # True, если обновление с таким update_id ещё не встречалось
+    def first_seen(self, update_id):
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._seen[update_id] = None
+            if len(self._seen) > self.window:
+                self._seen.popitem(last=False)
+            return True
+
+
+class WebhookServer:
+    def __init__(self, bot, executor, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                 path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.bot = bot
+        self.executor = executor
+        self.path = path
+        self.secret = secret
+        self.dedup = UpdateDeduplicator()
+        self.received = 0
+        self.duplicates = 0
+        self.httpd = ThreadingHTTPServer((listen, port), self._handler_class())
+        # Запрос подтверждается до постановки в очередь, поэтому при остановке
+        # server_close дожидается потоков запросов (block_on_close)
+        self.httpd.daemon_threads = False
+        self.httpd.block_on_close = True
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_error(404)
+                    return
+                if server.secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != server.secret:
+                    self.send_error(403)
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                # Подтверждаем сразу: Telegram не ждёт окончания обработки
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                server.accept(body)
+
+            def log_message(self, format, *args):
+                logger.debug("%s - %s", self.address_string(), format % args)
+
+        return Handler
+
+    def accept(self, body):
+        try:
+            update = types.Update.de_json(json.loads(body))
+        except Exception:
+            logger.warning("Некорректное обновление от Telegram")
+            return
+        self.received += 1
+        if not self.dedup.first_seen(update.update_id):
+            self.duplicates += 1
+            return
+        # process_new_updates подменён dispatcher.install и только ставит обновление в очередь
+        self.bot.process_new_updates([update])
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    # Прекращаем приём, дожидаемся потоков уже принятых запросов, затем обработки обновлений
+    def shutdown(self, drain_timeout=DRAIN_TIMEOUT):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if not self.executor.drain(timeout=drain_timeout):
+            logger.warning("Не все обновления обработаны за %s с", drain_timeout)
+        self.executor.shutdown(wait=False)
+
+
+def run(bot, executor):
+    server = WebhookServer(bot, executor)
+    if WEBHOOK_URL:
+        bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+
+    # shutdown() блокируется до остановки serve_forever, поэтому вызывается из другого потока
+    stopper = threading.Thread(target=server.shutdown)
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            stopper.start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Webhook-сервер слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    server.serve_forever()
+    if stopping.is_set():
+        stopper.join()
+    else:
+        server.shutdown()
+    return server
@@ -0,0 +1,179 @@
+import os
+import atexit
+import logging
+import threading
+import db_pool
+
+# Отложенная пакетная запись оценок и регистраций пользователей.
+# События накапливаются в памяти (повторные оценки за ту же тему схлопываются)
+# и сбрасываются многострочными INSERT по размеру очереди или по таймеру.
+# Незаписанные оценки видны при чтении через pending_marks().
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = int(os.getenv("WRITE_BEHIND_FLUSH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+ROWS_PER_STATEMENT = 500
+# Строка с ошибкой данных (например, внешний ключ на удалённую тему) отбрасывается после стольких попыток
+MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "3"))
+
+INSERT_USERS = "INSERT IGNORE INTO user (user_id, username) VALUES "
+UPSERT_MARKS_TAIL = " ON DUPLICATE KEY UPDATE mark = VALUES(mark)"
+INSERT_MARKS = "INSERT INTO user_has_topic (user_id, topic_id, mark) VALUES "
+
+
+def _write_rows(prefix, rows, suffix=""):
+    width = len(rows[0])
+    placeholder = "(" + ", ".join(["%s"] * width) + ")"
+    for i in range(0, len(rows), ROWS_PER_STATEMENT):
+        batch = rows[i:i + ROWS_PER_STATEMENT]
+        sql = prefix + ", ".join([placeholder] * len(batch)) + suffix
+        db_pool.execute_sql(sql, [value for row in batch for value in row])
+
+
+# Ошибки данных в строке не исчезают при повторе, в отличие от обрыва соединения или
+# таймаута пула. ProgrammingError (нет таблицы или колонки) - ошибка развёртывания,
+# а не строки: такие события ждут исправления схемы, а не отбрасываются
+def _is_permanent(error):
+    try:
+        from mysql.connector import errors
+    except ImportError:
+        return False
+    return isinstance(error, (errors.IntegrityError, errors.DataError))
+
+
+class WriteBehindQueue:
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._users = {}
+        self._marks = {}
+        # Пакет, который пишется прямо сейчас: тоже должен быть виден читателям
+        self._inflight_marks = {}
+        self._inflight_users = {}
+        # (вид, ключ) -> число неудачных попыток записи строки с ошибкой данных
+        self._attempts = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def add_user(self, user_id, username):
+        with self._lock:
+            self._users.setdefault(user_id, username)
+        self._after_write()
+
+    def set_mark(self, user_id, topic_id, mark):
+        with self._lock:
+            self._marks[(user_id, topic_id)] = mark
+        self._after_write()
+
+    def _after_write(self):
+        if self._thread is None:
+            self.start()
+        if len(self._users) + len(self._marks) >= self.flush_size:
+            self._wakeup.set()
+
+    # Оценки пользователя, ещё не попавшие в базу: {topic_id: mark}
+    def pending_marks(self, user_id):
+        with self._lock:
+            marks = {t: m for (u, t), m in self._inflight_marks.items() if u == user_id}
+            marks.update({t: m for (u, t), m in self._marks.items() if u == user_id})
+            return marks
+
+    # Немедленная запись ожидающей регистрации пользователя - для вставок мимо очереди,
+    # которые ссылаются на user внешним ключом (например, user_has_quiz)
+    def flush_user(self, user_id):
+        with self._lock:
+            username = self._users.get(user_id, self._inflight_users.get(user_id))
+        if username is not None:
+            _write_rows(INSERT_USERS, [(user_id, username)])
+
+    # Пишет события пакетом; если в пакете есть строка с ошибкой данных - по одной,
+    # чтобы она не блокировала остальные. Возвращает события для повторной попытки
+    def _write(self, kind, items, prefix, row, suffix=""):
+        try:
+            _write_rows(prefix, [row(key, value) for key, value in items.items()], suffix)
+            for key in items if self._attempts else ():
+                self._attempts.pop((kind, key), None)
+            return {}
+        except Exception as e:
+            if not _is_permanent(e):
+                logger.warning("Не удалось записать пакет %s (%d строк): %s", kind, len(items), e)
+                return dict(items)
+        retry = {}
+        for key, value in items.items():
+            try:
+                _write_rows(prefix, [row(key, value)], suffix)
+                self._attempts.pop((kind, key), None)
+            except Exception as e:
+                if not _is_permanent(e):
+                    retry[key] = value
+                    continue
+                attempts = self._attempts.pop((kind, key), 0) + 1
+                if attempts >= MAX_ATTEMPTS:
+                    self.dropped += 1
+                    logger.error("Запись %s %s = %r отброшена после %d попыток: %s", kind, key, value, attempts, e)
+                else:
+                    self._attempts[(kind, key)] = attempts
+                    retry[key] = value
+        return retry
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                users, self._users = self._users, {}
+                marks, self._marks = self._marks, {}
+                self._inflight_users = users
+                self._inflight_marks = marks
+            if not users and not marks:
+                return
+            # Пока запись не завершилась, всё считается незаписанным
+            retry_users, retry_marks = users, marks
+            try:
+                # Сначала пользователи: на них ссылается внешний ключ user_has_topic
+                retry_users = self._write("user", users, INSERT_USERS, lambda u, name: (u, name)) if users else {}
+                # Оценки незаписанных пользователей ждут вместе с ними
+                retry_marks = {key: mark for key, mark in marks.items() if key[0] in retry_users}
+                ready = {key: mark for key, mark in marks.items() if key[0] not in retry_users}
+                if ready:
+                    retry_marks.update(self._write(
+                        "user_has_topic", ready, INSERT_MARKS, lambda key, mark: (*key, mark), UPSERT_MARKS_TAIL
+                    ))
+            except Exception:
+                logger.exception("Не удалось записать пакет (%d пользователей, %d оценок)", len(users), len(marks))
+                retry_users, retry_marks = users, marks
+            finally:
+                # Возврат в очередь и сброс пакета "в полёте" - атомарно для читателей
+                # pending_marks/flush_user; более новые события не затираются
+                with self._lock:
+                    for user_id, username in retry_users.items():
+                        self._users.setdefault(user_id, username)
+                    for key, mark in retry_marks.items():
+                        self._marks.setdefault(key, mark)
+                    self._inflight_users = {}
+                    self._inflight_marks = {}
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+write_queue = WriteBehindQueue()